@@ -0,0 +1,225 @@
+# archive.py
+# 庭审档案库：SQLite + FTS5 全文索引，保存话题、模型分配、每轮发言、陪审团意见、判决与耗时
+# 支持按话题/关键词搜索、按话题精确查找（重复的话题直接复用上次的庭审）与分页浏览
+# 写入由后台线程完成，界面线程只负责入队
+# 分支庭审 (branch.py) 只保存分叉点之后新增的发言与投票，读取时沿 parent 拼回继承的部分
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+from config import ARCHIVE_PATH
+
+log = logging.getLogger(__name__)
+
+
+def topic_key(topic):
+    """话题归一化：去掉首尾空白、合并连续空白、忽略大小写"""
+    return re.sub(r"\s+", " ", topic or "").strip().lower()
+
+
+def _search_text(data):
+    """进入全文索引的正文：律师发言、陪审团意见与判决"""
+    parts = [msg["content"] for msg in data.get("transcript") or []]
+    parts += [vote["content"] for vote in data.get("jury") or []]
+    parts.append(data.get("verdict") or "")
+    return "\n".join(parts)
+
+
+class TrialArchive:
+    """线程安全；读取使用独立连接，WAL 模式下不会被后台写入阻塞"""
+
+    def __init__(self, path=ARCHIVE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS trials ("
+            "id TEXT PRIMARY KEY, topic TEXT NOT NULL, topic_key TEXT NOT NULL, created REAL NOT NULL, "
+            "status TEXT NOT NULL, rounds INTEGER, judge_model TEXT, verdict TEXT, total_time REAL, data TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_trials_topic ON trials(topic_key, created)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_trials_created ON trials(created)")
+        # 旧档案库没有分支列，补上
+        for column in ("parent TEXT", "fork TEXT"):
+            try:
+                self._db.execute(f"ALTER TABLE trials ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_trials_parent ON trials(parent)")
+        # trigram 分词对中文有效（默认分词器会把整段中文当作一个词）；SQLite 未编译 FTS5 时退回 LIKE 查询
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS trials_fts USING fts5(id UNINDEXED, topic, body, tokenize='trigram')"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self._db.commit()
+
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        threading.Thread(target=self._writer, name="trial-archive", daemon=True).start()
+
+    # ---------- 写入 ----------
+    def save(self, data):
+        """入队后立即返回，由后台线程写入"""
+        self._queue.put(data)
+
+    def flush(self):
+        """等待已入队的记录全部写入（命令行退出前调用）"""
+        self._queue.join()
+
+    def _writer(self):
+        while True:
+            batch = [self._queue.get()]
+            # 把同时到达的记录合并为一个事务
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    for data in batch:
+                        self._write_one(data)
+                    self._db.commit()
+            except Exception:  # 写入线程不能退出，否则之后的 save() 全部丢失、flush() 永远等待
+                log.exception("档案库写入失败")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_one(self, data):
+        """写入一条记录；失败时只回滚这一条，同一事务中的其他记录照常提交"""
+        self._db.execute("SAVEPOINT record")
+        try:
+            self._write(data)
+        except Exception:
+            self._db.execute("ROLLBACK TO record")
+            log.exception("档案库记录 %s 写入失败", data.get("id") if isinstance(data, dict) else repr(data))
+        finally:
+            self._db.execute("RELEASE record")
+
+    def _write(self, data):
+        data = {**data, "live": {}}
+        fork = data.get("fork")
+        if fork:
+            # 继承自父庭审的发言与投票不重复保存
+            inherited = fork["inherited"]
+            data["transcript"] = data["transcript"][inherited["transcript"]:]
+            if inherited["jury"]:
+                data["jury"], data["poll"] = [], None
+            data["fork"] = {**fork, "delta": True}
+        self._db.execute(
+            "INSERT OR REPLACE INTO trials (id, topic, topic_key, created, status, rounds, judge_model, verdict, "
+            "total_time, parent, fork, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (data["id"], data["topic"], topic_key(data["topic"]), data["created"], data["status"], data["rounds"],
+             data["models"]["judge"], data["verdict"], data["timings"].get("total"),
+             fork and fork["parent"], fork and json.dumps(fork, ensure_ascii=False),
+             json.dumps(data, ensure_ascii=False))
+        )
+        if self.fts:
+            self._db.execute("DELETE FROM trials_fts WHERE id = ?", (data["id"],))
+            self._db.execute("INSERT INTO trials_fts (id, topic, body) VALUES (?, ?, ?)",
+                             (data["id"], data["topic"], _search_text(data)))
+
+    # ---------- 读取 ----------
+    def _reader(self):
+        # 每个线程一个只读连接，避免与写入线程争用同一个连接的锁
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path)
+        return conn
+
+    def _inflate(self, data):
+        """分支记录拼回父庭审（可能也是分支）继承的发言与投票"""
+        fork = data.get("fork")
+        if not (fork and fork.get("delta")):
+            return data
+        parent = self.load(fork["parent"])
+        if parent is None:
+            return data  # 父庭审已不在档案库中，只能返回分支自己的部分
+        inherited = fork["inherited"]
+        data["transcript"] = parent["transcript"][:inherited["transcript"]] + data["transcript"]
+        if inherited["jury"]:
+            data["jury"], data["poll"] = parent["jury"], parent.get("poll")
+        data["fork"] = {key: value for key, value in fork.items() if key != "delta"}
+        return data
+
+    def load(self, trial_id):
+        row = self._reader().execute("SELECT data FROM trials WHERE id = ?", (trial_id,)).fetchone()
+        return self._inflate(json.loads(row[0])) if row else None
+
+    def find_topic(self, topic):
+        """同一话题最近一场已完成的庭审，没有时返回 None"""
+        row = self._reader().execute(
+            "SELECT data FROM trials WHERE topic_key = ? AND status = 'done' ORDER BY created DESC LIMIT 1",
+            (topic_key(topic),)
+        ).fetchone()
+        return self._inflate(json.loads(row[0])) if row else None
+
+    def family(self, trial_id):
+        """某场庭审所在的整棵分支树（从最初的庭审起），返回摘要列表"""
+        conn = self._reader()
+        root, seen = trial_id, {trial_id}
+        while True:
+            row = conn.execute("SELECT parent FROM trials WHERE id = ?", (root,)).fetchone()
+            if not row or not row[0] or row[0] in seen:
+                break
+            root = row[0]
+            seen.add(root)
+        rows = conn.execute(
+            "WITH RECURSIVE tree(id) AS (SELECT ? UNION SELECT trials.id FROM trials JOIN tree ON trials.parent = tree.id) "
+            "SELECT id, parent, created, status, judge_model, verdict, fork FROM trials WHERE id IN tree "
+            "ORDER BY created",
+            (root,)
+        ).fetchall()
+        keys = ("id", "parent", "created", "status", "judge_model", "verdict", "fork")
+        return [{**dict(zip(keys, row)), "fork": json.loads(row[6]) if row[6] else None} for row in rows]
+
+    def _where(self, query):
+        query = (query or "").strip()
+        if not query:
+            return "", ()
+        # trigram 至少需要 3 个字符，更短的关键词用 LIKE
+        if self.fts and len(query) >= 3:
+            return ("WHERE id IN (SELECT id FROM trials_fts WHERE trials_fts MATCH ?)",
+                    ('"' + query.replace('"', '""') + '"',))
+        like = f"%{query}%"
+        return "WHERE topic LIKE ? OR verdict LIKE ? OR data LIKE ?", (like, like, like)
+
+    def search(self, query="", limit=10, offset=0):
+        """按话题或关键词搜索，最新的在前；query 为空时列出全部。返回摘要列表（不含完整记录）"""
+        where, params = self._where(query)
+        rows = self._reader().execute(
+            f"SELECT id, topic, created, status, judge_model, total_time FROM trials {where} "
+            f"ORDER BY created DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset)
+        ).fetchall()
+        keys = ("id", "topic", "created", "status", "judge_model", "total_time")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def count(self, query=""):
+        where, params = self._where(query)
+        return self._reader().execute(f"SELECT COUNT(*) FROM trials {where}", params).fetchone()[0]
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """进程级档案库单例；CYBERGAVEL_ARCHIVE 置空时返回 None"""
+    global _archive
+    if not ARCHIVE_PATH:
+        return None
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = TrialArchive()
+    return _archive
@@ -0,0 +1,293 @@
+# async_court.py
+# asyncio 庭审引擎：基于 AsyncOpenAI，进程内一个事件循环线程驱动所有庭审，不再为每次调用占用一个线程
+# - 总时限与分阶段预算：辩论超时以已完成的发言继续，陪审团超时未作答者视为弃权
+# - 随时取消（停止按钮、浏览器会话结束），进行中的请求随之中断，不再继续计费
+# 提示词拼装与结果记录沿用 court.Trial，页面仍按 to_dict() 快照轮询重绘
+import asyncio
+import threading
+import time
+from court import Trial
+from cache import should_cache
+from resilience import DeadlineExceeded
+from utils import aget_ai_response, astream_ai_response, is_error
+from config import TRIAL_DEADLINE, PHASE_BUDGETS, ORPHAN_GRACE
+
+ABSTAIN_TEXT = "（未在时限内作答，视为弃权）"
+# 检查发起庭审的会话是否还在的间隔（秒）
+_REAPER_INTERVAL = 5.0
+
+_loop = None
+_loop_lock = threading.Lock()
+_running = set()  # 进行中的 AsyncTrial，供回收任务检查
+
+
+def get_loop():
+    """进程级事件循环，在后台线程中运行；首次调用时启动"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="trial-loop", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(_reap_orphans(), loop)
+                _loop = loop
+    return _loop
+
+
+async def _reap_orphans():
+    """发起方已离开（alive() 持续返回 False 超过 ORPHAN_GRACE 秒）的庭审自动取消"""
+    while True:
+        await asyncio.sleep(_REAPER_INTERVAL)
+        now = time.monotonic()
+        for trial in list(_running):
+            if trial.alive is None:
+                continue
+            try:
+                alive = trial.alive()
+            except Exception:
+                alive = True
+            if alive:
+                trial._orphaned_at = None
+            elif trial._orphaned_at is None:
+                trial._orphaned_at = now
+            elif now - trial._orphaned_at >= ORPHAN_GRACE:
+                trial.cancel("发起庭审的页面已关闭，庭审已自动停止")
+
+
+class AsyncTrial(Trial):
+    """
+    与 Trial 接口一致（start / run / to_dict），另外支持 cancel()
+    deadline: 整场庭审的总时限（秒），0 或 None 表示不限
+    budgets: 覆盖 config.PHASE_BUDGETS 中的分阶段预算
+    """
+
+    def __init__(self, *args, deadline=TRIAL_DEADLINE, budgets=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deadline = deadline or None
+        self.budgets = {phase: budget or None for phase, budget in {**PHASE_BUDGETS, **(budgets or {})}.items()}
+        self.notes = []  # 预算触发的降级说明，展示在页面上
+        self.alive = None  # 可选：返回发起方是否仍在线的函数，见 _reap_orphans
+        self._orphaned_at = None
+        self._task = None
+        self._cancel_requested = False
+        self._cancel_reason = None
+        self._on_finish = None
+        self._extract_tasks = {}  # 轮次 -> 书记员整理该轮要点的 Task（分段归纳判决）
+
+    # ---------- 调用 ----------
+    async def _acall(self, role, system_prompt, user_content, model_conf, persona=None):
+        stats = {}
+        use_cache = should_cache(role) and role not in self.cache_bypass
+        start = time.perf_counter()
+        try:
+            if self.stream and role not in ("jury", "poll", "clerk"):
+                def on_delta(delta):
+                    self.live[role] = self.live.get(role, "") + delta
+
+                content = await astream_ai_response(system_prompt, user_content, model_conf, on_delta, stats,
+                                                    use_cache, role, self.id)
+            else:
+                content = await aget_ai_response(system_prompt, user_content, model_conf, use_cache, stats, role,
+                                                 self.id)
+                stats["total"] = time.perf_counter() - start
+        except asyncio.CancelledError:
+            # 被取消的调用同样记录下来（已产生的费用无法从 usage 得知）
+            stats.setdefault("total", time.perf_counter() - start)
+            self._record_call(role, persona, model_conf, start, stats, True)
+            raise
+        finally:
+            self.live.pop(role, None)
+        self._record_call(role, persona, model_conf, start, stats, is_error(content))
+        return content, stats
+
+    # ---------- 各阶段 ----------
+    async def aspeak(self, role, round_idx):
+        system, prompt = self._speak_prompt(role, round_idx)
+        content, stats = await self._acall(role, system, prompt, self.configs[role])
+        self._spoke(role, round_idx, content, stats)
+        if role == "defendant" and self._reacts_after(round_idx):
+            for persona in self.personas:
+                self.reactions.setdefault(persona['id'], []).append(
+                    asyncio.ensure_future(self._areact(persona, round_idx))
+                )
+        if role == "defendant" and self.map_reduce:
+            self._extract_tasks[round_idx] = asyncio.ensure_future(self._aextract(round_idx))
+        return content
+
+    async def _areact(self, persona, round_idx):
+        system, prompt = self._react_prompt(persona, round_idx)
+        content, _ = await self._acall("jury", system, prompt, self.configs["jury"][persona['id']], persona['id'])
+        return None if is_error(content) else content
+
+    async def adebate(self):
+        self.phase = "debate"
+        start = time.perf_counter()
+
+        async def rounds():
+            for i in range(self.start_round, self.rounds):
+                await self.aspeak("plaintiff", i)
+                await self.aspeak("defendant", i)
+
+        try:
+            await asyncio.wait_for(rounds(), self.budgets.get("debate"))
+        except asyncio.TimeoutError:
+            if not self.messages:
+                raise DeadlineExceeded("辩论阶段超时，没有任何发言")
+            self.notes.append(f"辩论超过 {self.budgets['debate']:.0f}s 预算，以已完成的 {len(self.messages)} 段发言进入合议")
+        self.timings["debate"] = time.perf_counter() - start
+
+    async def _avote(self, persona):
+        tasks = self.reactions.get(persona['id']) or []
+        if tasks:
+            await asyncio.wait(tasks)
+        reactions = [None if task.cancelled() or task.exception() else task.result() for task in tasks]
+        system, prompt = self._vote_prompt(persona, reactions)
+        content, stats = await self._acall(self.jury_role, system, prompt, self.configs["jury"][persona['id']], persona['id'])
+        return self._ballot(persona, reactions, content, stats)
+
+    def _abstain(self, persona):
+        vote = self._ballot(persona, [], ABSTAIN_TEXT, {})
+        vote["abstained"] = True
+        return vote
+
+    async def adeliberate(self):
+        """陪审员并发作答；超过预算仍未作答的取消请求，按弃权处理"""
+        self.phase = "jury"
+        start = time.perf_counter()
+        tasks = {asyncio.ensure_future(self._avote(persona)): idx for idx, persona in enumerate(self.personas)}
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=self.budgets.get("jury"))
+        finally:
+            # 超过预算或整场庭审被取消：中断仍在进行的请求
+            for task in tasks:
+                task.cancel()
+        if pending:
+            await asyncio.wait(pending)  # 等取消完成，被取消的调用已记录
+            self.notes.append(f"陪审团超过 {self.budgets['jury']:.0f}s 预算，{len(pending)} 位陪审员未作答，视为弃权")
+        for task, idx in tasks.items():
+            persona = self.personas[idx]
+            self.jury[idx] = task.result() if task in done else self._abstain(persona)
+        self._tally()
+        self.timings["jury"] = time.perf_counter() - start
+
+    async def _aextract(self, key):
+        system, prompt = self._clerk_prompt(key)
+        content, _ = await self._acall("clerk", system, prompt, self.clerk_config)
+        return self._extracted(key, content)
+
+    async def _amap(self):
+        """与 Trial._map 相同：等待各轮要点、补上缺失的轮次，并发整理陪审团意见，超出预算时合并较早的轮次"""
+        start = time.perf_counter()
+
+        async def rounds():
+            await asyncio.gather(*[self._extract_tasks.get(i) or asyncio.ensure_future(self._aextract(i))
+                                   for i in self._debated_rounds() if i not in self.extracts["rounds"]])
+            if self._needs_merge():
+                await self._aextract("merged")
+
+        tasks = [asyncio.ensure_future(rounds())]
+        if self.poll:
+            self.extracts["jury"] = "\n".join(self.jury_opinions)
+        elif self.extracts["jury"] is None:
+            tasks.append(asyncio.ensure_future(self._aextract("jury")))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.timings["map"] = time.perf_counter() - start
+
+    async def ajudge(self):
+        self.phase = "judge"
+        start = time.perf_counter()
+
+        async def verdict():
+            # 书记员整理要点与法官判决共用法官阶段的预算
+            if self.map_reduce:
+                await self._amap()
+            system, prompt = self._judge_prompt()
+            return await self._acall("judge", system, prompt, self.configs["judge"])
+
+        try:
+            self.verdict, self.judge_timing = await asyncio.wait_for(verdict(), self.budgets.get("judge"))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"法官未能在 {self.budgets['judge']:.0f}s 预算内作出判决")
+        self.timings["judge"] = time.perf_counter() - start
+        return self.verdict
+
+    def _cancel_reactions(self):
+        for tasks in self.reactions.values():
+            for task in tasks:
+                task.cancel()
+        for task in self._extract_tasks.values():
+            task.cancel()
+
+    async def arun(self):
+        """完整运行一场庭审；错误与取消记录在 status / error 中，不向外抛出"""
+        self.status = "running"
+        self._task = asyncio.current_task()
+        _running.add(self)
+        start = time.perf_counter()
+
+        async def phases():
+            if self._cancel_requested:  # 尚未开始就被取消
+                raise asyncio.CancelledError
+            await self.adebate()
+            if not self.reuse_jury:
+                await self.adeliberate()
+            await self.ajudge()
+
+        try:
+            await asyncio.wait_for(phases(), self.deadline)
+            self.status = "done"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            self.error = self._cancel_reason or "庭审已停止"
+        except DeadlineExceeded as e:
+            self.status = "error"
+            self.error = str(e)
+        except asyncio.TimeoutError:
+            self.status = "error"
+            self.error = f"庭审超过 {self.deadline:.0f}s 总时限"
+        except Exception as e:
+            self.status = "error"
+            self.error = str(e)
+        finally:
+            self._cancel_reactions()
+            self.timings["total"] = time.perf_counter() - start
+            _running.discard(self)
+            if self._on_finish:
+                self._on_finish(self)
+        return self
+
+    # ---------- 与 Trial 一致的入口 ----------
+    def start(self, concurrent_jury=True, on_finish=None):
+        """
+        在共享的事件循环中运行庭审并立即返回 concurrent.futures.Future
+        concurrent_jury 仅为接口兼容：asyncio 引擎中陪审员总是并发作答
+        on_finish(trial): 结束（包括出错、取消）后在事件循环线程中回调
+        """
+        self.status = "running"
+        self._on_finish = on_finish
+        return asyncio.run_coroutine_threadsafe(self.arun(), get_loop())
+
+    def run(self, concurrent_jury=True):
+        """阻塞运行（命令行与压测使用）；出错时与 Trial.run 一样抛出异常"""
+        self.start(concurrent_jury).result()
+        if self.status != "done":
+            raise RuntimeError(self.error)
+        return self
+
+    def cancel(self, reason=None):
+        """线程安全：取消庭审，进行中的请求随之中断"""
+        if self.status != "running":
+            return
+        self._cancel_reason = reason
+        self._cancel_requested = True
+        if self._task is not None:
+            get_loop().call_soon_threadsafe(self._task.cancel)
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["notes"] = list(self.notes)
+        return data
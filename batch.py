@@ -0,0 +1,153 @@
+# batch.py
+# 命令行批量庭审：无需打开浏览器，一次并发跑完一批话题，结果逐行写入 JSONL
+#
+# 用法示例:
+#   python batch.py topics.txt -o results.jsonl --judge DeepSeek-Chat --jury "Qwen-Turbo " --workers 4
+#   python batch.py topics.txt --judge auto --jury auto   # 自动路由：每场开庭前按近期表现分配模型
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from court import Trial, build_configs
+from async_court import AsyncTrial
+from archive import get_archive
+from jury_poll import sample_jurors
+from prompts import JURY_PERSONAS
+from router import route, needs_routing, describe
+from config import AVAILABLE_MODELS, AUTO_MODEL
+
+model_names = list(AVAILABLE_MODELS.keys())
+# 命令行中用 auto 表示自动路由
+model_choices = model_names + ["auto"]
+
+
+def model_arg(name):
+    return AUTO_MODEL if name == "auto" else name
+
+
+def load_topics(path):
+    """读取话题文件：每行一个话题；.jsonl 文件则读取每行的 "topic" 字段"""
+    topics = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            topics.append(json.loads(line)["topic"] if path.endswith(".jsonl") else line)
+    return topics
+
+
+def check_keys(configs):
+    """启动前检查所有角色的 API Key，避免跑到一半才发现缺 Key（自动路由的角色开庭时只在有 Key 的模型中分配）"""
+    confs = [configs["judge"], configs["plaintiff"], configs["defendant"], *configs["jury"].values()]
+    confs = [conf for conf in confs if conf is not None]
+    missing = sorted({conf["env_key_name"] for conf in confs if not conf.get("api_key")})
+    if missing:
+        raise ValueError(f"⚠️ 缺少 API Key，请在 .env 文件中检查: {', '.join(missing)}")
+
+
+def run_one(topic, configs, rounds, concurrent_jury, pipelined_jury=False, archive=None, reuse=False,
+            async_engine=False, poll_size=0, map_reduce=False):
+    """
+    reuse 为 True 时，档案库中已审过的话题直接返回上次的结果（带 "reused": true）
+    async_engine 为 True 时使用 async_court.AsyncTrial（受 CYBERGAVEL_TRIAL_DEADLINE 等时限约束）
+    poll_size 大于 0 时使用民调陪审团：抽样 poll_size 名陪审员，共用 configs 中的陪审团模型
+    configs 中选了自动路由的角色在每场开庭前分配，前面几场的调用统计会影响后面的分配
+    map_reduce 为 True 时分段归纳判决：书记员整理各轮要点，法官只读要点
+    """
+    if reuse and archive is not None:
+        previous = archive.find_topic(topic)
+        if previous is not None:
+            return {**previous, "reused": True}
+    personas = JURY_PERSONAS
+    if poll_size:
+        personas = sample_jurors(poll_size)
+        jury_conf = next(iter(configs["jury"].values()))
+        configs = {**configs, "jury": {persona['id']: jury_conf for persona in personas}}
+    trial = (AsyncTrial if async_engine else Trial)(topic, configs, rounds, personas=personas)
+    trial.poll = bool(poll_size)
+    trial.jury_pipeline = pipelined_jury
+    trial.map_reduce = map_reduce
+    try:
+        if needs_routing(configs):
+            trial.configs, trial.routing = route(configs, rounds, poll=bool(poll_size), jury_pipeline=pipelined_jury)
+        trial.run(concurrent_jury=concurrent_jury)
+    except Exception as e:
+        # 单场失败不影响整批；开庭前就失败（如没有可分配的模型）时在这里记下错误
+        if trial.status != "error":
+            trial.status, trial.error = "error", str(e)
+    result = trial.to_dict()
+    if archive is not None:
+        archive.save(result)
+    return result
+
+
+def run_batch(topics, configs, rounds=2, workers=4, concurrent_jury=True, out=sys.stdout, on_done=None,
+              pipelined_jury=False, archive=None, reuse=False, async_engine=False, poll_size=0, map_reduce=False):
+    """并发运行一批庭审，每完成一场立即写入一行 JSON"""
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, topic, configs, rounds, concurrent_jury, pipelined_jury, archive, reuse,
+                               async_engine, poll_size, map_reduce)
+                   for topic in topics]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            with lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+            if on_done:
+                on_done(done, len(topics), result)
+    if archive is not None:
+        archive.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CyberGavel 命令行批量庭审")
+    parser.add_argument("topics", help="话题文件 (每行一个话题，或含 topic 字段的 .jsonl)")
+    parser.add_argument("-o", "--output", default="-", help="输出 JSONL 路径，默认输出到 stdout")
+    parser.add_argument("--judge", default=model_names[0], choices=model_choices, help="法官模型，auto 为自动路由")
+    parser.add_argument("--plaintiff", default=model_names[1], choices=model_choices, help="原告模型")
+    parser.add_argument("--defendant", default=model_names[1], choices=model_choices, help="被告模型")
+    parser.add_argument("--jury", default=model_names[2], choices=model_choices, help="陪审团模型 (所有陪审员共用)")
+    parser.add_argument("--rounds", type=int, default=2, help="辩论回合数")
+    parser.add_argument("--workers", type=int, default=4, help="同时进行的庭审数量")
+    parser.add_argument("--sequential-jury", action="store_true", help="陪审团逐个发言而不是并发合议")
+    parser.add_argument("--pipelined-jury", action="store_true", help="陪审团逐轮旁听，与辩论重叠进行")
+    parser.add_argument("--reuse", action="store_true", help="档案库中已审过的话题直接复用上次的结果")
+    parser.add_argument("--poll", type=int, default=0, metavar="N", help="民调陪审团：抽样 N 名陪审员给出结构化投票")
+    parser.add_argument("--async-engine", action="store_true", help="使用 asyncio 庭审引擎，受总时限与分阶段预算约束")
+    parser.add_argument("--map-reduce", action="store_true", help="分段归纳判决：书记员整理各轮要点，法官只读要点")
+    args = parser.parse_args(argv)
+
+    try:
+        configs = build_configs(model_arg(args.judge), model_arg(args.plaintiff), model_arg(args.defendant),
+                                model_arg(args.jury))
+        check_keys(configs)
+    except ValueError as e:
+        parser.error(str(e))
+
+    topics = load_topics(args.topics)
+    start = time.perf_counter()
+
+    def on_done(done, total, result):
+        flag = "♻️" if result.get("reused") else ("❌" if result["status"] == "error" else "✅")
+        print(f"[{done}/{total}] {flag} {result['topic']} ({result['timings'].get('total', 0):.1f}s)", file=sys.stderr)
+        if result.get("routing"):
+            print(f"    🤖 {describe(result['routing'])}", file=sys.stderr)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+    try:
+        run_batch(topics, configs, args.rounds, args.workers, not args.sequential_jury, out, on_done,
+                  pipelined_jury=args.pipelined_jury, archive=get_archive(), reuse=args.reuse,
+                  async_engine=args.async_engine, poll_size=args.poll, map_reduce=args.map_reduce)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"全部完成：{len(topics)} 场庭审，用时 {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,428 @@
+# bench/load_test.py
+# 多会话压测：启动本地模拟服务与一个真实的 `streamlit run main.py` 服务进程，
+# 用 websocket 客户端模拟多个浏览器会话同时操作页面（切换侧边栏模型、改话题、开庭、等待轮询、下载判决书）
+# 按会话数逐级加压，报告每级的 rerun 延迟分位数、服务进程 RSS（每会话增量）与庭审吞吐，并估算吞吐上限
+#
+# 模拟会话按浏览器的协议工作：每次交互发送一条 rerun 请求（带上改过的控件值与按钮触发），
+# 读到 script_finished 为止计为一次 rerun 的耗时；庭审进行中按服务端下发的 auto_rerun 间隔轮询片段
+#
+# 用法 (需要额外安装 websockets: pip install -r bench/requirements.txt):
+#   python bench/load_test.py --sessions 1 5 10 20 --duration 30
+#   python bench/load_test.py --sessions 10 20 40 --env CYBERGAVEL_MAX_TRIALS=8 --slo 1.5 --out load.json
+#   python bench/load_test.py --url http://127.0.0.1:8501 --pid 12345   # 压测已在运行的服务（不启动模拟服务）
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_server  # noqa: E402
+from run_bench import TOPICS, percentile  # noqa: E402
+
+# 页面上的控件标签（与 main.py 保持一致）
+MODEL_WIDGETS = ["👨‍⚖️ 法官模型", "🦁 原告模型", "🦈 被告模型"]
+ROUNDS_WIDGET = "🗣️ 辩论回合数"
+TOPIC_WIDGET = "📝 输入案件争议焦点："
+START_BUTTON = "🔥 开庭审理"
+DOWNLOAD_BUTTON = "📥 导出判决书 (HTML)"
+ACTIONS = ["load", "sidebar", "start", "poll", "download"]
+
+
+class Stats:
+    """同一级压力下所有会话共用的统计"""
+
+    def __init__(self):
+        self.latency = {action: [] for action in ACTIONS}
+        self.fetch = []  # 下载判决书文件的 HTTP 耗时
+        self.trial_times = []
+        self.rejected = 0  # 任务队列已满
+        self.failed = 0  # 庭审结束但没有判决书（出错或被取消）
+        self.exceptions = []
+        self.disconnects = 0
+
+    def record(self, action, seconds):
+        self.latency[action].append(seconds)
+
+
+class Session:
+    """一个模拟的浏览器会话"""
+
+    def __init__(self, base_url):
+        self.http = base_url.rstrip("/")
+        self.ws_url = "ws" + self.http[4:] + "/_stcore/stream"
+        self.ws = None
+        self.query_string = ""
+        self.widgets = {}  # 标签 -> (元素类型, proto)
+        self.states = {}  # 控件 id -> WidgetState，用户改过的值，每次 rerun 都带上（与浏览器一致）
+        self.auto_rerun = None  # (间隔秒数, fragment_id)，庭审进行中由服务端下发
+        self.alerts = []
+        self.exceptions = []
+
+    async def connect(self):
+        import websockets
+        self.ws = await websockets.connect(self.ws_url, max_size=None)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def rerun(self, trigger=None, fragment_id=None):
+        """发送一次 rerun，等到本次执行结束；返回耗时（秒）"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        msg = BackMsg()
+        request = msg.rerun_script
+        request.query_string = self.query_string
+        request.widget_states.widgets.extend(self.states.values())
+        if trigger is not None:
+            state = request.widget_states.widgets.add()
+            state.id = trigger
+            state.trigger_value = True
+        if fragment_id:
+            request.fragment_id = fragment_id
+            request.is_auto_rerun = True
+        else:
+            # 整页重绘：页面元素与轮询设置都以本次执行为准
+            self.widgets, self.alerts, self.auto_rerun = {}, [], None
+        start = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        await self._read()
+        return time.perf_counter() - start
+
+    async def _read(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        while True:
+            fm = ForwardMsg()
+            fm.ParseFromString(await self.ws.recv())
+            kind = fm.WhichOneof("type")
+            if kind == "delta" and fm.delta.WhichOneof("type") == "new_element":
+                self._element(fm.delta.new_element)
+            elif kind == "auto_rerun":
+                self.auto_rerun = (fm.auto_rerun.interval, fm.auto_rerun.fragment_id)
+            elif kind == "stop_auto_rerun":
+                self.auto_rerun = None
+            elif kind == "page_info_changed":
+                self.query_string = fm.page_info_changed.query_string
+            elif kind == "script_finished":
+                if fm.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    # 片段中调用了 st.rerun()：服务端紧接着整页重绘，继续读到它结束
+                    self.widgets, self.alerts, self.auto_rerun = {}, [], None
+                    continue
+                return
+
+    def _element(self, element):
+        kind = element.WhichOneof("type")
+        proto = getattr(element, kind)
+        if kind == "alert":
+            self.alerts.append(proto.body)
+        elif kind == "exception":
+            self.exceptions.append(proto.message)
+        elif getattr(proto, "id", "") and getattr(proto, "label", ""):
+            self.widgets[proto.label] = (kind, proto)
+
+    def set_value(self, label, value):
+        """修改控件的值（下一次 rerun 时生效）"""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        kind, proto = self.widgets[label]
+        state = WidgetState(id=proto.id)
+        if kind == "slider":
+            state.double_array_value.data[:] = [value]
+        elif kind == "checkbox":
+            state.bool_value = value
+        else:  # selectbox 传选项的显示文本，text_input 传字符串
+            state.string_value = value
+        self.states[proto.id] = state
+
+    async def click(self, label):
+        return await self.rerun(trigger=self.widgets[label][1].id)
+
+    def download_url(self):
+        return self.http + self.widgets[DOWNLOAD_BUTTON][1].url
+
+
+def fetch(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+
+async def user(base_url, args, deadline, stats, rng):
+    """一个用户的操作脚本：反复 换模型 → 改话题 → 开庭 → 等判决 → 下载，直到本级时长用完（至少一遍）"""
+
+    async def think():
+        await asyncio.sleep(args.think * rng.uniform(0.5, 1.5))
+
+    session = Session(base_url)
+    try:
+        await session.connect()
+        stats.record("load", await session.rerun())
+        session.set_value(ROUNDS_WIDGET, args.rounds)
+        stats.record("sidebar", await session.rerun())
+        iterations = 0
+        while not iterations or time.monotonic() < deadline:
+            iterations += 1
+            await think()
+            label = rng.choice(MODEL_WIDGETS)
+            session.set_value(label, rng.choice(session.widgets[label][1].options))
+            stats.record("sidebar", await session.rerun())
+            session.set_value(TOPIC_WIDGET, rng.choice(TOPICS))
+            stats.record("sidebar", await session.rerun())
+            await think()
+
+            started = time.monotonic()
+            stats.record("start", await session.click(START_BUTTON))
+            if any(alert.startswith("🚦") for alert in session.alerts):
+                stats.rejected += 1
+                continue
+            # 庭审进行中：按服务端下发的间隔轮询片段，庭审结束后片段触发整页重绘、轮询停止
+            while session.auto_rerun is not None:
+                interval, fragment_id = session.auto_rerun
+                await asyncio.sleep(interval)
+                stats.record("poll", await session.rerun(fragment_id=fragment_id))
+            if DOWNLOAD_BUTTON not in session.widgets:
+                stats.failed += 1
+                continue
+            stats.trial_times.append(time.monotonic() - started)
+            await think()
+            url = session.download_url()
+            stats.record("download", await session.click(DOWNLOAD_BUTTON))
+            stats.fetch.append(await asyncio.to_thread(fetch, url))
+    except Exception as e:
+        stats.disconnects += 1
+        print(f"[load] 会话异常退出: {type(e).__name__}: {e}")
+    finally:
+        stats.exceptions += session.exceptions
+        await session.close()
+
+
+def read_rss(pid):
+    """进程当前 RSS (MB)；没有 /proc 时返回 None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+async def run_level(sessions, base_url, pid, args, seed, duration):
+    stats = Stats()
+    baseline = read_rss(pid) if pid else None
+    peak = baseline
+    done = asyncio.Event()
+
+    async def sample():
+        nonlocal peak
+        while not done.is_set():
+            rss = read_rss(pid) if pid else None
+            if rss is not None:
+                peak = max(peak or 0.0, rss)
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample())
+    start = time.monotonic()
+    deadline = start + duration
+    # 会话错开启动，避免所有用户在同一瞬间加载页面
+    users = []
+    for i in range(sessions):
+        users.append(asyncio.create_task(user(base_url, args, deadline, stats, random.Random(seed + i))))
+        await asyncio.sleep(args.ramp / max(sessions, 1))
+    await asyncio.gather(*users)
+    wall = time.monotonic() - start
+    done.set()
+    await sampler
+
+    reruns = [t for action in ACTIONS for t in stats.latency[action]]
+    return {
+        "sessions": sessions,
+        "wall": wall,
+        "reruns": len(reruns),
+        "rerun_p50": percentile(reruns, 0.5),
+        "rerun_p95": percentile(reruns, 0.95),
+        "rerun_p99": percentile(reruns, 0.99),
+        "action_p95": {action: percentile(stats.latency[action], 0.95) for action in ACTIONS},
+        "fetch_p95": percentile(stats.fetch, 0.95),
+        "trials": len(stats.trial_times),
+        "trials_per_min": len(stats.trial_times) / wall * 60,
+        "trial_p50": percentile(stats.trial_times, 0.5),
+        "rejected": stats.rejected,
+        "failed": stats.failed,
+        "disconnects": stats.disconnects,
+        "exceptions": sorted(set(stats.exceptions)),
+        "rss_baseline_mb": baseline,
+        "rss_peak_mb": peak,
+        "rss_per_session_mb": (peak - baseline) / sessions if baseline is not None else None,
+    }
+
+
+def capacity(levels, slo):
+    """吞吐上限：庭审/分钟最高的一级；rerun p95 仍在 SLO 内的最大会话数；吞吐不再随会话数增长的起点"""
+    healthy = [lv for lv in levels if lv["rerun_p95"] <= slo and not lv["exceptions"] and not lv["disconnects"]]
+    saturated = None
+    for prev, cur in zip(levels, levels[1:]):
+        if cur["trials_per_min"] < prev["trials_per_min"] * 1.1:
+            saturated = prev["sessions"]
+            break
+    best = max(levels, key=lambda lv: lv["trials_per_min"])
+    return {
+        "max_trials_per_min": best["trials_per_min"],
+        "at_sessions": best["sessions"],
+        "max_sessions_within_slo": max((lv["sessions"] for lv in healthy), default=0),
+        "saturated_at": saturated,
+        "slo": slo,
+    }
+
+
+def print_report(levels, cap):
+    header = f"{'会话':>6}{'rerun次数':>10}{'p50':>8}{'p95':>8}{'p99':>8}{'开庭p95':>9}{'轮询p95':>9}{'下载p95':>9}" \
+             f"{'庭审/分':>9}{'单场耗时':>9}{'拒绝':>6}{'失败':>6}{'RSS峰值MB':>11}{'每会话MB':>10}"
+    print(header)
+    for lv in levels:
+        a = lv["action_p95"]
+        rss = f"{lv['rss_peak_mb']:>11.0f}" if lv["rss_peak_mb"] is not None else f"{'-':>11}"
+        per = f"{lv['rss_per_session_mb']:>10.1f}" if lv["rss_per_session_mb"] is not None else f"{'-':>10}"
+        print(f"{lv['sessions']:>6}{lv['reruns']:>10}{lv['rerun_p50']:>8.3f}{lv['rerun_p95']:>8.3f}{lv['rerun_p99']:>8.3f}"
+              f"{a['start']:>9.3f}{a['poll']:>9.3f}{a['download']:>9.3f}{lv['trials_per_min']:>9.1f}"
+              f"{lv['trial_p50']:>9.1f}{lv['rejected']:>6}{lv['failed']:>6}{rss}{per}")
+        if lv["exceptions"] or lv["disconnects"]:
+            print(f"    ⚠️ 页面报错 {lv['exceptions'][:3]}，会话异常退出 {lv['disconnects']} 个")
+    print(f"吞吐上限：约 {cap['max_trials_per_min']:.1f} 场/分钟（{cap['at_sessions']} 个会话时）")
+    print(f"rerun p95 ≤ {cap['slo']:g}s 的最大会话数：{cap['max_sessions_within_slo']}")
+    if cap["saturated_at"] is not None:
+        print(f"会话数超过 {cap['saturated_at']} 后吞吐增长不足 10%，已接近饱和（可用 --env CYBERGAVEL_MAX_TRIALS=N 调整并发庭审数）")
+
+
+def wait_ready(base_url, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"streamlit 进程已退出（退出码 {proc.returncode}）")
+        try:
+            with urllib.request.urlopen(base_url + "/_stcore/health", timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError("等待 streamlit 服务启动超时")
+
+
+def pick_port(port):
+    """port 为 None 时选一个空闲端口；指定的端口已被占用时报错（否则会压测到别的服务上）"""
+    with socket.socket() as sock:
+        try:
+            sock.bind(("127.0.0.1", port or 0))
+        except OSError:
+            raise RuntimeError(f"端口 {port} 已被占用")
+        return sock.getsockname()[1]
+
+
+def start_app(args, llm_url, workdir):
+    """以子进程启动 streamlit，所有模型指向模拟服务；档案库写到临时目录"""
+    from config import AVAILABLE_MODELS
+
+    env = dict(os.environ, CYBERGAVEL_BASE_URL=llm_url, CYBERGAVEL_CACHE="0",
+               CYBERGAVEL_ARCHIVE=os.path.join(workdir, "trials.sqlite3"))
+    env.setdefault("CYBERGAVEL_FAILOVER", "0")
+    for conf in AVAILABLE_MODELS.values():
+        env[conf["env_key"]] = "sk-mock"  # 覆盖 .env 中的真实 Key，保证请求不会发往服务商
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    log = open(os.path.join(workdir, "streamlit.log"), "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "main.py", "--server.headless", "true",
+         "--server.port", str(args.port), "--server.fileWatcherType", "none",
+         "--browser.gatherUsageStats", "false"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    return proc, log
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CyberGavel 多会话压测")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10], help="逐级加压的同时在线会话数")
+    parser.add_argument("--duration", type=float, default=30.0, help="每级持续时间（秒），到时后等进行中的庭审结束")
+    parser.add_argument("--ramp", type=float, default=2.0, help="每级内会话逐个启动所用的时间（秒）")
+    parser.add_argument("--think", type=float, default=1.0, help="用户两次操作之间的平均停顿（秒）")
+    parser.add_argument("--rounds", type=int, default=1, help="页面上选择的辩论回合数")
+    parser.add_argument("--cooldown", type=float, default=3.0, help="两级之间的间隔（秒），等服务端回收断开的会话")
+    parser.add_argument("--slo", type=float, default=1.0, help="rerun p95 的目标（秒），用于估算容量")
+    parser.add_argument("--port", type=int, help="启动的 streamlit 服务端口，默认自动选择空闲端口")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="传给 streamlit 服务进程的环境变量，如 CYBERGAVEL_MAX_TRIALS=8，可重复")
+    parser.add_argument("--url", help="压测已在运行的服务（不再启动模拟服务与 streamlit）")
+    parser.add_argument("--pid", type=int, help="配合 --url：服务进程的 pid，用于读取 RSS")
+    parser.add_argument("--out", help="把结果写入 JSON 文件")
+    mock_server.add_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        parser.error("缺少 websockets，请先运行 pip install -r bench/requirements.txt")
+
+    proc = log = server = None
+    workdir = tempfile.mkdtemp(prefix="cybergavel-load-")
+    try:
+        if args.url:
+            base_url, pid = args.url.rstrip("/"), args.pid
+        else:
+            args.port = pick_port(args.port)
+            server, llm_url = mock_server.start(mock_server.settings_from_args(args))
+            proc, log = start_app(args, llm_url, workdir)
+            base_url, pid = f"http://127.0.0.1:{args.port}", proc.pid
+        wait_ready(base_url, proc)
+        # 预热：完整走一遍操作，让服务端导入页面与各模块，避免第一级的延迟与 RSS 计入冷启动
+        print("[load] 预热 ...")
+        asyncio.run(run_level(1, base_url, pid, args, seed=-1, duration=0))
+        levels = []
+        for i, sessions in enumerate(args.sessions):
+            if i:
+                time.sleep(args.cooldown)
+            print(f"[load] {sessions} 个会话，持续 {args.duration:g}s ...")
+            levels.append(asyncio.run(run_level(sessions, base_url, pid, args, (args.seed or 0) + i * 1000,
+                                                args.duration)))
+    except RuntimeError as e:
+        print(f"[load] {e}；服务日志: {os.path.join(workdir, 'streamlit.log')}")
+        return 1
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+            log.close()
+        if server is not None:
+            server.shutdown()
+
+    cap = capacity(levels, args.slo)
+    print_report(levels, cap)
+    if args.out:
+        report = {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "settings": {k: v for k, v in vars(args).items() if k != "out"},
+            "mock_requests": server.settings.requests if server is not None else None,
+            "levels": levels,
+            "capacity": cap,
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
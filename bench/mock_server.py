@@ -0,0 +1,261 @@
+# bench/mock_server.py
+# 本地 OpenAI 兼容模拟服务：可配置延迟分布、输出速度、流式输出与 429/500 错误注入
+# 并按消息粒度模拟服务端前缀缓存：与之前请求相同的消息前缀计入 cached_tokens，首字延迟相应缩短
+# 请求 response_format=json_object 时返回一张随机的陪审团投票 (民调模式)；法官的判决书以随机的【判决结果】开头
+# --prefill-rate 让首字延迟随未命中缓存的输入 token 数增长（长提示词更慢）
+# --slow-model 可让某个模型整体变慢，模拟单个服务商降级（用于观察自动路由的切换）
+# 配合 CYBERGAVEL_BASE_URL 使用，压测时不消耗任何 API 额度
+#
+# 单独运行:
+#   python bench/mock_server.py --port 8765 --latency-median 0.4 --token-rate 60 --error-429 0.05
+#   CYBERGAVEL_BASE_URL=http://127.0.0.1:8765/v1 streamlit run main.py
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER = "本席认为，此案的关键在于权利与责任的边界。**论点**：规则必须清晰。"
+
+
+class MockSettings:
+    def __init__(self, latency_median=0.3, latency_sigma=0.5, token_rate=80.0, completion_tokens=200,
+                 error_429=0.0, error_500=0.0, retry_after=0.2, seed=None, prefix_cache=True, slow_models=None,
+                 prefill_rate=0.0):
+        self.latency_median = latency_median  # 首字延迟中位数（秒），对数正态分布
+        self.latency_sigma = latency_sigma
+        self.token_rate = token_rate  # 每秒输出 token 数，0 表示瞬间输出
+        self.completion_tokens = completion_tokens  # 平均输出 token 数
+        self.prefill_rate = prefill_rate  # 每秒预填充的输入 token 数，0 表示不计预填充时间
+        self.error_429 = error_429  # 注入 429 的概率
+        self.error_500 = error_500  # 注入 500 的概率
+        self.retry_after = retry_after
+        self.prefix_cache = prefix_cache
+        self.slow_models = dict(slow_models or {})  # 请求中的 model -> 变慢倍数，首字延迟与输出时间都乘以该倍数
+        self._prefixes = OrderedDict()  # (模型, 消息前缀哈希) -> None，LRU
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = {429: 0, 500: 0}
+        self.aborted = 0  # 客户端中途断开（被取消）的请求数
+
+    def sample(self):
+        """返回 (首字延迟, 输出 token 数, 注入的错误码或 None)"""
+        with self.lock:
+            self.requests += 1
+            r = self.random.random()
+            error = 429 if r < self.error_429 else (500 if r < self.error_429 + self.error_500 else None)
+            if error:
+                self.errors[error] += 1
+            latency = self.latency_median * math.exp(self.random.gauss(0, self.latency_sigma))
+            tokens = max(1, int(self.random.gauss(self.completion_tokens, self.completion_tokens * 0.2)))
+        return latency, tokens, error
+
+    def vote_text(self):
+        """民调陪审员的结构化投票，原告略占优势"""
+        with self.lock:
+            side = self.random.choices(["plaintiff", "defendant", "abstain"], [0.5, 0.42, 0.08])[0]
+            confidence = round(self.random.uniform(0.3, 1.0), 2)
+        return json.dumps({"side": side, "confidence": confidence, "reason": f"模拟理由：{side} 一方更有说服力"},
+                          ensure_ascii=False)
+
+    def verdict_text(self):
+        """判决书开头的胜负，供 tournament.py 解析"""
+        with self.lock:
+            side = self.random.choice(["原告", "被告"])
+        return f"【判决结果】：支持{side}\n"
+
+    def cached_tokens(self, model, messages):
+        """最长的已见过的消息前缀所含 token 数；同时把本次请求的各级前缀记入缓存"""
+        if not self.prefix_cache:
+            return 0
+        digest = hashlib.sha1(model.encode("utf-8"))
+        cached = tokens = 0
+        with self.lock:
+            for message in messages[:-1]:  # 最后一条消息不可能被缓存
+                digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+                key = digest.hexdigest()
+                tokens += _estimate_prompt_tokens([message])
+                if key in self._prefixes:
+                    self._prefixes.move_to_end(key)
+                    cached = tokens
+                else:
+                    self._prefixes[key] = None
+            while len(self._prefixes) > 10000:
+                self._prefixes.popitem(last=False)
+        return cached
+
+
+def _estimate_prompt_tokens(messages):
+    return sum(len(m.get("content") or "") for m in messages) * 2 // 3 + 1
+
+
+def _make_handler(settings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive，与真实服务商一致
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            try:
+                self._complete()
+            except (BrokenPipeError, ConnectionResetError):
+                with settings.lock:
+                    settings.aborted += 1
+
+        def _complete(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            latency, completion_tokens, error = settings.sample()
+
+            if error == 429:
+                self._send_json(429, {"error": {"message": "rate limited (mock)", "type": "rate_limit"}},
+                                {"Retry-After": str(settings.retry_after)})
+                return
+            model = request.get("model", "mock")
+            slowdown = settings.slow_models.get(model, 1.0)
+            latency *= slowdown
+            token_rate = settings.token_rate / slowdown
+            messages = request.get("messages", [])
+            prompt_tokens = _estimate_prompt_tokens(messages)
+            cached_tokens = min(settings.cached_tokens(model, messages), prompt_tokens)
+            # 命中前缀缓存的部分无需重新预填充，首字延迟按比例缩短
+            time.sleep(latency * (1 - 0.5 * cached_tokens / prompt_tokens))
+            if settings.prefill_rate:
+                time.sleep((prompt_tokens - cached_tokens) / settings.prefill_rate * slowdown)
+            if error == 500:
+                self._send_json(500, {"error": {"message": "internal error (mock)", "type": "server_error"}})
+                return
+
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                     "total_tokens": prompt_tokens + completion_tokens,
+                     "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+            if (request.get("response_format") or {}).get("type") == "json_object":
+                text = settings.vote_text()
+                completion_tokens = len(text) // 2
+            else:
+                completion_tokens = min(completion_tokens, request.get("max_tokens") or completion_tokens)
+                text = (FILLER * (completion_tokens // len(FILLER) + 1))[:completion_tokens]
+                if any("【判决结果】" in (m.get("content") or "") for m in messages):
+                    text = settings.verdict_text() + text
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+            if not request.get("stream"):
+                if token_rate:
+                    time.sleep(completion_tokens / token_rate)
+                self._send_json(200, {
+                    "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def event(choices, **extra):
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                           "model": model, "choices": choices, **extra}
+                self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+            # 每个分片 8 个 token（此处按字符近似）
+            step = 8
+            for i in range(0, len(text), step):
+                if token_rate:
+                    time.sleep(step / token_rate)
+                event([{"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}])
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (request.get("stream_options") or {}).get("include_usage"):
+                event([], usage=usage)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+    return Handler
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """客户端中途断开（取消请求、压测结束）是常态，不打印堆栈；其他异常照常输出"""
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start(settings=None, host="127.0.0.1", port=0):
+    """在后台线程启动模拟服务，返回 (server, base_url)；port 为 0 时自动选择端口"""
+    settings = settings or MockSettings()
+    server = MockServer((host, port), _make_handler(settings))
+    server.settings = settings
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency-median", type=float, default=0.3, help="首字延迟中位数（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="首字延迟的对数正态 sigma")
+    parser.add_argument("--token-rate", type=float, default=80.0, help="每秒输出 token 数，0 为瞬间输出")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="平均输出 token 数")
+    parser.add_argument("--error-429", type=float, default=0.0, help="注入 429 的概率")
+    parser.add_argument("--error-500", type=float, default=0.0, help="注入 500 的概率")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--prefill-rate", type=float, default=0.0,
+                        help="每秒预填充的输入 token 数，0 为不计预填充时间")
+    parser.add_argument("--no-prefix-cache", action="store_true", help="不模拟服务端前缀缓存")
+    parser.add_argument("--slow-model", action="append", default=[], metavar="MODEL=FACTOR",
+                        help="让某个模型 (请求中的 model 字段，如 qwen-turbo) 慢 FACTOR 倍，可重复")
+
+
+def parse_slow_models(items):
+    """["qwen-turbo=4", ...] -> {"qwen-turbo": 4.0}"""
+    slow = {}
+    for item in items:
+        model, _, factor = item.rpartition("=")
+        slow[model] = float(factor)
+    return slow
+
+
+def settings_from_args(args):
+    return MockSettings(args.latency_median, args.latency_sigma, args.token_rate, args.completion_tokens,
+                        args.error_429, args.error_500, seed=args.seed, prefix_cache=not args.no_prefix_cache,
+                        slow_models=parse_slow_models(args.slow_model), prefill_rate=args.prefill_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CyberGavel 本地模拟 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, url = start(settings_from_args(args), args.host, args.port)
+    print(f"模拟服务已启动：{url}  (Ctrl+C 退出)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,275 @@
+# bench/run_bench.py
+# 离线性能基准：启动本地模拟服务，用真实的庭审引擎 (court.Trial) 跑完整庭审
+# 报告各阶段耗时、调用延迟 p50/p95/p99、吞吐量与内存峰值，并可保存/对比机器可读的基线
+#
+# 用法:
+#   python bench/run_bench.py --rounds 1 2 4 --jury-sizes 5 20 --trials 8 --concurrency 4 --out bench/baseline.json
+#   python bench/run_bench.py --compare bench/baseline.json --tolerance 0.15
+#   python bench/run_bench.py --auto --slow-model qwen-turbo=20 --trials 8   # 观察自动路由避开变慢的模型
+#   python bench/run_bench.py --pipeline-ab --rounds 1 3   # 同一场景分别关/开陪审团逐轮旁听，对比耗时
+#   python bench/run_bench.py --map-reduce --rounds 8 16 32 --trials 2 --token-rate 0 --assert-flat-judge
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_server  # noqa: E402
+
+TOPICS = [
+    "AI生成的画作版权应该归属于提示词作者吗？",
+    "外卖平台是否应该为骑手的超时罚款负责？",
+    "宠物狗在小区电梯里不牵绳，物业该不该管？",
+    "AI 能否作为专利的发明人？",
+]
+
+# 对比基线时检查的指标：数值越大越差
+COMPARED_METRICS = ["wall", "trial_p50", "trial_p95", "call_p50", "call_p95", "call_p99", "peak_mem_mb"]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def make_personas(size):
+    """按需扩充陪审团：循环使用内置人设，id 加序号区分"""
+    from prompts import JURY_PERSONAS
+    return [
+        {**JURY_PERSONAS[i % len(JURY_PERSONAS)], "id": f"{JURY_PERSONAS[i % len(JURY_PERSONAS)]['id']}_{i}"}
+        for i in range(size)
+    ]
+
+
+def run_scenario(rounds, jury_size, args):
+    from court import Trial, build_configs
+    from async_court import AsyncTrial
+    from jury_poll import sample_jurors
+    from router import route, needs_routing
+    from config import AVAILABLE_MODELS, AUTO_MODEL
+
+    names = [AUTO_MODEL] * 3 if args.auto else list(AVAILABLE_MODELS)
+    personas = sample_jurors(jury_size, seed=0) if args.poll else make_personas(jury_size)
+    configs = build_configs(names[0], names[1], names[1], names[2], personas)
+
+    def one(i):
+        trial_configs, routing = configs, None
+        if needs_routing(configs):
+            trial_configs, routing = route(configs, rounds, poll=args.poll, jury_pipeline=args.pipelined_jury)
+        trial = (AsyncTrial if args.async_engine else Trial)(TOPICS[i % len(TOPICS)], trial_configs, rounds,
+                                                             personas=personas)
+        trial.routing = routing
+        trial.stream = args.stream
+        trial.jury_pipeline = args.pipelined_jury
+        trial.prefix_layout = not args.classic_prompts
+        trial.poll = args.poll
+        trial.map_reduce = args.map_reduce
+        try:
+            trial.run()
+        except Exception:
+            pass  # 错误记录在 trial.status 中
+        return trial
+
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        trials = list(pool.map(one, range(args.trials)))
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+
+    calls = [call for trial in trials for call in trial.calls]
+    latencies = [call["latency"] for call in calls if not call["error"]]
+    prompt_tokens = sum(call["prompt_tokens"] for call in calls)
+    judge_calls = [call for call in calls if call["role"] == "judge"]
+    phases = {}
+    for phase in ("debate", "jury", "judge", "total"):
+        values = [trial.timings.get(phase, 0.0) for trial in trials]
+        phases[phase] = sum(values) / len(values)
+    totals = [trial.timings.get("total", 0.0) for trial in trials]
+    routed = {}  # 自动路由：角色 -> {模型: 场数}
+    for trial in trials:
+        for decision in (trial.routing or {}).get("decisions", []):
+            counts = routed.setdefault(decision["label"], {})
+            counts[decision["model"]] = counts.get(decision["model"], 0) + 1
+
+    return {
+        "name": f"rounds={rounds} jury={jury_size}" + (" 逐轮旁听" if args.pipeline_ab and args.pipelined_jury else ""),
+        "rounds": rounds,
+        "jury_size": jury_size,
+        "trials": len(trials),
+        "failed_trials": sum(trial.status != "done" for trial in trials),
+        "wall": wall,
+        "phase_mean": phases,
+        "trial_p50": percentile(totals, 0.5),
+        "trial_p95": percentile(totals, 0.95),
+        "calls": len(calls),
+        "call_errors": sum(call["error"] for call in calls),
+        "calls_per_sec": len(calls) / wall if wall else 0.0,
+        "call_p50": percentile(latencies, 0.5),
+        "call_p95": percentile(latencies, 0.95),
+        "call_p99": percentile(latencies, 0.99),
+        "peak_mem_mb": peak / 1024 / 1024,
+        "prompt_tokens": prompt_tokens,
+        "prefix_hit_rate": sum(call["cached_tokens"] for call in calls) / prompt_tokens if prompt_tokens else 0.0,
+        "judge_prompt_tokens": sum(c["prompt_tokens"] for c in judge_calls) / len(judge_calls) if judge_calls else 0,
+        "routed": routed,
+    }
+
+
+def print_report(results):
+    header = f"{'场景':<22}{'总耗时':>8}{'辩论':>8}{'合议':>8}{'判决':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'调用/s':>8}{'错误':>6}{'内存MB':>8}{'前缀命中':>8}{'法官输入':>8}"
+    print(header)
+    for r in results:
+        p = r["phase_mean"]
+        print(f"{r['name']:<22}{r['wall']:>8.2f}{p['debate']:>8.2f}{p['jury']:>8.2f}{p['judge']:>8.2f}"
+              f"{r['call_p50']:>8.3f}{r['call_p95']:>8.3f}{r['call_p99']:>8.3f}{r['calls_per_sec']:>8.1f}"
+              f"{r['call_errors']:>6}{r['peak_mem_mb']:>8.1f}{r['prefix_hit_rate']:>8.0%}"
+              f"{r.get('judge_prompt_tokens', 0):>8.0f}")
+        if r.get("routed"):
+            print("    自动路由：" + "；".join(
+                f"{role} " + ", ".join(f"{model}×{n}" for model, n in counts.items())
+                for role, counts in r["routed"].items()))
+
+
+def print_pipeline_ab(pairs):
+    """逐轮旁听 A/B：同一场景关 / 开逐轮旁听的单场平均耗时与合议阶段耗时"""
+    print("\n逐轮旁听对比（单场平均，秒）")
+    print(f"{'场景':<22}{'总耗时 关':>10}{'总耗时 开':>10}{'变化':>8}{'合议 关':>10}{'合议 开':>10}{'变化':>8}")
+    for off, on in pairs:
+        total_off, total_on = off["phase_mean"]["total"], on["phase_mean"]["total"]
+        jury_off, jury_on = off["phase_mean"]["jury"], on["phase_mean"]["jury"]
+        print(f"{off['name']:<22}{total_off:>10.2f}{total_on:>10.2f}{_change(total_off, total_on):>8}"
+              f"{jury_off:>10.2f}{jury_on:>10.2f}{_change(jury_off, jury_on):>8}")
+
+
+def _change(old, new):
+    return f"{(new / old - 1) * 100:+.0f}%" if old else "-"
+
+
+def judge_growth(results, tolerance):
+    """分段归纳判决：轮数增加时法官平均输入 token 数的增长超出容差的场景对"""
+    growth = []
+    for jury_size in sorted({r["jury_size"] for r in results}):
+        scenarios = sorted((r for r in results if r["jury_size"] == jury_size), key=lambda r: r["rounds"])
+        for fewer, more in zip(scenarios, scenarios[1:]):
+            if fewer["judge_prompt_tokens"] and more["judge_prompt_tokens"] > fewer["judge_prompt_tokens"] * (1 + tolerance):
+                growth.append(f"{fewer['name']} -> {more['name']}: 法官输入 "
+                              f"{fewer['judge_prompt_tokens']:.0f} -> {more['judge_prompt_tokens']:.0f} tokens")
+    return growth
+
+
+def compare(results, baseline, tolerance):
+    """与基线对比，返回退化的指标列表"""
+    base = {r["name"]: r for r in baseline["scenarios"]}
+    regressions = []
+    for r in results:
+        old = base.get(r["name"])
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if old.get(metric) and r[metric] > old[metric] * (1 + tolerance):
+                regressions.append(f"{r['name']} {metric}: {old[metric]:.3f} -> {r[metric]:.3f} "
+                                   f"(+{(r[metric] / old[metric] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CyberGavel 离线性能基准")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[1, 2], help="辩论回合数（可多个）")
+    parser.add_argument("--jury-sizes", type=int, nargs="+", default=[5], help="陪审团人数（可多个）")
+    parser.add_argument("--trials", type=int, default=4, help="每个场景的庭审场数")
+    parser.add_argument("--concurrency", type=int, default=2, help="同时进行的庭审数")
+    parser.add_argument("--stream", action="store_true", help="律师与法官使用流式调用")
+    parser.add_argument("--pipelined-jury", action="store_true", help="陪审团逐轮旁听")
+    parser.add_argument("--pipeline-ab", action="store_true", help="每个场景分别关 / 开逐轮旁听各跑一次并对比耗时")
+    parser.add_argument("--async-engine", action="store_true", help="使用 asyncio 庭审引擎 (async_court)")
+    parser.add_argument("--poll", action="store_true", help="民调模式：陪审员按人设模板抽样，只给结构化投票")
+    parser.add_argument("--map-reduce", action="store_true", help="分段归纳判决：书记员整理各轮要点，法官只读要点")
+    parser.add_argument("--auto", action="store_true", help="所有角色使用自动路由，每场开庭前按近期表现分配模型")
+    parser.add_argument("--assert-flat-judge", action="store_true",
+                        help="配合 --map-reduce：轮数增加时法官输入 token 数的增长超出 --tolerance 则退出码为 1")
+    parser.add_argument("--classic-prompts", action="store_true", help="使用旧的单条消息提示词布局")
+    parser.add_argument("--out", help="把结果写入 JSON 基线文件")
+    parser.add_argument("--compare", help="与已有的基线文件对比")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="对比时允许的退化比例")
+    mock_server.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server, base_url = mock_server.start(mock_server.settings_from_args(args))
+    # 配置在导入时读取环境变量，必须在导入项目模块之前设置
+    os.environ["CYBERGAVEL_BASE_URL"] = base_url
+    os.environ["CYBERGAVEL_CACHE"] = "0"
+    os.environ.setdefault("CYBERGAVEL_FAILOVER", "0")
+    from config import AVAILABLE_MODELS
+    for conf in AVAILABLE_MODELS.values():
+        os.environ[conf["env_key"]] = "sk-mock"  # 覆盖 .env 中的真实 Key，保证请求不会发往服务商
+
+    # 预热：SDK 在首次调用时才导入 (见 utils)，提前建好客户端，避免第一个场景计入一次性的导入耗时
+    from config import get_model_config
+    from utils import get_client
+    for name in AVAILABLE_MODELS:
+        get_client(get_model_config(name))
+
+    tracemalloc.start()
+    results, pairs = [], []
+    for rounds in args.rounds:
+        for jury_size in args.jury_sizes:
+            if args.pipeline_ab:
+                pair = [run_scenario(rounds, jury_size, Namespace(**{**vars(args), "pipelined_jury": on}))
+                        for on in (False, True)]
+                pairs.append(pair)
+                results.extend(pair)
+            else:
+                results.append(run_scenario(rounds, jury_size, args))
+    tracemalloc.stop()
+    print_report(results)
+    if pairs:
+        print_pipeline_ab(pairs)
+
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "mock_requests": server.settings.requests,
+        "mock_errors": server.settings.errors,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "scenarios": results,
+    }
+    server.shutdown()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.out}")
+
+    if args.assert_flat_judge:
+        growth = judge_growth(results, args.tolerance)
+        if growth:
+            print("⚠️ 法官输入随辩论轮数增长：")
+            for line in growth:
+                print("  " + line)
+            return 1
+        print("✅ 法官输入不随辩论轮数增长")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("⚠️ 性能退化：")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print("✅ 与基线相比没有超出容差的退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# bench/startup_bench.py
+# 页面冷启动与 rerun 耗时测量：
+#   1. 新进程中导入页面依赖的模块所需时间，以及 openai / markdown 等重量级模块是否被提前加载
+#   2. 用 streamlit.testing 运行 main.py，测量首次执行与反复切换侧边栏控件时每次 rerun 的耗时
+#
+# 用法:
+#   python bench/startup_bench.py --reruns 30
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["openai", "httpx", "markdown", "pandas", "altair"]
+
+_IMPORT_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import streamlit
+streamlit_done = time.perf_counter()
+import styles, court, store, cache, metrics, config, prompts
+end = time.perf_counter()
+print(json.dumps({{
+    "streamlit": streamlit_done - start,
+    "app_modules": end - streamlit_done,
+    "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def measure_imports(repeat):
+    """新进程中测量导入耗时，取多次中的最小值以排除磁盘缓存的影响"""
+    results = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "streamlit": min(r["streamlit"] for r in results),
+        "app_modules": min(r["app_modules"] for r in results),
+        "loaded": results[-1]["loaded"],
+    }
+
+
+def measure_reruns(reruns):
+    """首次执行页面脚本，然后反复切换侧边栏控件触发 rerun"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=60)
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+
+    times = []
+    for i in range(reruns):
+        at.slider[0].set_value(1 + i % 4)
+        start = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - start)
+    return {"first_run": first, "reruns": times, "exceptions": [str(e.value) for e in at.exception]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CyberGavel 页面冷启动与 rerun 耗时")
+    parser.add_argument("--reruns", type=int, default=20, help="触发 rerun 的次数")
+    parser.add_argument("--import-repeat", type=int, default=3, help="测量导入耗时的进程数")
+    parser.add_argument("--out", help="把结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    imports = measure_imports(args.import_repeat)
+    runs = measure_reruns(args.reruns)
+
+    print(f"导入 streamlit:     {imports['streamlit'] * 1000:7.0f} ms")
+    print(f"导入项目模块:       {imports['app_modules'] * 1000:7.0f} ms")
+    print(f"启动时已加载的重量级模块: {', '.join(imports['loaded']) or '无'}")
+    print(f"首次执行 main.py:   {runs['first_run'] * 1000:7.0f} ms")
+    print(f"rerun p50 / p95:    {percentile(runs['reruns'], 0.5) * 1000:7.0f} / "
+          f"{percentile(runs['reruns'], 0.95) * 1000:.0f} ms  ({len(runs['reruns'])} 次)")
+    if runs["exceptions"]:
+        print(f"⚠️ 页面报错: {runs['exceptions']}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"imports": imports, **runs}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
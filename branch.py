@@ -0,0 +1,157 @@
+# branch.py
+# 庭审分支：从已结束庭审的某一轮辩论、陪审团合议或法官判决处分叉，改换模型或辩论回合数后只重跑分叉点之后的调用
+# 分叉点之前的发言、投票与书记员要点直接沿用父庭审的对象（写时复制：分支只追加自己的内容，从不修改继承的部分）
+# 档案库中分支只保存自己新增的部分，读取时再拼上父庭审的记录 (见 archive.TrialArchive)
+from court import Trial, build_configs, verdict_winner
+from jury_poll import sample_jurors
+from prompts import JURY_PERSONAS
+from config import PREFIX_LAYOUT
+
+ROLE_LABELS = {"judge": "法官", "plaintiff": "原告", "defendant": "被告", "jury": "陪审团", "rounds": "辩论回合数"}
+SIDE_LABELS = {"plaintiff": "支持原告", "defendant": "支持被告", None: "未写明胜负"}
+
+
+def fork_points(parent):
+    """可选的分叉点: [(键, 说明)]；"round-N" 表示从第 N+1 轮辩论开始重跑"""
+    rounds = parent["rounds"]
+    points = [(f"round-{r}", f"第 {r + 1} 轮辩论起") for r in range(rounds)]
+    points.append((f"round-{rounds}", f"追加第 {rounds + 1} 轮起的辩论（需增加回合数）"))
+    points.append(("jury", "陪审团合议起（沿用全部辩论）"))
+    points.append(("judge", "仅重新判决（沿用辩论与陪审团）"))
+    return points
+
+
+def point_label(point):
+    if point.startswith("round-"):
+        return f"第 {int(point[6:]) + 1} 轮辩论起"
+    return {"jury": "陪审团合议起", "judge": "仅重新判决"}[point]
+
+
+def fork(parent, point, rounds=None, judge=None, plaintiff=None, defendant=None, jury=None, engine=Trial):
+    """
+    parent: 已结束庭审的 to_dict() 快照（会话中或档案库读出的均可）
+    point: fork_points 中的键；rounds / 各模型为 None 时沿用父庭审
+    jury: 所有陪审员共用的模型名称，None 时沿用父庭审的逐人分配
+    返回尚未运行的庭审对象（交给任务队列运行）；分叉点与改动不匹配时抛出 ValueError
+    """
+    if parent["status"] != "done":
+        raise ValueError("只能从已完成的庭审分叉")
+    models = parent["models"]
+    rounds = rounds or parent["rounds"]
+    changes = {}
+    for role, name in (("judge", judge), ("plaintiff", plaintiff), ("defendant", defendant)):
+        if name is not None and name != models[role]:
+            changes[role] = name
+    if jury is not None and any(name != jury for name in models["jury"].values()):
+        changes["jury"] = jury
+    if rounds != parent["rounds"]:
+        changes["rounds"] = rounds
+
+    if point.startswith("round-"):
+        start_round = int(point[6:])
+        if not 0 <= start_round <= parent["rounds"]:
+            raise ValueError("分叉的轮次超出了父庭审的辩论回合数")
+        if rounds <= start_round:
+            raise ValueError("分叉点之后至少要有一轮辩论：请增加辩论回合数，或选择更早的轮次")
+    elif point in ("jury", "judge"):
+        start_round = rounds
+        if rounds > parent["rounds"]:
+            raise ValueError("增加辩论回合数需要从辩论轮次分叉")
+        if "plaintiff" in changes or "defendant" in changes:
+            raise ValueError("律师模型的改动只对重新进行的辩论生效，请选择辩论轮次作为分叉点")
+        if point == "judge" and ("jury" in changes or rounds != parent["rounds"]):
+            raise ValueError("改动陪审团模型或辩论回合数后需要重新合议，请选择「陪审团合议起」")
+    else:
+        raise ValueError(f"未知的分叉点: {point}")
+
+    poll_size = parent.get("poll_size") or 0
+    reuse_jury = point == "judge"
+    if reuse_jury:
+        # 只重新判决：陪审员就是父庭审的那些人，按投票记录还原席位
+        personas = [{"id": vote["id"], "name": vote["name"], "avatar": vote["avatar"], "template": vote.get("template")}
+                    for vote in parent["jury"]]
+    elif poll_size:
+        personas = sample_jurors(poll_size)  # 民调陪审团重新合议时重新抽样
+    else:
+        personas = JURY_PERSONAS
+    # 重新抽样的民调陪审员不在父庭审的分配中，沿用其（共用的）陪审团模型
+    fallback = next(iter(models["jury"].values()))
+    jury_models = {persona['id']: jury or models["jury"].get(persona['id'], fallback) for persona in personas}
+    configs = build_configs(judge or models["judge"], plaintiff or models["plaintiff"],
+                            defendant or models["defendant"], jury_models, personas)
+
+    trial = engine(parent["topic"], configs, rounds, personas=personas)
+    trial.poll = bool(poll_size)
+    trial.prefix_layout = parent.get("prefix_layout", PREFIX_LAYOUT)
+    trial.map_reduce = parent.get("extracts") is not None
+    trial.start_round = start_round
+    trial.reuse_jury = reuse_jury
+
+    # 沿用分叉点之前的发言：消息对象与父庭审共用，不复制
+    inherited = [msg for msg in parent["transcript"] if msg["round"] < start_round]
+    for msg in inherited:
+        trial.record.add(msg["role"], msg["round"], msg["content"])
+        trial.messages.append(msg)
+        trial.last_argument = msg["content"]
+    reused = len(inherited)
+    extracts = parent.get("extracts")
+    if extracts and trial.map_reduce:
+        for i, text in enumerate(extracts["rounds"][:start_round]):
+            trial.extracts["rounds"][i] = text
+            reused += 1
+        merged = extracts.get("merged")
+        if merged and merged[0] <= start_round:
+            # 合并要点只涵盖沿用的轮次；判决前按分支自己的各轮要点确认合并范围不变才会使用
+            trial.extracts["merged"] = tuple(merged)
+    if reuse_jury:
+        trial.jury = list(parent["jury"])
+        trial.poll_result = parent.get("poll")
+        reused += len(trial.jury)
+        if extracts and trial.map_reduce and extracts["jury"]:
+            trial.extracts["jury"] = extracts["jury"]
+            reused += 1
+
+    trial.fork = {
+        "parent": parent["id"],
+        "point": point,
+        "inherited": {"transcript": len(inherited), "jury": reuse_jury},
+        "changes": changes,
+        "reused_calls": reused,
+    }
+    return trial
+
+
+def describe_fork(fork_info):
+    """分支的一行说明，如 "第 2 轮辩论起 · 被告 → GLM-4.6" """
+    parts = [point_label(fork_info["point"])]
+    for key, value in fork_info.get("changes", {}).items():
+        parts.append(f"{ROLE_LABELS.get(key, key)} → {str(value).strip()}")
+    return " · ".join(parts)
+
+
+def tree_lines(rows, current_id=None):
+    """
+    rows: archive.TrialArchive.family 的结果
+    返回按树形 (深度优先) 排列的 [(深度, 行, 说明)]
+    """
+    children = {}
+    ids = {row["id"] for row in rows}
+    roots = []
+    for row in sorted(rows, key=lambda r: r["created"]):
+        if row["parent"] in ids:
+            children.setdefault(row["parent"], []).append(row)
+        else:
+            roots.append(row)
+    lines = []
+
+    def walk(row, depth):
+        side = SIDE_LABELS[verdict_winner(row["verdict"])] if row["status"] == "done" else "未完成"
+        what = describe_fork(row["fork"]) if row["fork"] else "原始庭审"
+        marker = "👉 " if row["id"] == current_id else ""
+        lines.append((depth, row, f"{marker}{'🌿' if row['fork'] else '🌱'} {what} · 法官 {row['judge_model'].strip()} · {side}"))
+        for child in children.get(row["id"], []):
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+    return lines
@@ -0,0 +1,139 @@
+# cache.py
+# 模型回复缓存：内存 LRU + SQLite 持久层，默认关闭 (CYBERGAVEL_CACHE=1 开启)
+# 相同的 (模型, base_url, 系统提示词, 用户内容, temperature, 请求参数) 直接返回上次的回复
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import (CACHE_ENABLED, CACHE_PATH, CACHE_MEMORY_ITEMS, CACHE_MAX_ROWS,
+                    CACHE_TTL, CACHE_BYPASS_ROLES)
+
+
+def make_key(model_conf, system_prompt, user_content, temperature, options=None):
+    """options: 按角色附加的请求参数 (max_tokens、response_format 等)，改变后不再命中旧的回复"""
+    parts = [model_conf["model"], model_conf["base_url"], system_prompt, user_content, temperature]
+    if options:
+        parts.append(options)  # 不带附加参数的调用沿用原来的 key，已有的缓存仍然有效
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """两级缓存：先查内存 LRU，未命中再查 SQLite；线程安全"""
+
+    def __init__(self, path=CACHE_PATH, memory_items=CACHE_MEMORY_ITEMS, max_rows=CACHE_MAX_ROWS, ttl=CACHE_TTL):
+        self.memory_items = memory_items
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (value, created)
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+            self._db.commit()
+
+    def _expired(self, created, now):
+        return self.ttl and now - created > self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item and not self._expired(item[1], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self._memory.pop(key, None)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row and not self._expired(row[1], now):
+                    self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                             (key, value, now, now))
+            self._puts += 1
+            # 每写入 50 条做一次淘汰，避免每次写入都全表扫描
+            if self._puts % 50 == 0:
+                self._evict(now)
+            self._db.commit()
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        if self.ttl:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        if self.max_rows:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """进程级缓存单例；未开启缓存时返回 None"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def should_cache(role):
+    """按角色绕过缓存，例如 CYBERGAVEL_CACHE_BYPASS=jury 让陪审团每次都重新采样"""
+    return role not in CACHE_BYPASS_ROLES
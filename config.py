@@ -1,11 +1,18 @@
 # config.py
 import os
-from dotenv import load_dotenv
+import json
+import logging
+from dotenv import load_dotenv, find_dotenv, dotenv_values
 
-load_dotenv()
+ENV_PATH = find_dotenv() or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+# 启动前已由进程环境提供的变量（部署时注入的 Key、压测的 sk-mock 等）优先于 .env，重新读取 .env 时也不覆盖
+_PROCESS_ENV_KEYS = frozenset(os.environ)
+load_dotenv(ENV_PATH)
 
 # --- 模型池定义 ---
 # 格式: "UI显示名称": { "env_key": 环境变量名, "base_url": API地址, "model": 模型ID }
+# 可选字段: "http2": 是否对该服务商启用 HTTP/2
+#          "fallback": [备用模型名称, ...]，服务商故障时依次切换 (默认使用其他服务商中已配置 Key 的模型)
 AVAILABLE_MODELS = {
     "DeepSeek-Chat": {
         "env_key": "DEEPSEEK_API_KEY",
@@ -34,6 +41,199 @@ AVAILABLE_MODELS = {
     },
 }
 
+# 角色选择中的特殊值：开庭前按各模型近期表现自动分配 (见 router.py)
+AUTO_MODEL = "🤖 自动路由"
+
+
+# --- 价目表 (元 / 百万 token)，仅用于估算费用 ---
+# 价格会调整，请以各服务商官网为准；cached_input 为命中服务端前缀缓存的输入价格
+MODEL_PRICES = {
+    "DeepSeek-Chat": {"input": 2.0, "cached_input": 0.2, "output": 3.0},
+    "Qwen-Plus ": {"input": 0.8, "cached_input": 0.32, "output": 2.0},
+    "Qwen-Turbo ": {"input": 0.3, "cached_input": 0.12, "output": 0.6},
+    "Kimi-K2-Turbo-Preview": {"input": 8.0, "cached_input": 1.0, "output": 58.0},
+    "GLM-4.6": {"input": 2.0, "cached_input": 0.4, "output": 8.0},
+}
+
+# --- 辩论回合 ---
+# 网页上新开庭审与分支庭审可选的最大辩论回合数（费用估算与阶段时限按这个规模设定）
+MAX_ROUNDS = int(os.getenv("CYBERGAVEL_MAX_ROUNDS", "4"))
+
+# --- 并发设置 ---
+# 陪审团并发合议时的最大线程数
+JURY_MAX_WORKERS = int(os.getenv("CYBERGAVEL_JURY_WORKERS", "5"))
+
+# --- 大规模民调陪审团 ---
+# 从人设模板抽样出数十到数百名陪审员，每人只输出一条结构化投票，法官读统计摘要而不是逐条意见
+POLL_DEFAULT_SIZE = int(os.getenv("CYBERGAVEL_POLL_SIZE", "50"))
+POLL_MAX_SIZE = int(os.getenv("CYBERGAVEL_POLL_MAX_SIZE", "300"))
+# 民调陪审员的并发线程数（同步引擎；实际并发仍受服务商限流约束）
+POLL_MAX_WORKERS = int(os.getenv("CYBERGAVEL_POLL_WORKERS", "32"))
+# 请求服务端以 JSON 格式输出 (response_format=json_object)；服务商不支持时置 0，仍按提示词要求输出 JSON
+POLL_JSON_MODE = os.getenv("CYBERGAVEL_POLL_JSON_MODE", "1") == "1"
+POLL_MAX_TOKENS = int(os.getenv("CYBERGAVEL_POLL_MAX_TOKENS", "120"))
+
+# --- 分段归纳判决 (map-reduce) ---
+# 开启后书记员模型逐轮整理辩论要点、汇总陪审团意见，法官只读这些要点，提示词规模不随辩论长度增长
+MAP_REDUCE_JUDGE = os.getenv("CYBERGAVEL_MAP_REDUCE", "0") == "1"
+# 书记员使用的模型 (AVAILABLE_MODELS 中的名称)，留空时使用陪审团的模型（通常是便宜、快速的模型）
+CLERK_MODEL = os.getenv("CYBERGAVEL_CLERK_MODEL", "")
+# 每份要点的最大输出 token 数
+CLERK_MAX_TOKENS = int(os.getenv("CYBERGAVEL_CLERK_MAX_TOKENS", "300"))
+# 法官读到的各轮要点总量上限 (token)：超出时书记员把较早的轮次再合并成一份要点，近期的轮次保留原样
+# 法官的输入因此不超过 该值 + CLERK_MAX_TOKENS (陪审团要点)，不随辩论轮数增长
+CLERK_TOTAL_TOKENS = max(int(os.getenv("CYBERGAVEL_CLERK_TOTAL_TOKENS", "1200")), CLERK_MAX_TOKENS * 2)
+
+# --- 自动路由 ---
+# 各角色单次调用的目标 p95 延迟（秒），自动路由优先选择满足该 SLA 的模型
+ROLE_SLAS = {
+    "plaintiff": float(os.getenv("CYBERGAVEL_SLA_LAWYER", "60")),
+    "defendant": float(os.getenv("CYBERGAVEL_SLA_LAWYER", "60")),
+    "jury": float(os.getenv("CYBERGAVEL_SLA_JURY", "5")),
+    "poll": float(os.getenv("CYBERGAVEL_SLA_JURY", "5")),
+    "judge": float(os.getenv("CYBERGAVEL_SLA_JUDGE", "90")),
+}
+# 每场庭审的预估费用上限（元），0 表示不限；预计超支时花费最多的角色改用更便宜的模型
+TRIAL_BUDGET = float(os.getenv("CYBERGAVEL_TRIAL_BUDGET", "0"))
+# 近期错误率超过该值的模型视为降级，不参与自动路由
+ROUTER_MAX_ERROR_RATE = float(os.getenv("CYBERGAVEL_ROUTER_MAX_ERROR_RATE", "0.2"))
+# 某模型担任某角色的样本数不足时，改用该模型所有调用的统计估算
+ROUTER_MIN_SAMPLES = int(os.getenv("CYBERGAVEL_ROUTER_MIN_SAMPLES", "5"))
+
+# --- 庭审记录的 token 预算 ---
+# 陪审员与法官读到的庭审记录上限（估算 token 数），超出部分只保留最近的完整发言 + 早期发言摘要
+# 陪审员的上限只在旧布局 (CYBERGAVEL_PREFIX_LAYOUT=0) 中生效；前缀缓存布局中各角色共用同一份记录，见 PREFIX_CONTEXT_TOKENS
+JURY_CONTEXT_TOKENS = int(os.getenv("CYBERGAVEL_JURY_CONTEXT_TOKENS", "800"))
+JUDGE_CONTEXT_TOKENS = int(os.getenv("CYBERGAVEL_JUDGE_CONTEXT_TOKENS", "8000"))
+
+# --- HTTP 连接池设置 ---
+# 同一 (base_url, api_key) 的所有调用共用一个客户端，复用 keep-alive 连接
+HTTP_MAX_CONNECTIONS = int(os.getenv("CYBERGAVEL_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("CYBERGAVEL_HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("CYBERGAVEL_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("CYBERGAVEL_HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("CYBERGAVEL_HTTP_READ_TIMEOUT", "120"))
+# 全局开启 HTTP/2 (需要安装 h2: pip install httpx[http2])；也可在模型池中按模型设置 "http2"
+HTTP2_ENABLED = os.getenv("CYBERGAVEL_HTTP2", "0") == "1"
+
+# --- 回复缓存设置 (默认关闭) ---
+CACHE_ENABLED = os.getenv("CYBERGAVEL_CACHE", "0") == "1"
+CACHE_PATH = os.getenv("CYBERGAVEL_CACHE_PATH", ".cache/responses.sqlite3")  # 置空则只用内存缓存
+CACHE_MEMORY_ITEMS = int(os.getenv("CYBERGAVEL_CACHE_MEMORY_ITEMS", "256"))
+CACHE_MAX_ROWS = int(os.getenv("CYBERGAVEL_CACHE_MAX_ROWS", "5000"))
+CACHE_TTL = float(os.getenv("CYBERGAVEL_CACHE_TTL", str(7 * 24 * 3600)))  # 秒，0 表示永不过期
+# 绕过缓存的角色 (plaintiff, defendant, jury, judge)，逗号分隔
+CACHE_BYPASS_ROLES = {r.strip() for r in os.getenv("CYBERGAVEL_CACHE_BYPASS", "").split(",") if r.strip()}
+
+# --- 容错设置 ---
+# 各角色单次调用的总时限（秒），包含重试与切换备用模型的时间
+ROLE_DEADLINES = {
+    "plaintiff": float(os.getenv("CYBERGAVEL_DEADLINE_LAWYER", "120")),
+    "defendant": float(os.getenv("CYBERGAVEL_DEADLINE_LAWYER", "120")),
+    "jury": float(os.getenv("CYBERGAVEL_DEADLINE_JURY", "45")),
+    "poll": float(os.getenv("CYBERGAVEL_DEADLINE_JURY", "45")),
+    "judge": float(os.getenv("CYBERGAVEL_DEADLINE_JUDGE", "180")),
+    "clerk": float(os.getenv("CYBERGAVEL_DEADLINE_CLERK", "45")),
+}
+# 429/5xx/超时的最大重试次数与退避时间（秒）
+RETRY_MAX = int(os.getenv("CYBERGAVEL_RETRY_MAX", "3"))
+RETRY_BASE_DELAY = float(os.getenv("CYBERGAVEL_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("CYBERGAVEL_RETRY_MAX_DELAY", "8"))
+# 对冲请求：非流式调用发出后超过该模型 p95 延迟仍未返回、且服务商还有空闲名额时再发一个相同请求 (会增加调用量，默认关闭)
+HEDGE_ENABLED = os.getenv("CYBERGAVEL_HEDGE", "0") == "1"
+HEDGE_MIN_SAMPLES = int(os.getenv("CYBERGAVEL_HEDGE_MIN_SAMPLES", "20"))  # 样本数不足时不对冲
+# 服务商故障时自动切换到备用模型
+FAILOVER_ENABLED = os.getenv("CYBERGAVEL_FAILOVER", "1") == "1"
+# 熔断：同一服务商连续失败次数达到阈值后，冷却期内优先使用备用模型
+CIRCUIT_FAILURES = int(os.getenv("CYBERGAVEL_CIRCUIT_FAILURES", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("CYBERGAVEL_CIRCUIT_COOLDOWN", "30"))
+
+# --- asyncio 庭审引擎 (async_court.py) ---
+# 默认使用的引擎；界面中也可以切换
+ASYNC_ENGINE = os.getenv("CYBERGAVEL_ASYNC_ENGINE", "0") == "1"
+# 整场庭审的总时限与各阶段预算（秒），0 表示不限
+# 辩论超时：以已完成的发言进入合议；陪审团超时：未作答的陪审员视为弃权；法官超时：庭审以错误结束
+TRIAL_DEADLINE = float(os.getenv("CYBERGAVEL_TRIAL_DEADLINE", "0"))
+PHASE_BUDGETS = {
+    "debate": float(os.getenv("CYBERGAVEL_BUDGET_DEBATE", "0")),
+    "jury": float(os.getenv("CYBERGAVEL_BUDGET_JURY", "0")),
+    "judge": float(os.getenv("CYBERGAVEL_BUDGET_JUDGE", "0")),
+}
+# 发起庭审的浏览器会话结束后，再等待多少秒仍未重连就取消庭审（停止计费）
+ORPHAN_GRACE = float(os.getenv("CYBERGAVEL_ORPHAN_GRACE", "30"))
+
+# --- 服务商限流 ---
+# 按账号 (API Key) 统一排队：最大并发数、每分钟请求数、每分钟 token 数 (0 表示不限)
+PROVIDER_MAX_INFLIGHT = int(os.getenv("CYBERGAVEL_PROVIDER_MAX_INFLIGHT", "8"))
+PROVIDER_RPM = int(os.getenv("CYBERGAVEL_PROVIDER_RPM", "0"))
+PROVIDER_TPM = int(os.getenv("CYBERGAVEL_PROVIDER_TPM", "0"))
+# 按账号覆盖，例如 '{"DASHSCOPE_API_KEY": {"max_inflight": 16, "rpm": 600, "tpm": 1000000}}'
+PROVIDER_LIMITS = json.loads(os.getenv("CYBERGAVEL_PROVIDER_LIMITS", "{}"))
+# 计算 TPM 时预估的单次回复 token 数
+EST_COMPLETION_TOKENS = int(os.getenv("CYBERGAVEL_EST_COMPLETION_TOKENS", "800"))
+
+# --- 提示词布局 ---
+# 前缀缓存友好的布局：所有角色共用稳定的系统提示词，庭审记录按发言逐条追加为多条消息，角色设定与任务放在最后
+# DeepSeek、Qwen、Kimi 等对重复的提示词前缀计费打折、首字更快；置 0 恢复每个角色各自拼接单条消息的旧布局
+PREFIX_LAYOUT = os.getenv("CYBERGAVEL_PREFIX_LAYOUT", "1") == "1"
+# 前缀布局中共享庭审记录的上限（估算 token 数），对律师、陪审员、法官一视同仁：记录必须逐字节相同才能命中缓存，
+# 因此陪审员也读完整记录 (命中缓存的部分按折扣计费)，CYBERGAVEL_JURY_CONTEXT_TOKENS 不再生效；默认与法官的上限相同
+PREFIX_CONTEXT_TOKENS = int(os.getenv("CYBERGAVEL_PREFIX_CONTEXT_TOKENS", str(JUDGE_CONTEXT_TOKENS)))
+if PREFIX_LAYOUT and "CYBERGAVEL_JURY_CONTEXT_TOKENS" in os.environ:
+    logging.getLogger(__name__).warning(
+        "CYBERGAVEL_JURY_CONTEXT_TOKENS 只在 CYBERGAVEL_PREFIX_LAYOUT=0 时生效；"
+        "前缀布局中陪审员读取的记录由 CYBERGAVEL_PREFIX_CONTEXT_TOKENS 限制")
+
+# --- 调用埋点 ---
+# 流式调用时请求服务端在最后一个分片返回 usage (stream_options.include_usage)
+STREAM_USAGE = os.getenv("CYBERGAVEL_STREAM_USAGE", "1") == "1"
+# 每次调用的记录追加写入的 JSONL 文件 (可选)
+METRICS_JSONL = os.getenv("CYBERGAVEL_METRICS_JSONL", "")
+# Prometheus 文本格式端点 http://<host>:<port>/metrics，0 表示不启动
+METRICS_PORT = int(os.getenv("CYBERGAVEL_METRICS_PORT", "0"))
+
+# --- 庭审状态保存 ---
+# 已完成庭审的磁盘目录 (可选)，配置后刷新页面也能通过 URL 中的 ?trial=<id> 找回
+TRIAL_STORE_DIR = os.getenv("CYBERGAVEL_TRIAL_STORE", "")
+# 庭审进行中页面的刷新间隔（秒），流式输出也按此间隔重绘，避免每个 token 都重新解析一次 Markdown
+TRIAL_POLL_INTERVAL = float(os.getenv("CYBERGAVEL_TRIAL_POLL_INTERVAL", "0.5"))
+# 庭审档案库 (SQLite + 全文索引)：所有结束的庭审都会存入，可在侧边栏搜索、复用；置空则不保存
+ARCHIVE_PATH = os.getenv("CYBERGAVEL_ARCHIVE", ".cache/trials.sqlite3")
+ARCHIVE_PAGE_SIZE = int(os.getenv("CYBERGAVEL_ARCHIVE_PAGE_SIZE", "8"))
+
+# --- 任务队列 ---
+# 所有会话共用的庭审工作线程数，即同时进行的庭审上限；其余庭审排队等待
+MAX_ACTIVE_TRIALS = int(os.getenv("CYBERGAVEL_MAX_TRIALS", "4"))
+# 排队上限，队列满时拒绝新的庭审
+TRIAL_QUEUE_LIMIT = int(os.getenv("CYBERGAVEL_QUEUE_LIMIT", "32"))
+# 内存中保留的已结束庭审数量，重连时可按 id 找回（更早的从磁盘存档或档案库恢复）
+JOB_RETAIN = int(os.getenv("CYBERGAVEL_JOB_RETAIN", "100"))
+# 还没有完成过庭审时，估算排队时间所用的单场耗时（秒）
+TRIAL_ETA_DEFAULT = float(os.getenv("CYBERGAVEL_TRIAL_ETA_DEFAULT", "90"))
+
+
+# --- 地址覆盖 ---
+# 把所有模型指向同一个 OpenAI 兼容地址，例如本地压测用的模拟服务 (bench/mock_server.py)
+BASE_URL_OVERRIDE = os.getenv("CYBERGAVEL_BASE_URL", "")
+
+
+def env_signature():
+    """.env 的修改时间；界面缓存的模型配置以它为键，修改 .env 后自动失效"""
+    try:
+        return os.path.getmtime(ENV_PATH)
+    except OSError:
+        return 0.0
+
+
+def reload_env():
+    """
+    重新读取 .env：只更新来自 .env 的变量，启动前已在进程环境中的变量保持不变
+    只影响 API Key 等按调用读取的变量，其余设置仍需重启
+    """
+    for key, value in dotenv_values(ENV_PATH).items():
+        if value is not None and key not in _PROCESS_ENV_KEYS:
+            os.environ[key] = value
+
 
 def get_model_config(model_name):
     """根据UI选择的名称，返回具体的配置字典"""
@@ -45,8 +245,9 @@ def get_model_config(model_name):
 
     return {
         "api_key": api_key,
-        "base_url": config_template["base_url"],
+        "base_url": BASE_URL_OVERRIDE or config_template["base_url"],
         "model": config_template["model"],
         "name": model_name,  # 用于UI显示
-        "env_key_name": config_template["env_key"]  # 用于报错提示
+        "env_key_name": config_template["env_key"],  # 用于报错提示
+        "http2": config_template.get("http2", HTTP2_ENABLED)
     }
\ No newline at end of file
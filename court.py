@@ -0,0 +1,632 @@
+# court.py
+# 庭审引擎：Phase 1-3 的流程编排，与 UI 无关
+# Streamlit 页面 (main.py) 与命令行批处理 (batch.py) 共用这一套逻辑
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import get_ai_response, stream_ai_response, is_error
+from cache import should_cache
+from metrics import metrics, estimate_cost
+from prompts import (LAWYER_PROMPTS, JURY_PERSONAS, JUDGE_PROMPT, COURT_SYSTEM_PROMPT, POLL_VOTE_PROMPT, CLERK_PROMPT,
+                     CLERK_ROUND_FORMAT, CLERK_JURY_FORMAT)
+from transcript import Transcript, count_tokens
+from jury_poll import parse_vote, tally, summary_text
+from config import (get_model_config, AUTO_MODEL, JURY_MAX_WORKERS, JURY_CONTEXT_TOKENS, JUDGE_CONTEXT_TOKENS, PREFIX_LAYOUT,
+                    PREFIX_CONTEXT_TOKENS, POLL_MAX_WORKERS, MAP_REDUCE_JUDGE, CLERK_MODEL, CLERK_MAX_TOKENS, CLERK_TOTAL_TOKENS)
+
+
+def build_configs(judge_model, plaintiff_model, defendant_model, jury_models, personas=JURY_PERSONAS):
+    """
+    把模型名称转换成配置字典
+    jury_models: {persona_id: 模型名称}，或一个模型名称（personas 中的陪审员共用）
+    选了 AUTO_MODEL 的角色先记为 None，开庭前由 router.route 分配
+    """
+    if isinstance(jury_models, str):
+        jury_models = {persona['id']: jury_models for persona in personas}
+    def conf(name):
+        return None if name == AUTO_MODEL else get_model_config(name)
+
+    return {
+        "judge": conf(judge_model),
+        "plaintiff": conf(plaintiff_model),
+        "defendant": conf(defendant_model),
+        "jury": {pid: conf(m_name) for pid, m_name in jury_models.items()}
+    }
+
+
+_VERDICT_RE = re.compile(r"【判决结果】\s*[：:]?\s*[（(]?\s*(?:支持)?\s*(原告|被告)")
+
+
+def _model_name(conf):
+    """配置的显示名称；开庭前路由失败时角色仍为 None（自动路由）"""
+    return conf["name"] if conf else AUTO_MODEL
+
+
+def verdict_winner(verdict):
+    """从判决书中取出胜诉方 "plaintiff" / "defendant"；没有写明时返回 None"""
+    match = _VERDICT_RE.search(verdict or "")
+    if not match:
+        return None
+    return "plaintiff" if match.group(1) == "原告" else "defendant"
+
+
+def lawyer_prompt(role, topic, round_idx, last_argument):
+    if role == "plaintiff":
+        return f"话题：'{topic}'。请开篇立论。" if round_idx == 0 else f"话题：'{topic}'。对方说：'{last_argument}'。请反驳！"
+    return f"话题：'{topic}'。原告说：'{last_argument}'。请反驳并立论。" if round_idx == 0 else f"话题：'{topic}'。原告反驳：'{last_argument}'。请回击！"
+
+
+def jury_prompt(persona, transcript_view):
+    return f"庭审记录片段：\n{transcript_view}\n\n请用你的风格（{persona['style']}）点评并投票。"
+
+
+def poll_prompt(transcript_view):
+    return f"庭审记录片段：\n{transcript_view}\n\n{POLL_VOTE_PROMPT.strip()}"
+
+
+def jury_round_prompt(persona, round_idx, round_view):
+    return (f"第 {round_idx + 1} 轮辩论记录：\n{round_view}\n\n"
+            f"请用你的风格（{persona['style']}）用一两句话给出你对这一轮的即时反应，并说明你目前更倾向原告还是被告。")
+
+
+def jury_final_prompt(persona, topic, reactions, round_idx, round_view):
+    notes = "\n".join(f"第 {i + 1} 轮：{text}" for i, text in enumerate(reactions) if text)
+    return (f"案件：{topic}\n你在前几轮辩论中的即时反应：\n{notes}\n\n"
+            f"第 {round_idx + 1} 轮（最后一轮）辩论记录：\n{round_view}\n\n请用你的风格（{persona['style']}）点评并投票。")
+
+
+def judge_prompt(transcript, jury_opinions):
+    return f"""
+            {transcript}
+            ================================================
+            【重要参考】陪审团的投票与意见如下：
+            {chr(10).join(jury_opinions)}
+            ================================================
+            请结合上述辩论记录和陪审团的民意，做出最终判决。
+            请使用清晰的 Markdown 格式（使用 ### 做小标题，**做加粗**）。
+            """
+
+
+# ---------- 分段归纳判决 (map-reduce) ----------
+def clerk_round_prompt(topic, round_idx, round_view):
+    return f"案件：{topic}\n第 {round_idx + 1} 轮辩论记录：\n{round_view}\n\n请按以下格式整理本轮要点：{CLERK_ROUND_FORMAT}"
+
+
+def clerk_jury_prompt(topic, jury_opinions):
+    opinions = "\n".join(jury_opinions)
+    return f"案件：{topic}\n陪审团的投票与意见：\n{opinions}\n\n请按以下格式整理陪审团意见：{CLERK_JURY_FORMAT}"
+
+
+def clerk_merge_prompt(topic, round_extracts):
+    rounds = "\n\n".join(f"第 {i + 1} 轮：\n{text}" for i, text in enumerate(round_extracts))
+    return (f"案件：{topic}\n第 1–{len(round_extracts)} 轮辩论的要点：\n{rounds}\n\n"
+            f"请把这几轮合并成一份要点，保留双方贯穿始终的核心论点与关键反驳，按以下格式整理：{CLERK_ROUND_FORMAT}")
+
+
+def judge_reduce_prompt(topic, round_extracts, jury_extract, merged=None):
+    """round_extracts: [(轮次, 要点)]；merged: (合并的轮数, 要点)，较早的轮次由书记员合并成的一份要点"""
+    rounds = "\n\n".join(f"第 {i + 1} 轮：\n{text}" for i, text in round_extracts)
+    if merged:
+        rounds = "\n\n".join(filter(None, [f"第 1–{merged[0]} 轮（合并）：\n{merged[1]}", rounds]))
+    return f"""
+            案件：{topic}
+            ================================================
+            【各轮辩论要点】（书记员整理）
+            {rounds}
+            ================================================
+            【重要参考】陪审团意见要点：
+            {jury_extract}
+            ================================================
+            请结合上述辩论要点和陪审团的民意，做出最终判决。
+            请使用清晰的 Markdown 格式（使用 ### 做小标题，**做加粗**）。
+            """
+
+
+# ---------- 前缀缓存布局：庭审记录之后的最后一条消息 ----------
+def lawyer_task(role, round_idx):
+    if role == "plaintiff":
+        return "请开篇立论。" if round_idx == 0 else "请针对被告上一段发言进行反驳！"
+    return "请反驳原告并立论。" if round_idx == 0 else "请针对原告上一段反驳进行回击！"
+
+
+def jury_task(persona):
+    return f"请用你的风格（{persona['style']}）点评并投票。"
+
+
+def jury_round_task(persona, round_idx):
+    return (f"第 {round_idx + 1} 轮辩论刚刚结束。请用你的风格（{persona['style']}）用一两句话给出你对这一轮的即时反应，"
+            f"并说明你目前更倾向原告还是被告。")
+
+
+def jury_final_task(persona, reactions):
+    notes = "\n".join(f"第 {i + 1} 轮：{text}" for i, text in enumerate(reactions) if text)
+    return f"你在前几轮辩论中的即时反应：\n{notes}\n\n{jury_task(persona)}"
+
+
+JUDGE_TASK = "请结合上述辩论记录和陪审团的民意，做出最终判决。请使用清晰的 Markdown 格式（使用 ### 做小标题，**做加粗**）。"
+
+
+def role_message(role_prompt, task):
+    """角色设定与任务放在最后：前面的系统提示词与庭审记录对所有角色都相同"""
+    return {"role": "user", "content": f"【你的角色】\n{role_prompt.strip()}\n\n【本次任务】\n{task}"}
+
+
+class Trial:
+    """
+    一场庭审的状态与流程
+    各阶段方法可以单独调用（UI 逐步渲染），也可以用 run() 一次跑完（无界面批处理）
+    """
+
+    def __init__(self, topic, configs, rounds=2, cache_bypass=(), personas=JURY_PERSONAS):
+        self.id = uuid.uuid4().hex[:12]
+        self.created = time.time()
+        self.topic = topic
+        self.configs = configs
+        self.rounds = rounds
+        self.status = "pending"  # pending / queued / running / done / error / cancelled
+        self.phase = None  # debate / jury / judge
+        self.error = None
+        self.stream = False  # 为 True 时把正在生成的文本写入 self.live，供界面轮询展示
+        self.live = {}  # 角色 -> 正在生成中的部分文本
+        self.cache_bypass = set(cache_bypass)  # 本场强制重新采样的角色
+        self.record = Transcript(topic)
+        self.last_argument = ""
+        self.messages = []  # 律师发言: {"role", "round", "model", "requested_model", "content", "timing"}
+        self.personas = personas  # 陪审员人设，默认为 prompts.JURY_PERSONAS
+        self.jury = [None] * len(personas)  # 按席位顺序: {"id", "name", "avatar", "model", "content", "timing"}
+        # 陪审团逐轮旁听：每轮辩论结束就在后台请陪审员给出即时反应，与下一轮辩论重叠进行
+        self.jury_pipeline = False
+        # 前缀缓存友好的提示词布局（见 config.PREFIX_LAYOUT）
+        self.prefix_layout = PREFIX_LAYOUT
+        # 民调模式：personas 为 jury_poll.sample_jurors 抽样的陪审员，每人只给结构化投票，法官读统计摘要
+        self.poll = False
+        self.poll_result = None  # jury_poll.tally 的结果
+        self.routing = None  # 自动路由的分配记录（见 router.route），没有角色选自动路由时为 None
+        # 分段归纳判决：每轮辩论结束就由书记员在后台整理要点，法官只读要点（见 config.MAP_REDUCE_JUDGE）
+        self.map_reduce = MAP_REDUCE_JUDGE
+        # 书记员整理的要点：{"rounds": {轮次: 文本}, "jury": 文本, "merged": (合并的轮数, 文本) 或 None}
+        self.extracts = {"rounds": {}, "jury": None, "merged": None}
+        self._extract_futures = {}  # 轮次 -> Future
+        self._clerk_pool = None
+        self._clerk_conf = None
+        # 分支：从已结束庭审的某一轮或某一阶段分叉（见 branch.fork），此前的发言与投票直接沿用
+        self.fork = None  # {"parent", "point", "inherited", "changes", "reused_calls"}
+        self.start_round = 0  # 辩论从这一轮开始，之前的轮次沿用父庭审的发言
+        self.reuse_jury = False  # 为 True 时沿用父庭审的陪审团投票，只重新判决
+        self.reactions = {}  # persona_id -> [每轮的 Future]
+        self._reaction_pool = None
+        self.verdict = None
+        self.judge_timing = {}
+        self.timings = {}  # 各阶段耗时（秒）
+        self.calls = []  # 每次模型调用的埋点记录，见 _record_call
+        self._clock = time.perf_counter()  # 调用记录中 start 的时间起点
+        self._calls_lock = threading.Lock()
+
+    def _call(self, role, system_prompt, user_content, model_conf, consume=None, persona=None):
+        """
+        调用模型并计时
+        consume: 可选，接收 stream_ai_response 生成器并返回完整文本（用于流式渲染）
+        persona: 陪审员 id，仅用于埋点
+        """
+        stats = {}
+        use_cache = should_cache(role) and role not in self.cache_bypass
+        # 陪审员并发作答，共用一个 live 键会互相覆盖，页面也不展示陪审员的流式文本：与 asyncio 引擎一致，不流式
+        if consume is None and self.stream and role not in ("jury", "poll", "clerk"):
+            consume = self._live_consumer(role)
+        start = time.perf_counter()
+        if consume is not None:
+            content = consume(stream_ai_response(system_prompt, user_content, model_conf, stats, use_cache, role, self.id))
+        else:
+            content = get_ai_response(system_prompt, user_content, model_conf, use_cache, stats, role, self.id)
+            stats["total"] = time.perf_counter() - start
+        self._record_call(role, persona, model_conf, start, stats, is_error(content))
+        return content, stats
+
+    def _record_call(self, role, persona, model_conf, start, stats, error):
+        model = stats.get("model", model_conf["name"])
+        prompt_tokens = stats.get("prompt_tokens", 0)
+        completion_tokens = stats.get("completion_tokens", 0)
+        cached_tokens = stats.get("cached_tokens", 0)
+        cache_hit = stats.get("cache_hit", False)
+        call = {
+            "trial": self.id,
+            "role": role,
+            "persona": persona,
+            "model": model,
+            "requested_model": model_conf["name"],
+            "start": start - self._clock,
+            "queue_wait": stats.get("queue_wait", 0.0),
+            "ttft": stats.get("ttft"),
+            "latency": stats.get("total", 0.0),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "cost": 0.0 if cache_hit else estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens),
+            "cache_hit": cache_hit,
+            "error": error,
+        }
+        with self._calls_lock:
+            self.calls.append(call)
+        metrics.record(call)
+
+    def _live_consumer(self, role):
+        def consume(chunks):
+            text = ""
+            for delta in chunks:
+                text += delta
+                self.live[role] = text
+            self.live.pop(role, None)
+            return text
+        return consume
+
+    def _prefixed(self, model_conf, role_prompt, task, upto_round=None, extra=()):
+        """前缀缓存布局的用户消息：共享的庭审记录 + 可选的附加消息 + 角色设定与任务"""
+        # 所有角色共用同一上限，各角色拿到的记录才逐字节相同、可以复用服务端缓存的前缀
+        history = self.record.history(PREFIX_CONTEXT_TOKENS, model_conf["model"], upto_round)
+        return history + list(extra) + [role_message(role_prompt, task)]
+
+    # 以下 *_prompt / _spoke / _ballot 方法只负责拼装提示词与记录结果，
+    # 同步引擎 (本类) 与 asyncio 引擎 (async_court.AsyncTrial) 共用
+    def _speak_prompt(self, role, round_idx):
+        """律师发言的 (系统提示词, 用户内容)"""
+        if self.prefix_layout:
+            return COURT_SYSTEM_PROMPT, self._prefixed(self.configs[role], LAWYER_PROMPTS[role], lawyer_task(role, round_idx))
+        return LAWYER_PROMPTS[role], lawyer_prompt(role, self.topic, round_idx, self.last_argument)
+
+    def speak(self, role, round_idx, consume=None):
+        """律师发言，返回发言内容"""
+        system, prompt = self._speak_prompt(role, round_idx)
+        content, stats = self._call(role, system, prompt, self.configs[role], consume)
+        self._spoke(role, round_idx, content, stats)
+        if role == "defendant" and self._reacts_after(round_idx):
+            self._react_round(round_idx)
+        if role == "defendant" and self.map_reduce:
+            self._extract_futures[round_idx] = self._clerk().submit(self._extract, round_idx)
+        return content
+
+    def _spoke(self, role, round_idx, content, stats):
+        self.last_argument = content
+        self.record.add(role, round_idx, content)
+        self.messages.append({
+            "role": role,
+            "round": round_idx,
+            "model": stats.get("model", self.configs[role]["name"]),  # 实际应答的模型
+            "requested_model": self.configs[role]["name"],
+            "content": content,
+            "timing": stats,
+        })
+
+    def _reacts_after(self, round_idx):
+        """逐轮旁听时，除最后一轮外每轮结束都提交即时反应；最后一轮直接并入汇总投票，辩论结束后每位陪审员只剩一次调用"""
+        return self.jury_pipeline and not self.poll and round_idx < self.rounds - 1
+
+    def _react_round(self, round_idx):
+        """一轮辩论结束：把陪审员的即时反应请求提交到后台线程池"""
+        if self._reaction_pool is None:
+            self._reaction_pool = ThreadPoolExecutor(max_workers=JURY_MAX_WORKERS, thread_name_prefix=f"jury-{self.id}")
+        for persona in self.personas:
+            self.reactions.setdefault(persona['id'], []).append(
+                self._reaction_pool.submit(self._react, persona, round_idx)
+            )
+
+    def _react_prompt(self, persona, round_idx):
+        conf = self.configs["jury"][persona['id']]
+        if self.prefix_layout:
+            return COURT_SYSTEM_PROMPT, self._prefixed(conf, persona['prompt'], jury_round_task(persona, round_idx),
+                                                       upto_round=round_idx)
+        view = self.record.view(JURY_CONTEXT_TOKENS, conf["model"], summary=False, round_idx=round_idx)
+        return persona['prompt'], jury_round_prompt(persona, round_idx, view)
+
+    def _react(self, persona, round_idx):
+        system, prompt = self._react_prompt(persona, round_idx)
+        content, _ = self._call("jury", system, prompt, self.configs["jury"][persona['id']], persona=persona['id'])
+        return None if is_error(content) else content
+
+    def _close_reactions(self):
+        if self._reaction_pool is not None:
+            self._reaction_pool.shutdown(wait=False, cancel_futures=True)
+            self._reaction_pool = None
+
+    def debate(self):
+        self.phase = "debate"
+        start = time.perf_counter()
+        for i in range(self.start_round, self.rounds):
+            self.speak("plaintiff", i)
+            self.speak("defendant", i)
+        self.timings["debate"] = time.perf_counter() - start
+
+    def _vote_prompt(self, persona, reactions):
+        conf = self.configs["jury"][persona['id']]
+        if self.poll:
+            if self.prefix_layout:
+                return COURT_SYSTEM_PROMPT, self._prefixed(conf, persona['prompt'], POLL_VOTE_PROMPT.strip())
+            return persona['prompt'], poll_prompt(self.record.view(JURY_CONTEXT_TOKENS, conf["model"]))
+        if self.prefix_layout:
+            # 完整记录已作为共享前缀缓存在服务端，逐轮旁听时再附上自己的即时反应
+            task = jury_final_task(persona, reactions) if any(reactions) else jury_task(persona)
+            return COURT_SYSTEM_PROMPT, self._prefixed(conf, persona['prompt'], task)
+        if any(reactions):
+            # 逐轮旁听过：根据自己前几轮的即时反应，加上最后一轮的记录，做一次汇总投票
+            last_round = self.messages[-1]["round"]
+            view = self.record.view(JURY_CONTEXT_TOKENS, conf["model"], summary=False, round_idx=last_round)
+            return persona['prompt'], jury_final_prompt(persona, self.topic, reactions, last_round, view)
+        view = self.record.view(JURY_CONTEXT_TOKENS, conf["model"])
+        return persona['prompt'], jury_prompt(persona, view)
+
+    def _vote(self, persona):
+        futures = self.reactions.get(persona['id'])
+        reactions = [future.result() for future in futures] if futures else []
+        system, prompt = self._vote_prompt(persona, reactions)
+        content, stats = self._call(self.jury_role, system, prompt, self.configs["jury"][persona['id']],
+                                    persona=persona['id'])
+        return self._ballot(persona, reactions, content, stats)
+
+    @property
+    def jury_role(self):
+        """陪审员投票调用的角色名：民调模式为 "poll"（要求 JSON 输出、限制长度，见 utils._request_options）"""
+        return "poll" if self.poll else "jury"
+
+    def _ballot(self, persona, reactions, content, stats):
+        conf = self.configs["jury"][persona['id']]
+        vote = {
+            "id": persona['id'],
+            "name": persona['name'],
+            "avatar": persona['avatar'],
+            "model": stats.get("model", conf['name']),
+            "requested_model": conf['name'],
+            "content": content,
+            "reactions": reactions,
+            "timing": stats,
+        }
+        if self.poll:
+            vote.update(parse_vote(content), template=persona.get("template"))
+        return vote
+
+    def _tally(self):
+        if self.poll:
+            self.poll_result = tally([vote for vote in self.jury if vote])
+
+    def deliberate(self, concurrent=True, max_workers=JURY_MAX_WORKERS, on_start=None, on_vote=None):
+        """
+        陪审团合议
+        on_start(idx, persona): 串行模式下每位陪审员开始前回调
+        on_vote(idx, vote, done): 每位陪审员完成后在调用线程中回调，done 为已完成人数
+        """
+        self.phase = "jury"
+        start = time.perf_counter()
+        if self.poll:
+            max_workers = max(max_workers, POLL_MAX_WORKERS)
+        if concurrent:
+            # 线程池里只做 API 请求，回调留在调用线程，便于 UI 渲染
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(self.personas))) as pool:
+                futures = {pool.submit(self._vote, persona): idx for idx, persona in enumerate(self.personas)}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    idx = futures[future]
+                    self.jury[idx] = future.result()
+                    if on_vote:
+                        on_vote(idx, self.jury[idx], done)
+        else:
+            for idx, persona in enumerate(self.personas):
+                if on_start:
+                    on_start(idx, persona)
+                self.jury[idx] = self._vote(persona)
+                if on_vote:
+                    on_vote(idx, self.jury[idx], idx + 1)
+        self._close_reactions()
+        self._tally()
+        self.timings["jury"] = time.perf_counter() - start
+
+    @property
+    def transcript(self):
+        return self.record.text()
+
+    @property
+    def jury_opinions(self):
+        if self.poll:
+            # 数百条意见只汇总成一段统计摘要，法官的提示词规模不随人数增长
+            return [summary_text(self.poll_result)] if self.poll_result else []
+        return [f"【陪审员-{vote['name']}】: {vote['content']}" for vote in self.jury if vote]
+
+    # ---------- 分段归纳判决 ----------
+    @property
+    def clerk_config(self):
+        """书记员的模型：CYBERGAVEL_CLERK_MODEL，未设置时用第一位陪审员的模型"""
+        if self._clerk_conf is None:
+            self._clerk_conf = get_model_config(CLERK_MODEL) if CLERK_MODEL else next(iter(self.configs["jury"].values()))
+        return self._clerk_conf
+
+    def _clerk(self):
+        if self._clerk_pool is None:
+            self._clerk_pool = ThreadPoolExecutor(max_workers=JURY_MAX_WORKERS, thread_name_prefix=f"clerk-{self.id}")
+        return self._clerk_pool
+
+    def _close_clerk(self):
+        if self._clerk_pool is not None:
+            self._clerk_pool.shutdown(wait=False, cancel_futures=True)
+            self._clerk_pool = None
+
+    def _debated_rounds(self):
+        """已有发言的轮次（asyncio 引擎的辩论超时时，最后一轮可能只有原告发言）"""
+        return sorted({turn["round"] for turn in self.record.turns})
+
+    def _clerk_prompt(self, key):
+        """key 为轮次时整理该轮辩论，为 "jury" 时整理陪审团意见，为 "merged" 时合并较早各轮的要点"""
+        if key == "jury":
+            return CLERK_PROMPT, clerk_jury_prompt(self.topic, self.jury_opinions)
+        if key == "merged":
+            return CLERK_PROMPT, clerk_merge_prompt(self.topic, [self.extracts["rounds"][i] for i in self._merged_rounds()])
+        view = self.record.view(JUDGE_CONTEXT_TOKENS, self.clerk_config["model"], summary=False, round_idx=key)
+        return CLERK_PROMPT, clerk_round_prompt(self.topic, key, view)
+
+    def _extracted(self, key, content):
+        """记录要点；书记员调用失败时退回原文的结尾，长度同样受 CLERK_MAX_TOKENS 约束"""
+        if is_error(content):
+            if key == "jury":
+                # 每条意见按字数截断（一个汉字约一个 token）
+                chars = CLERK_MAX_TOKENS // max(len(self.jury_opinions), 1)
+                content = "\n".join(opinion[:chars] for opinion in self.jury_opinions)
+            elif key == "merged":
+                texts = [self.extracts["rounds"][i] for i in self._merged_rounds()]
+                chars = CLERK_MAX_TOKENS // len(texts)
+                content = "\n".join(f"第 {i + 1} 轮：{text[:chars]}" for i, text in enumerate(texts))
+            else:
+                content = self.record.view(CLERK_MAX_TOKENS, self.configs["judge"]["model"], summary=False,
+                                           round_idx=key)
+        if key == "jury":
+            self.extracts["jury"] = content
+        elif key == "merged":
+            self.extracts["merged"] = (len(self._merged_rounds()), content)
+        else:
+            self.extracts["rounds"][key] = content
+        return content
+
+    def _merged_rounds(self):
+        """
+        各轮要点总量超出 CLERK_TOTAL_TOKENS 时需要合并的较早轮次（从第 1 轮起连续）
+        从最近一轮往前保留原样，直到剩下的预算只够放一份合并要点
+        """
+        rounds = sorted(self.extracts["rounds"])
+        model = self.clerk_config["model"]  # 按书记员的模型估算，只换法官的分支可以沿用父庭审的合并要点
+        sizes = [count_tokens(self.extracts["rounds"][i], model) for i in rounds]
+        if sum(sizes) <= CLERK_TOTAL_TOKENS:
+            return []
+        remaining = CLERK_TOTAL_TOKENS - CLERK_MAX_TOKENS
+        kept = 0
+        for size in reversed(sizes):
+            if size > remaining:
+                break
+            remaining -= size
+            kept += 1
+        return rounds[:len(rounds) - kept]
+
+    def _needs_merge(self):
+        """需要合并较早的轮次，且没有涵盖同样轮次的合并要点（分支可能已从父庭审沿用）"""
+        merged_rounds, merged = self._merged_rounds(), self.extracts["merged"]
+        return bool(merged_rounds) and not (merged and merged[0] == len(merged_rounds))
+
+    def _extract(self, key):
+        system, prompt = self._clerk_prompt(key)
+        content, _ = self._call("clerk", system, prompt, self.clerk_config)
+        return self._extracted(key, content)
+
+    def _map(self):
+        """
+        map 阶段：等待辩论中已提交的各轮整理，补上缺失的轮次，同时整理陪审团意见
+        各轮要点超出总量预算时再合并较早的轮次（与陪审团意见的整理并行）
+        民调模式的陪审团已有固定长度的统计摘要，无需再整理
+        """
+        pool = self._clerk()
+        # 分支庭审从父庭审继承的要点已在 extracts 中，不再重复整理
+        futures = [self._extract_futures.get(i) or pool.submit(self._extract, i)
+                   for i in self._debated_rounds() if i not in self.extracts["rounds"]]
+        jury_future = None
+        if self.poll:
+            self.extracts["jury"] = "\n".join(self.jury_opinions)
+        elif self.extracts["jury"] is None:
+            jury_future = pool.submit(self._extract, "jury")
+        for future in futures:
+            future.result()
+        if self._needs_merge():
+            self._extract("merged")
+        if jury_future is not None:
+            jury_future.result()
+
+    def _judge_prompt(self):
+        conf = self.configs["judge"]
+        if self.map_reduce:
+            merged = self.extracts["merged"] if self._merged_rounds() else None
+            rounds = [(i, self.extracts["rounds"][i]) for i in sorted(self.extracts["rounds"]) if not merged or i >= merged[0]]
+            return JUDGE_PROMPT, judge_reduce_prompt(self.topic, rounds, self.extracts["jury"], merged)
+        if self.prefix_layout:
+            opinions = {"role": "user", "content": "【陪审团的投票与意见】\n" + "\n".join(self.jury_opinions)}
+            return COURT_SYSTEM_PROMPT, self._prefixed(conf, JUDGE_PROMPT, JUDGE_TASK, extra=[opinions])
+        view = self.record.view(JUDGE_CONTEXT_TOKENS, conf["model"])
+        return JUDGE_PROMPT, judge_prompt(view, self.jury_opinions)
+
+    def judge(self, consume=None):
+        """法官判决，返回判决书 Markdown"""
+        self.phase = "judge"
+        start = time.perf_counter()
+        if self.map_reduce:
+            self._map()
+            self.timings["map"] = time.perf_counter() - start
+        system, prompt = self._judge_prompt()
+        self.verdict, self.judge_timing = self._call("judge", system, prompt, self.configs["judge"], consume)
+        self.timings["judge"] = time.perf_counter() - start
+        return self.verdict
+
+    def run(self, concurrent_jury=True):
+        """无界面完整运行一场庭审"""
+        self.status = "running"
+        start = time.perf_counter()
+        try:
+            self.debate()
+            if not self.reuse_jury:
+                self.deliberate(concurrent=concurrent_jury)
+            self.judge()
+        except Exception as e:
+            self.status = "error"
+            self.error = str(e)
+            raise
+        finally:
+            self._close_reactions()
+            self._close_clerk()
+            self.timings["total"] = time.perf_counter() - start
+        self.status = "done"
+        return self
+
+    def start(self, concurrent_jury=True, on_finish=None):
+        """
+        在后台线程中运行庭审并立即返回
+        Streamlit 的 rerun 不会打断后台线程，页面只需按状态重绘即可
+        on_finish(trial): 结束（包括出错）后在后台线程中回调
+        """
+        def target():
+            try:
+                self.run(concurrent_jury=concurrent_jury)
+            except Exception:
+                pass  # 错误已记录在 self.status / self.error
+            if on_finish:
+                on_finish(self)
+
+        self.status = "running"
+        thread = threading.Thread(target=target, name=f"trial-{self.id}", daemon=True)
+        thread.start()
+        return thread
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "created": self.created,
+            "status": self.status,
+            "phase": self.phase,
+            "error": self.error,
+            "topic": self.topic,
+            "rounds": self.rounds,
+            "prefix_layout": self.prefix_layout,
+            "poll_size": len(self.personas) if self.poll else 0,
+            "poll": self.poll_result,
+            "routing": self.routing,
+            "fork": self.fork,
+            "extracts": {
+                "model": _model_name(self.clerk_config),
+                "rounds": [self.extracts["rounds"][i] for i in sorted(self.extracts["rounds"])],
+                "jury": self.extracts["jury"],
+                "merged": self.extracts["merged"] and list(self.extracts["merged"]),
+            } if self.map_reduce else None,
+            "models": {
+                "judge": _model_name(self.configs["judge"]),
+                "plaintiff": _model_name(self.configs["plaintiff"]),
+                "defendant": _model_name(self.configs["defendant"]),
+                "jury": {pid: _model_name(conf) for pid, conf in self.configs["jury"].items()},
+            },
+            "transcript": list(self.messages),
+            "jury": [vote for vote in self.jury if vote],
+            "verdict": self.verdict,
+            "verdict_timing": self.judge_timing,
+            "timings": dict(self.timings),
+            "calls": list(self.calls),
+            "live": dict(self.live),
+        }
\ No newline at end of file
@@ -0,0 +1,264 @@
+# export.py
+# 整场庭审导出：每轮律师发言、陪审员卡片、判决书与逐次调用的元数据，支持 HTML / Markdown / JSONL，可选 gzip 压缩
+# 导出由生成器逐块产出，写文件、压缩、打包时都不必把整份文档拼在内存里；批量导出时内存只与单场庭审的大小有关
+# HTML 中的发言、卡片与判决书直接用页面的渲染函数 (styles.render_*)，同一段文本只转换一次 (见 styles.md_to_html)
+#
+# 用法:
+#   python export.py 3f2a9c1b7d4e -f md -o trial.md            # 单场庭审，输出文件以 .gz 结尾时压缩
+#   python export.py -o bundle.zip -f html jsonl --query 版权    # 档案库中的多场庭审打包为一个 zip
+import argparse
+import html
+import json
+import sys
+import time
+import zipfile
+import zlib
+import styles
+
+ROLE_TITLES = {"plaintiff": "🦁 原告律师", "defendant": "🦈 被告律师"}
+
+_EXPORT_CSS = """
+    <style>
+    body { background-color: #1a1a2e; color: #e0e0e0; font-family: sans-serif; margin: 0; padding: 32px; }
+    .trial-meta { color: #aaa; font-size: 0.9rem; line-height: 1.8; margin-bottom: 24px; }
+    .round { display: grid; grid-template-columns: 1fr 1fr; gap: 16px; margin-bottom: 12px; }
+    .round .lawyer-box { height: auto; max-height: none; }
+    .jury { display: grid; grid-template-columns: repeat(auto-fill, minmax(220px, 1fr)); gap: 12px; }
+    .timing { color: #888; font-size: 0.8rem; margin: 4px 0 12px; }
+    table.calls { border-collapse: collapse; font-size: 0.8rem; width: 100%; }
+    table.calls th, table.calls td { border: 1px solid #333; padding: 4px 8px; text-align: right; }
+    table.calls td:first-child, table.calls td:nth-child(2), table.calls td:nth-child(3) { text-align: left; }
+    </style>
+"""
+# 调用明细的列：(表头, 字段, 格式)
+CALL_COLUMNS = [
+    ("角色", "role", "{}"), ("陪审员", "persona", "{}"), ("模型", "model", "{}"), ("开始(s)", "start", "{:.2f}"),
+    ("排队(s)", "queue_wait", "{:.2f}"), ("首字(s)", "ttft", "{:.2f}"), ("耗时(s)", "latency", "{:.2f}"),
+    ("输入", "prompt_tokens", "{}"), ("输出", "completion_tokens", "{}"), ("缓存", "cached_tokens", "{}"),
+    ("费用(¥)", "cost", "{:.5f}"), ("错误", "error", "{}"),
+]
+
+
+def _model_label(item):
+    if item.get("requested_model") and item["requested_model"] != item["model"]:
+        return f"{item['model']} (替补 {item['requested_model']})"
+    return item["model"]
+
+
+def _timing(stats):
+    if stats.get("ttft") is not None:
+        return f"首字 {stats['ttft']:.2f}s · 总耗时 {stats.get('total', 0.0):.2f}s"
+    if "total" in stats:
+        return f"总耗时 {stats['total']:.2f}s"
+    return ""
+
+
+def _cell(call, key, fmt):
+    value = call.get(key)
+    return "" if value is None or value is False else fmt.format(value)
+
+
+def _meta_lines(data):
+    """庭审概况：编号、时间、状态、各角色模型"""
+    models = data["models"]
+    jury_models = sorted(set(models["jury"].values()))
+    lines = [
+        f"编号 {data['id']} · {time.strftime('%Y-%m-%d %H:%M', time.localtime(data['created']))} · 状态 {data['status']}"
+        + (f"（{data['error']}）" if data.get("error") else ""),
+        f"法官 {models['judge']} · 原告 {models['plaintiff']} · 被告 {models['defendant']} · "
+        f"陪审团 {', '.join(jury_models)} · 辩论 {data['rounds']} 轮",
+    ]
+    if data.get("fork"):
+        lines.append(f"分支自 {data['fork']['parent']}（{data['fork']['point']}）")
+    if data["timings"].get("total") is not None:
+        lines.append(f"总耗时 {data['timings']['total']:.1f}s · 调用 {len(data['calls'])} 次 · "
+                     f"费用 ¥{sum(call.get('cost') or 0.0 for call in data['calls']):.4f}")
+    return lines
+
+
+def _poll_line(poll):
+    counts = poll["counts"]
+    return (f"民调：支持原告 {counts['plaintiff']} · 支持被告 {counts['defendant']} · 弃权 {counts['abstain']} · "
+            f"加权得分 {poll['score']:+.2f}")
+
+
+def iter_html(data, verdict_html=None):
+    """整场庭审的独立 HTML 页面；verdict_html 可传入页面上已转换好的判决书"""
+    yield f'<!DOCTYPE html>\n<html lang="zh-CN">\n<head>\n<meta charset="UTF-8">\n' \
+          f'<title>CyberGavel · {html.escape(data["topic"])}</title>\n'
+    yield styles.APP_CSS
+    yield _EXPORT_CSS
+    yield f'</head>\n<body>\n<h1>⚖️ {html.escape(data["topic"])}</h1>\n<div class="trial-meta">'
+    yield "<br>".join(html.escape(line) for line in _meta_lines(data)) + "</div>\n"
+
+    yield "<h2>⚔️ 控辩双方</h2>\n"
+    current = None
+    for msg in data["transcript"]:
+        if msg["round"] != current:
+            yield ("</div>\n" if current is not None else "") + f'<h3>第 {msg["round"] + 1} 轮</h3>\n<div class="round">'
+            current = msg["round"]
+        yield "<div>" + styles.render_lawyer_message(msg["role"], msg["content"], _model_label(msg))
+        yield f'<div class="timing">⏱️ {_timing(msg["timing"])}</div></div>\n'
+    if current is not None:
+        yield "</div>\n"
+
+    if data["jury"]:
+        yield f'<h2>👥 陪审团（{len(data["jury"])} 人）</h2>\n'
+        if data.get("poll"):
+            yield f'<p>{html.escape(_poll_line(data["poll"]))}</p>\n'
+        yield '<div class="jury">'
+        for vote in data["jury"]:
+            yield styles.render_jury_card(vote["name"], vote["avatar"], vote["content"], _model_label(vote))
+        yield "</div>\n"
+
+    if data.get("verdict"):
+        yield styles.render_verdict(data["verdict"], verdict_html)
+        if data.get("verdict_timing"):
+            yield f'<div class="timing">⏱️ {_timing(data["verdict_timing"])}</div>\n'
+
+    if data["calls"]:
+        yield '<h2>📊 调用明细</h2>\n<table class="calls">\n<tr>'
+        yield "".join(f"<th>{title}</th>" for title, _, _ in CALL_COLUMNS) + "</tr>\n"
+        for call in data["calls"]:
+            yield "<tr>" + "".join(f"<td>{html.escape(_cell(call, key, fmt))}</td>"
+                                   for _, key, fmt in CALL_COLUMNS) + "</tr>\n"
+        yield "</table>\n"
+    yield "</body>\n</html>\n"
+
+
+def iter_markdown(data, verdict_html=None):
+    """整场庭审的 Markdown 文档（verdict_html 不使用，保持与其他格式相同的签名）"""
+    yield f"# ⚖️ {data['topic']}\n\n"
+    yield "".join(f"- {line}\n" for line in _meta_lines(data)) + "\n"
+    yield "## ⚔️ 控辩双方\n\n"
+    for msg in data["transcript"]:
+        yield f"### 第 {msg['round'] + 1} 轮 · {ROLE_TITLES[msg['role']]}（{_model_label(msg)}）\n\n"
+        yield f"{msg['content'].strip()}\n\n> ⏱️ {_timing(msg['timing'])}\n\n"
+    if data["jury"]:
+        yield f"## 👥 陪审团（{len(data['jury'])} 人）\n\n"
+        if data.get("poll"):
+            yield f"{_poll_line(data['poll'])}\n\n"
+        for vote in data["jury"]:
+            yield f"### {vote['avatar']} {vote['name']}（{_model_label(vote)}）\n\n{vote['content'].strip()}\n\n"
+    if data.get("verdict"):
+        yield f"## ⚖️ 最终判决书\n\n{data['verdict'].strip()}\n\n"
+    if data["calls"]:
+        yield "## 📊 调用明细\n\n"
+        yield "| " + " | ".join(title for title, _, _ in CALL_COLUMNS) + " |\n"
+        yield "|" + "---|" * len(CALL_COLUMNS) + "\n"
+        for call in data["calls"]:
+            yield "| " + " | ".join(_cell(call, key, fmt).replace("|", "\\|").replace("\n", " ")
+                                    for _, key, fmt in CALL_COLUMNS) + " |\n"
+
+
+def iter_jsonl(data, verdict_html=None):
+    """每行一条记录：trial（概况）、turn（发言）、vote（陪审员）、verdict、call（调用元数据）"""
+    def line(record):
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    meta = {key: value for key, value in data.items() if key not in ("transcript", "jury", "verdict", "calls", "live")}
+    yield line({"type": "trial", **meta})
+    for msg in data["transcript"]:
+        yield line({"type": "turn", "trial": data["id"], **msg})
+    for vote in data["jury"]:
+        yield line({"type": "vote", "trial": data["id"], **vote})
+    if data.get("verdict") is not None:
+        yield line({"type": "verdict", "trial": data["id"], "content": data["verdict"],
+                    "timing": data.get("verdict_timing")})
+    for call in data["calls"]:
+        yield line({"type": "call", **call})
+
+
+# 格式: (生成器, MIME 类型, 扩展名)
+FORMATS = {
+    "html": (iter_html, "text/html", ".html"),
+    "md": (iter_markdown, "text/markdown", ".md"),
+    "jsonl": (iter_jsonl, "application/x-ndjson", ".jsonl"),
+}
+
+
+def gzip_chunks(chunks, level=6):
+    """把字节块流式压缩为 gzip 格式"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: 带 gzip 头
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def export(data, fmt, compress=False, verdict_html=None):
+    """逐块产出导出内容 (bytes)；data 为 Trial.to_dict() 或档案库中的记录"""
+    chunks = (chunk.encode("utf-8") for chunk in FORMATS[fmt][0](data, verdict_html))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def filename(data, fmt, compress=False):
+    return f"CyberGavel_{data['id']}{FORMATS[fmt][2]}" + (".gz" if compress else "")
+
+
+def write_file(chunks, path):
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def export_archive(archive, path, formats=("html",), ids=None, query=""):
+    """
+    把档案库中的多场庭审写入一个 zip：每场每种格式一个文件，外加 index.jsonl 目录
+    ids 为空时导出 query 匹配的全部庭审（query 为空即全部）；逐场读取、逐块写入。返回导出的场数
+    """
+    if not ids:
+        ids = [row["id"] for row in archive.search(query, limit=archive.count(query))]
+    index = []  # zip 同一时间只能写一个文件，目录最后写入
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+        for trial_id in ids:
+            data = archive.load(trial_id)
+            if data is None:
+                print(f"[export] 档案库中没有庭审 {trial_id}，已跳过")
+                continue
+            for fmt in formats:
+                with bundle.open(filename(data, fmt), "w") as f:
+                    for chunk in export(data, fmt):
+                        f.write(chunk)
+            index.append(json.dumps({
+                "id": data["id"], "topic": data["topic"], "created": data["created"], "status": data["status"],
+                "judge_model": data["models"]["judge"], "parent": (data.get("fork") or {}).get("parent"),
+                "files": [filename(data, fmt) for fmt in formats],
+            }, ensure_ascii=False))
+        bundle.writestr("index.jsonl", "\n".join(index) + "\n")
+    return len(index)
+
+
+def main(argv=None):
+    from archive import TrialArchive
+    from config import ARCHIVE_PATH
+
+    parser = argparse.ArgumentParser(description="CyberGavel 整场庭审导出")
+    parser.add_argument("ids", nargs="*", help="庭审编号；打包为 zip 时可省略，表示导出 --query 匹配的全部庭审")
+    parser.add_argument("-o", "--output", required=True,
+                        help="输出文件：以 .zip 结尾时打包多场庭审，以 .gz 结尾时压缩单场庭审")
+    parser.add_argument("-f", "--format", nargs="+", default=["html"], choices=list(FORMATS), help="导出格式")
+    parser.add_argument("--query", default="", help="打包时按话题或关键词筛选")
+    parser.add_argument("--archive", default=ARCHIVE_PATH, help="档案库路径")
+    args = parser.parse_args(argv)
+
+    if not args.archive:
+        parser.error("档案库未启用 (CYBERGAVEL_ARCHIVE 为空)")
+    archive = TrialArchive(args.archive)
+    if args.output.endswith(".zip"):
+        count = export_archive(archive, args.output, args.format, args.ids, args.query)
+        print(f"已导出 {count} 场庭审到 {args.output}")
+        return 0
+    if len(args.ids) != 1 or len(args.format) != 1:
+        parser.error("导出单个文件时需要恰好一个庭审编号和一种格式（多场庭审请输出为 .zip）")
+    data = archive.load(args.ids[0])
+    if data is None:
+        parser.error(f"档案库中没有庭审 {args.ids[0]}")
+    write_file(export(data, args.format[0], compress=args.output.endswith(".gz")), args.output)
+    print(f"已导出到 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# jobs.py
+# 进程级庭审任务队列：所有会话共用固定数量的工作线程，同时进行的庭审不超过上限，其余按提交顺序排队
+# 队列已满时拒绝新的庭审（准入控制），避免多人同时开庭时并发请求成倍增加、耗尽服务商配额与内存
+# 任务编号即庭审 id；排队中、进行中与最近结束的庭审保存在内存里，浏览器重连后按 id 找回并继续轮询
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from config import MAX_ACTIVE_TRIALS, TRIAL_QUEUE_LIMIT, JOB_RETAIN, TRIAL_ETA_DEFAULT
+import metrics
+
+log = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, workers=MAX_ACTIVE_TRIALS, limit=TRIAL_QUEUE_LIMIT, retain=JOB_RETAIN):
+        self.workers = max(1, workers)
+        self.limit = limit
+        self.retain = retain
+        self._cond = threading.Condition()
+        self._pending = deque()  # (trial, concurrent_jury, on_finish)，按提交顺序
+        self._jobs = OrderedDict()  # 庭审 id -> Trial，排队中、进行中与最近结束的
+        self._started = {}  # 进行中的庭审 id -> 开始时间 (monotonic)
+        self._durations = deque(maxlen=20)  # 最近完成的庭审耗时，用于估算等待时间
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"trial-worker-{i}", daemon=True).start()
+
+    # ---------- 提交与查询 ----------
+    def submit(self, trial, concurrent_jury=True, on_finish=None):
+        """
+        庭审入队并立即返回；队列已满时抛出 QueueFull
+        on_finish(trial): 结束（包括出错、取消）后在工作线程中回调
+        """
+        with self._cond:
+            if len(self._pending) >= self.limit:
+                raise QueueFull(f"当前排队的庭审已达上限 ({self.limit} 场)，请稍后再试")
+            trial.status = "queued"
+            self._pending.append((trial, concurrent_jury, on_finish))
+            self._jobs[trial.id] = trial
+            self._cond.notify()
+        return trial.id
+
+    def get(self, trial_id):
+        """按任务编号取回庭审对象（排队中、进行中或最近结束的），不存在时返回 None"""
+        with self._cond:
+            return self._jobs.get(trial_id)
+
+    def position(self, trial_id):
+        """排在前面的庭审数；不在排队中时返回 None"""
+        with self._cond:
+            for i, (trial, _, _) in enumerate(self._pending):
+                if trial.id == trial_id:
+                    return i
+        return None
+
+    def average_duration(self):
+        with self._cond:
+            durations = list(self._durations)
+        return sum(durations) / len(durations) if durations else TRIAL_ETA_DEFAULT
+
+    def eta(self, trial_id):
+        """
+        预计多少秒后开庭：按平均耗时推算各工作线程何时空闲，依次分配给排在前面的庭审
+        排在队首、有空闲线程时为 0；不在排队中时返回 None
+        """
+        position = self.position(trial_id)
+        if position is None:
+            return None
+        avg = self.average_duration()
+        now = time.monotonic()
+        with self._cond:
+            free_at = [max(avg - (now - started), 0.0) for started in self._started.values()]
+        free_at += [0.0] * (self.workers - len(free_at))
+        heapq.heapify(free_at)
+        for _ in range(position):
+            heapq.heappush(free_at, heapq.heappop(free_at) + avg)
+        return free_at[0]
+
+    def cancel(self, trial_id, reason=None):
+        """取消庭审：排队中的直接移出队列，进行中的交给庭审自身的 cancel()（仅 asyncio 引擎支持）"""
+        with self._cond:
+            for item in self._pending:
+                if item[0].id == trial_id:
+                    self._pending.remove(item)
+                    break
+            else:
+                item = None
+            trial = self._jobs.get(trial_id)
+        if item is not None:
+            trial, _, on_finish = item
+            trial.status = "cancelled"
+            trial.error = reason or "庭审已在排队时取消"
+            self._finished(trial, on_finish)
+        elif trial is not None and hasattr(trial, "cancel"):
+            trial.cancel(reason)
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": len(self._started),
+                "queued": len(self._pending),
+                "limit": self.limit,
+                "avg_duration": self.average_duration(),
+            }
+
+    # ---------- 工作线程 ----------
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                trial, concurrent_jury, on_finish = self._pending.popleft()
+                self._started[trial.id] = time.monotonic()
+            try:
+                trial.run(concurrent_jury=concurrent_jury)
+            except Exception:
+                pass  # 错误已记录在 status / error 中
+            finally:
+                with self._cond:
+                    self._started.pop(trial.id, None)
+                    if trial.status == "done":
+                        self._durations.append(trial.timings.get("total", 0.0))
+            self._finished(trial, on_finish)
+
+    def _finished(self, trial, on_finish):
+        if on_finish:
+            try:
+                on_finish(trial)
+            except Exception:
+                log.exception("庭审 %s 的结束回调出错", trial.id)
+        with self._cond:
+            # 结束的庭审移到末尾，超出保留数量时从最早结束的开始淘汰
+            self._jobs.move_to_end(trial.id)
+            finished = [tid for tid, t in self._jobs.items() if t.status not in ACTIVE_STATUSES]
+            for tid in finished[:max(len(finished) - self.retain, 0)]:
+                del self._jobs[tid]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """进程级任务队列单例，同一个 Streamlit 服务的所有会话共用"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+                metrics.metrics.add_gauge("cybergavel_trials_running", "Trials currently running.",
+                                          lambda: _queue.snapshot()["running"])
+                metrics.metrics.add_gauge("cybergavel_trials_queued", "Trials waiting for a worker.",
+                                          lambda: _queue.snapshot()["queued"])
+    return _queue
@@ -0,0 +1,147 @@
+# jury_poll.py
+# 大规模民调陪审团：从人设模板抽样出 N 名陪审员，每人只给出一条结构化投票 (立场, 置信度, 一句话理由)
+# 投票用 NumPy 汇总为票数、置信度加权得分与分群统计；法官只读一段长度固定的统计摘要，
+# 陪审团从 5 人扩大到数百人时，法官的提示词规模与耗时基本不变
+import json
+import random
+import re
+from prompts import JURY_PERSONAS, POLL_TRAITS
+
+SIDES = ("plaintiff", "defendant", "abstain")
+SIDE_LABELS = {"plaintiff": "原告", "defendant": "被告", "abstain": "弃权"}
+_SIDE_ALIASES = {
+    "plaintiff": "plaintiff", "原告": "plaintiff", "支持原告": "plaintiff",
+    "defendant": "defendant", "被告": "defendant", "支持被告": "defendant",
+    "abstain": "abstain", "弃权": "abstain",
+}
+_SIDE_VALUES = {"plaintiff": 1, "defendant": -1, "abstain": 0}
+_JSON_RE = re.compile(r"\{.*\}", re.S)
+
+# 理由的最大字数，以及摘要中每一方保留的代表性理由条数
+REASON_CHARS = 40
+SUMMARY_REASONS = 3
+
+
+def sample_jurors(size, seed=None, templates=JURY_PERSONAS):
+    """按模板轮流抽样 size 名陪审员，每人随机组合一组 POLL_TRAITS；seed 相同时结果相同"""
+    rng = random.Random(seed)
+    jurors = []
+    for i in range(size):
+        template = templates[i % len(templates)]
+        traits = {name: rng.choice(options) for name, options in POLL_TRAITS.items()}
+        identity = "，".join(f"{name}：{value}" for name, value in traits.items())
+        jurors.append({
+            "id": f"{template['id']}-{i + 1:03d}",
+            "template": template['id'],
+            "name": f"{template['name'].strip()}·{traits['职业']}",
+            "avatar": template['avatar'],
+            "style": template['style'],
+            "prompt": f"{template['prompt'].rstrip()}\n【本次抽样的具体身份】{identity}\n",
+            "traits": traits,
+        })
+    return jurors
+
+
+def parse_vote(text):
+    """从回复中取出 JSON 投票；无法解析（包括调用出错）时按无效票处理，计为弃权"""
+    match = _JSON_RE.search(text or "")
+    try:
+        data = json.loads(match.group(0)) if match else None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return {"side": "abstain", "confidence": 0.0, "reason": "", "valid": False}
+    side = _SIDE_ALIASES.get(str(data.get("side", "")).strip().lower(), "abstain")
+    try:
+        confidence = min(max(float(data.get("confidence", 0.5)), 0.0), 1.0)
+    except (TypeError, ValueError):
+        confidence = 0.5
+    reason = str(data.get("reason") or "").strip()[:REASON_CHARS]
+    return {"side": side, "confidence": confidence if side != "abstain" else 0.0, "reason": reason, "valid": True}
+
+
+def tally(votes, templates=JURY_PERSONAS):
+    """
+    votes: Trial.jury 中的投票（含 side / confidence / reason / valid / template 字段）
+    返回可直接写入 JSON 的统计结果
+    """
+    import numpy as np  # 只有民调模式才需要
+
+    names = {t['id']: t['name'].strip() for t in templates}
+    order = [t['id'] for t in templates]
+    groups = sorted({vote.get("template") for vote in votes}, key=lambda g: order.index(g) if g in order else len(order))
+
+    side = np.array([_SIDE_VALUES[vote.get("side", "abstain")] for vote in votes], dtype=np.int8)
+    confidence = np.array([vote.get("confidence", 0.0) for vote in votes], dtype=np.float64)
+    valid = np.array([bool(vote.get("valid")) for vote in votes])
+    group = np.array([groups.index(vote.get("template")) for vote in votes], dtype=np.intp)
+    cast = side != 0
+    weighted = side * confidence
+
+    plaintiff, defendant = int((side == 1).sum()), int((side == -1).sum())
+    n_cast = plaintiff + defendant
+    share = plaintiff / n_cast if n_cast else 0.5
+    result = {
+        "size": len(votes),
+        "valid": int(valid.sum()),
+        "counts": {"plaintiff": plaintiff, "defendant": defendant, "abstain": len(votes) - n_cast},
+        "plaintiff_share": share,
+        # 原告得票率的 95% 置信区间半宽（正态近似）
+        "margin": float(1.96 * np.sqrt(share * (1 - share) / n_cast)) if n_cast else 1.0,
+        # 置信度加权得分：+1 为一致强烈支持原告，-1 为一致强烈支持被告，只计有效立场
+        "score": float(weighted[cast].mean()) if n_cast else 0.0,
+        "mean_confidence": float(confidence[cast].mean()) if n_cast else 0.0,
+        "groups": [],
+        "reasons": {},
+    }
+
+    k = len(groups)
+    sizes = np.bincount(group, minlength=k)
+    g_plaintiff = np.bincount(group, weights=side == 1, minlength=k)
+    g_defendant = np.bincount(group, weights=side == -1, minlength=k)
+    g_score = np.bincount(group, weights=weighted, minlength=k)
+    g_cast = g_plaintiff + g_defendant
+    for i, g in enumerate(groups):
+        result["groups"].append({
+            "template": g,
+            "name": names.get(g, g or "其他"),
+            "size": int(sizes[i]),
+            "plaintiff": int(g_plaintiff[i]),
+            "defendant": int(g_defendant[i]),
+            "abstain": int(sizes[i] - g_cast[i]),
+            "score": float(g_score[i] / g_cast[i]) if g_cast[i] else 0.0,
+        })
+
+    # 每一方置信度最高、且理由不重复的几条
+    ranked = np.argsort(-confidence, kind="stable")
+    for key, value in (("plaintiff", 1), ("defendant", -1)):
+        picked = []
+        for idx in ranked[side[ranked] == value]:
+            reason = votes[idx].get("reason")
+            if reason and reason not in picked:
+                picked.append(reason)
+            if len(picked) == SUMMARY_REASONS:
+                break
+        result["reasons"][key] = picked
+    return result
+
+
+def summary_text(result):
+    """给法官看的统计摘要：行数只与人设模板数有关，与陪审团人数无关"""
+    counts = result["counts"]
+    cast = counts["plaintiff"] + counts["defendant"]
+    lines = [
+        f"【陪审团民调】共 {result['size']} 人，有效投票 {result['valid']} 张",
+        f"- 支持原告 {counts['plaintiff']} 票，支持被告 {counts['defendant']} 票，弃权 {counts['abstain']} 票"
+        + (f"；原告得票率 {result['plaintiff_share']:.0%}（95% 置信区间 ±{result['margin']:.0%}）" if cast else ""),
+        f"- 置信度加权得分 {result['score']:+.2f}（+1 为一致强烈支持原告，-1 为一致强烈支持被告），"
+        f"平均置信度 {result['mean_confidence']:.2f}",
+        "- 分群统计：" + "；".join(
+            f"{g['name']} {g['size']} 人，原告 {g['plaintiff']} / 被告 {g['defendant']}，得分 {g['score']:+.2f}"
+            for g in result["groups"]
+        ),
+    ]
+    for side in ("plaintiff", "defendant"):
+        if result["reasons"].get(side):
+            lines.append(f"- 支持{SIDE_LABELS[side]}的代表性理由：" + "；".join(result["reasons"][side]))
+    return "\n".join(lines)
@@ -1,14 +1,28 @@
 # main.py
-import streamlit as st
 import time
+import streamlit as st
 import styles
-from utils import get_ai_response
-from prompts import LAWYER_PROMPTS, JURY_PERSONAS, JUDGE_PROMPT
-# 【新增】引入配置文件的模型池和获取函数
-from config import AVAILABLE_MODELS, get_model_config
-
+from prompts import JURY_PERSONAS
+from court import Trial, build_configs
+from async_court import AsyncTrial
+from store import get_store
+from archive import get_archive
+from jobs import get_queue, QueueFull, ACTIVE_STATUSES
+from jury_poll import sample_jurors, SIDE_LABELS
+from router import route, needs_routing, describe
+from branch import fork, fork_points, describe_fork, tree_lines
+import export
+# 【新增】引入配置文件的模型池
+from config import (AVAILABLE_MODELS, AUTO_MODEL, TRIAL_POLL_INTERVAL, ARCHIVE_PAGE_SIZE, PREFIX_LAYOUT, ASYNC_ENGINE,
+                    POLL_DEFAULT_SIZE, POLL_MAX_SIZE, MAP_REDUCE_JUDGE, MAX_ROUNDS, env_signature, reload_env)
+from cache import get_cache
+import metrics
+
+_run_started = time.perf_counter()
 st.set_page_config(page_title="CyberGavel", page_icon="⚖️", layout="wide")
 styles.apply_custom_css()
+# 配置了 CYBERGAVEL_METRICS_PORT 时启动 /metrics 端点（进程内只启动一次）
+metrics.serve()
 
 # ==========================================
 # 侧边栏：模型选角中心
@@ -17,36 +31,68 @@ with st.sidebar:
     st.title("⚙️ 庭审配置中心")
 
     # 1. 获取所有可用模型的名称列表 (来自 config.py)
-    model_names = list(AVAILABLE_MODELS.keys())
+    # 排在最前的「自动路由」按各模型近期的延迟、错误率与费用在开庭前分配 (见 router.py)
+    model_names = [AUTO_MODEL] + list(AVAILABLE_MODELS.keys())
 
     st.markdown("### 1. 法官设置")
-    # 默认 index=0 (通常是 DeepSeek)
-    judge_model_name = st.selectbox("👨‍⚖️ 法官模型", model_names, index=0)
+    # 默认 index=1 (通常是 DeepSeek)
+    judge_model_name = st.selectbox("👨‍⚖️ 法官模型", model_names, index=1)
 
     st.markdown("### 2. 律师设置")
     col_l1, col_l2 = st.columns(2)
     with col_l1:
-        # 默认 index=1 (通常是 Qwen-Plus)
-        plaintiff_model_name = st.selectbox("🦁 原告模型", model_names, index=1)
+        # 默认 index=2 (通常是 Qwen-Plus)
+        plaintiff_model_name = st.selectbox("🦁 原告模型", model_names, index=2)
     with col_l2:
-        defendant_model_name = st.selectbox("🦈 被告模型", model_names, index=1)
+        defendant_model_name = st.selectbox("🦈 被告模型", model_names, index=2)
 
     st.markdown("### 3. 陪审团与流程")
-    rounds = st.slider("🗣️ 辩论回合数", 1, 4, 2)
+    rounds = st.slider("🗣️ 辩论回合数", 1, MAX_ROUNDS, min(2, MAX_ROUNDS))
 
     # 使用 Expander 折叠陪审团详细配置，避免侧边栏过长
     jury_configs = {}
     with st.expander("👥 点击配置 5 位陪审员模型", expanded=False):
         for persona in JURY_PERSONAS:
-            # 默认给陪审团选稍微便宜或快速的模型 (index=2, e.g., Qwen-Turbo or Kimi)
+            # 默认给陪审团选稍微便宜或快速的模型 (index=3, e.g., Qwen-Turbo or Kimi)
             selected = st.selectbox(
                 f"{persona['avatar']} {persona['name']}",
                 model_names,
-                index=2,
+                index=3,
                 key=f"jury_{persona['id']}"
             )
             jury_configs[persona['id']] = selected
 
+    # 民调模式：以上面 5 种人设为模板抽样出几十到几百名陪审员，每人只投一票，法官读统计摘要而不是逐条意见
+    poll_mode = st.toggle("🗳️ 大规模民调陪审团", value=False)
+    if poll_mode:
+        poll_size = st.slider("🧑‍🤝‍🧑 民调陪审员人数", 10, POLL_MAX_SIZE, POLL_DEFAULT_SIZE, step=10)
+        poll_model_name = st.selectbox("🗳️ 民调陪审员模型", model_names, index=3)
+
+    # 陪审员之间互不依赖，并发合议时耗时取决于最慢的一位而不是五位之和
+    concurrent_jury = st.toggle("⚡ 陪审团并发合议", value=True)
+    # 每轮辩论结束后陪审团就在后台给出即时反应，辩论结束时只剩一次简短的汇总投票
+    pipelined_jury = st.toggle("🔁 陪审团逐轮旁听", value=False)
+    # 律师与法官边生成边显示，等待时间从整段生成缩短到首字延迟
+    stream_output = st.toggle("🌊 流式输出", value=True)
+    # 各角色共用稳定的提示词前缀，服务端前缀缓存命中的输入 token 更便宜、首字更快
+    prefix_layout = st.toggle("🧩 前缀缓存友好的提示词布局", value=PREFIX_LAYOUT)
+    # 所有庭审共用一个事件循环，可随时停止；超过分阶段预算的陪审员视为弃权
+    async_engine = st.toggle("🧵 asyncio 引擎（可停止、限时）", value=ASYNC_ENGINE)
+    # 书记员逐轮整理辩论要点、汇总陪审团意见，法官只读要点：辩论再长，判决的输入规模与耗时也基本不变
+    map_reduce = st.toggle("🧾 分段归纳判决（书记员先整理要点）", value=MAP_REDUCE_JUDGE)
+
+    # 开启缓存后 (CYBERGAVEL_CACHE=1)，相同请求直接复用上次回复；可按角色强制重新生成
+    cache_bypass = []
+    response_cache = get_cache()
+    if response_cache is not None:
+        cache_bypass = st.multiselect(
+            "♻️ 以下角色强制重新生成 (不使用缓存)",
+            ["plaintiff", "defendant", "jury", "judge"],
+            format_func=lambda r: {"plaintiff": "原告", "defendant": "被告", "jury": "陪审团", "judge": "法官"}[r]
+        )
+        cache_stats = response_cache.stats()
+        st.caption(f"缓存命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} (命中率 {cache_stats['hit_rate']:.0%})")
+
 st.title("⚖️ 赛博公堂")
 st.caption(f"当前裁判: {judge_model_name} | 控方: {plaintiff_model_name} vs 辩方: {defendant_model_name}")
 
@@ -55,143 +101,526 @@ st.caption(f"当前裁判: {judge_model_name} | 控方: {plaintiff_model_name} v
 # ==========================================
 # 在循环开始前，先把用户选的名字转换成 config.py 里的配置字典
 # 这样如果缺少 API Key，在这里就会报错提示，而不是等到运行一半时报错
+@st.cache_resource(show_spinner=False)
+def resolve_configs(judge, plaintiff, defendant, jury_items, env_version):
+    """
+    进程内共享的配置缓存，只改侧边栏的 rerun 直接命中
+    env_version 为 .env 的修改时间：修改 .env 后缓存失效，重新读取 API Key
+    """
+    reload_env()
+    return build_configs(judge, plaintiff, defendant, dict(jury_items))
+
+
 try:
-    CONFIGS = {
-        "judge": get_model_config(judge_model_name),
-        "plaintiff": get_model_config(plaintiff_model_name),
-        "defendant": get_model_config(defendant_model_name),
-        "jury": {pid: get_model_config(m_name) for pid, m_name in jury_configs.items()}
-    }
+    CONFIGS = resolve_configs(judge_model_name, plaintiff_model_name, defendant_model_name,
+                              tuple(sorted(jury_configs.items())), env_signature())
+    if poll_mode:
+        # 所有民调陪审员共用一个模型，开庭时再按抽样结果展开
+        POLL_CONFIGS = resolve_configs(judge_model_name, plaintiff_model_name, defendant_model_name,
+                                       (("poll", poll_model_name),), env_signature())
 except ValueError as e:
     st.error(str(e))
     st.stop()  # 如果配置有误（如缺Key），停止运行
 
-# ==========================================
-# 输入区域
-# ==========================================
-topic = st.text_input("📝 输入案件争议焦点：", value="AI生成的画作版权应该归属于提示词作者吗？")
-start_btn = st.button("🔥 开庭审理", type="primary", use_container_width=True)
 
-if start_btn and topic:
-    full_transcript = f"案件：{topic}\n"
-    last_argument = ""
 
-    # ==========================================
-    # Phase 1: 律师辩论
-    # ==========================================
-    st.subheader("⚔️ Phase 1: 控辩双方")
-    st.progress(0.3)
+PHASES = ["debate", "jury", "judge"]
 
-    for i in range(rounds):
-        col_p, col_d = st.columns(2)
 
-        # --- 原告发言 ---
-        with col_p:
-            prompt = f"话题：'{topic}'。请开篇立论。" if i == 0 else f"话题：'{topic}'。对方说：'{last_argument}'。请反驳！"
+def reached(data, phase):
+    """庭审是否已进行到（或越过）某个阶段"""
+    if data["status"] == "done":
+        return True
+    return data["phase"] is not None and PHASES.index(data["phase"]) >= PHASES.index(phase)
 
-            with st.spinner(f"🦁 原告 ({plaintiff_model_name}) 发言中..."):
-                # 【修改】传入具体的配置字典 CONFIGS["plaintiff"]
-                p_msg = get_ai_response(LAWYER_PROMPTS["plaintiff"], prompt, CONFIGS["plaintiff"])
 
-                last_argument = p_msg
-                full_transcript += f"\n[原告]: {p_msg}"
+def show_timing(stats):
+    if "ttft" in stats:
+        st.caption(f"⏱️ 首字 {stats['ttft']:.2f}s · 总耗时 {stats['total']:.2f}s")
+    elif "total" in stats:
+        st.caption(f"⏱️ 总耗时 {stats['total']:.2f}s")
 
-                # 【修改】传入模型名称用于 UI 显示
-                st.markdown(styles.render_lawyer_message("plaintiff", p_msg, plaintiff_model_name),
-                            unsafe_allow_html=True)
 
-        # --- 被告发言 ---
-        with col_d:
-            prompt = f"话题：'{topic}'。原告说：'{last_argument}'。请反驳并立论。" if i == 0 else f"话题：'{topic}'。原告反驳：'{last_argument}'。请回击！"
+def model_label(item):
+    """模型标签：切换到备用模型时同时标出原本选择的模型"""
+    if item.get("requested_model") and item["requested_model"] != item["model"]:
+        return f"{item['model']} (替补 {item['requested_model']})"
+    return item["model"]
 
-            with st.spinner(f"🦈 被告 ({defendant_model_name}) 反击中..."):
-                # 【修改】传入具体的配置字典 CONFIGS["defendant"]
-                d_msg = get_ai_response(LAWYER_PROMPTS["defendant"], prompt, CONFIGS["defendant"])
 
-                last_argument = d_msg
-                full_transcript += f"\n[被告]: {d_msg}"
+def render_debate(data):
+    running = data["status"] == "running"
+    models = data["models"]
+    turns = {(msg["round"], msg["role"]): msg for msg in data["transcript"]}
+    # 下一位发言者：原告、被告交替
+    next_round, next_role = divmod(len(data["transcript"]), 2)
+    next_role = ["plaintiff", "defendant"][next_role]
+    waiting_text = {
+        "plaintiff": f"🦁 原告 ({models['plaintiff']}) 发言中...",
+        "defendant": f"🦈 被告 ({models['defendant']}) 反击中...",
+    }
 
-                # 【修改】传入模型名称用于 UI 显示
-                st.markdown(styles.render_lawyer_message("defendant", d_msg, defendant_model_name),
-                            unsafe_allow_html=True)
+    st.subheader("⚔️ Phase 1: 控辩双方")
+    st.progress(min(len(data["transcript"]) / (2 * data["rounds"]), 1.0))
+
+    for i in range(min(next_round + 1, data["rounds"])):
+        col_p, col_d = st.columns(2)
+        for col, role in ((col_p, "plaintiff"), (col_d, "defendant")):
+            with col:
+                msg = turns.get((i, role))
+                if msg:
+                    # 【修改】传入模型名称用于 UI 显示
+                    st.markdown(styles.render_lawyer_message(role, msg["content"], model_label(msg)),
+                                unsafe_allow_html=True)
+                    show_timing(msg["timing"])
+                elif running and data["phase"] == "debate" and (i, role) == (next_round, next_role):
+                    if data["live"].get(role):
+                        st.markdown(styles.render_lawyer_message(role, data["live"][role], models[role]),
+                                    unsafe_allow_html=True)
+                    else:
+                        st.caption(waiting_text[role])
+
+
+def render_jury(data):
+    running = data["status"] == "running" and data["phase"] == "jury"
+    votes = {vote["id"]: vote for vote in data["jury"]}
 
-    # ==========================================
-    # Phase 2: 陪审团投票
-    # ==========================================
     st.markdown("---")
     st.subheader("👥 Phase 2: 陪审团合议")
 
-    jury_progress_bar = st.progress(0, text="陪审团正在入场...")
-    jury_opinions = []
-    jury_cols = st.columns(len(JURY_PERSONAS))
-
-    for idx, persona in enumerate(JURY_PERSONAS):
-        jury_progress_bar.progress((idx + 1) / len(JURY_PERSONAS), text=f"正在听取 {persona['name']} 的意见...")
+    if running:
+        st.progress(len(votes) / len(JURY_PERSONAS), text=f"陪审团合议中 ({len(votes)}/{len(JURY_PERSONAS)})...")
 
-        with jury_cols[idx]:
-            # 获取当前陪审员对应的配置
-            current_jury_conf = CONFIGS["jury"][persona['id']]
-            model_display_name = current_jury_conf['name']
-
-            with st.spinner(f"{persona['name']} ({model_display_name}) 思考中..."):
-                prompt = f"庭审记录片段：...{full_transcript[-1000:]}\n\n请用你的风格（{persona['style']}）点评并投票。"
-
-                # 【修改】传入该陪审员特定的模型配置
-                content = get_ai_response(persona['prompt'], prompt, current_jury_conf)
-
-                jury_opinions.append(f"【陪审员-{persona['name']}】: {content}")
-
-                # 【修改】UI 渲染
-                st.markdown(styles.render_jury_card(persona['name'], persona['avatar'], content, model_display_name),
+    jury_cols = st.columns(len(JURY_PERSONAS))
+    for col, persona in zip(jury_cols, JURY_PERSONAS):
+        with col:
+            vote = votes.get(persona['id'])
+            if vote:
+                st.markdown(styles.render_jury_card(vote['name'], vote['avatar'], vote['content'], model_label(vote)),
                             unsafe_allow_html=True)
-
-                time.sleep(0.2)
-
-    jury_progress_bar.progress(1.0, text="陪审团合议完毕。")
-    time.sleep(1)
-    jury_progress_bar.empty()
-
-    # ==========================================
-    # Phase 3: 法官判决
-    # ==========================================
+                if any(vote.get("reactions") or []):
+                    with st.expander("逐轮反应"):
+                        for i, text in enumerate(vote["reactions"]):
+                            if text:
+                                st.markdown(f"**第 {i + 1} 轮**：{text}")
+            elif running:
+                st.caption(f"{persona['name']} ({data['models']['jury'][persona['id']]}) 思考中...")
+
+
+def render_poll(data):
+    """民调模式：只展示统计结果，不逐张展示投票卡片"""
+    size = data["poll_size"]
+    votes = data["jury"]
+    st.markdown("---")
+    st.subheader(f"🗳️ Phase 2: 陪审团民调（{size} 人）")
+
+    if data["status"] == "running" and data["phase"] == "jury":
+        st.progress(len(votes) / size, text=f"陪审团投票中 ({len(votes)}/{size})...")
+    result = data.get("poll")
+    if result is None:
+        if not votes:
+            return
+        from jury_poll import tally
+        result = tally(votes)  # 投票进行中：按已收到的票实时统计
+
+    counts = result["counts"]
+    cols = st.columns(4)
+    cols[0].metric("🦁 支持原告", counts["plaintiff"], f"{result['plaintiff_share']:.0%} ± {result['margin']:.0%}",
+                   delta_color="off")
+    cols[1].metric("🦈 支持被告", counts["defendant"])
+    cols[2].metric("🤐 弃权 / 无效", counts["abstain"], f"有效票 {result['valid']}", delta_color="off")
+    cols[3].metric("⚖️ 加权得分", f"{result['score']:+.2f}", "+1 原告 / -1 被告", delta_color="off")
+
+    st.dataframe([{
+        "人设": group["name"], "人数": group["size"], "原告": group["plaintiff"], "被告": group["defendant"],
+        "弃权": group["abstain"], "加权得分": round(group["score"], 2),
+    } for group in result["groups"]], hide_index=True, use_container_width=True)
+
+    reason_cols = st.columns(2)
+    for col, side in zip(reason_cols, ("plaintiff", "defendant")):
+        with col:
+            st.markdown(f"**支持{SIDE_LABELS[side]}的代表性理由**")
+            for reason in result["reasons"].get(side) or []:
+                st.caption(f"“{reason}”")
+
+
+def render_judge(data):
     st.markdown("---")
     st.subheader("⚖️ Phase 3: 最终判决")
 
-    with st.status(f"👨‍⚖️ 法官 ({judge_model_name}) 正在审阅卷宗...", expanded=True) as status:
-        st.write("✅ 已阅读双方律师辩词")
-        st.write(f"✅ 已听取 {len(jury_opinions)} 位陪审员的投票意见")
-
-        judge_prompt_content = f"""
-            {full_transcript}
-            ================================================
-            【重要参考】陪审团的投票与意见如下：
-            {chr(10).join(jury_opinions)}
-            ================================================
-            请结合上述辩论记录和陪审团的民意，做出最终判决。
-            请使用清晰的 Markdown 格式（使用 ### 做小标题，**做加粗**）。
-            """
-
-        # 【修改】传入法官配置
-        verdict = get_ai_response(JUDGE_PROMPT, judge_prompt_content, CONFIGS["judge"])
-
-        status.update(label="判决已生成", state="complete", expanded=False)
-
+    if data["verdict"] is None:
+        with st.status(f"👨‍⚖️ 法官 ({data['models']['judge']}) 正在审阅卷宗...", expanded=True):
+            st.write("✅ 已阅读双方律师辩词")
+            st.write(f"✅ 已听取 {len(data['jury'])} 位陪审员的投票意见")
+            if data.get("extracts"):
+                st.write(f"🧾 书记员 ({data['extracts']['model']}) 已整理 {len(data['extracts']['rounds'])} 轮辩论要点")
+        if data["live"].get("judge"):
+            st.markdown(styles.render_verdict(data["live"]["judge"]), unsafe_allow_html=True)
+        return
+
+    st.status("判决已生成", state="complete", expanded=False)
+    # 判决书只转换一次，页面与导出共用
+    verdict_html = styles.md_to_html(data["verdict"])
     # 渲染
-    st.markdown(styles.render_verdict(verdict), unsafe_allow_html=True)
+    st.markdown(styles.render_verdict(data["verdict"], verdict_html), unsafe_allow_html=True)
+    show_timing(data["verdict_timing"])
+    if data["verdict_timing"].get("failover_from"):
+        st.caption(f"⚠️ 法官模型 {data['verdict_timing']['failover_from']} 不可用，由 {data['verdict_timing']['model']} 代为判决")
+    if data.get("extracts"):
+        with st.expander(f"🧾 书记员要点（法官据此判决，由 {data['extracts']['model']} 整理）", expanded=False):
+            merged = data["extracts"].get("merged")
+            if merged:
+                st.markdown(f"**第 1–{merged[0]} 轮（合并，法官读这一份代替下面对应的各轮）**\n\n{merged[1]}")
+            for i, text in enumerate(data["extracts"]["rounds"]):
+                st.markdown(f"**第 {i + 1} 轮**\n\n{text}")
+            if data["extracts"]["jury"]:
+                st.markdown(f"**陪审团**\n\n{data['extracts']['jury']}")
 
     # ==========================================
     # Phase 4: 导出
     # ==========================================
     st.markdown("<br>", unsafe_allow_html=True)
-    col_empty, col_btn = st.columns([4, 1])
+    col_empty, col_html, col_md, col_jsonl, col_btn = st.columns([1, 1, 1, 1, 1])
+
+    # 整场庭审的导出在点击时才生成，不常驻会话内存；判决书沿用上面已转换的 HTML
+    for col, fmt, label, compress in ((col_html, "html", "📦 整场庭审 (HTML)", False),
+                                      (col_md, "md", "📝 整场庭审 (Markdown)", False),
+                                      (col_jsonl, "jsonl", "🗂️ 记录与调用明细 (JSONL.gz)", True)):
+        col.download_button(
+            label=label,
+            data=lambda fmt=fmt, compress=compress: b"".join(export.export(data, fmt, compress, verdict_html)),
+            file_name=export.filename(data, fmt, compress),
+            mime="application/gzip" if compress else export.FORMATS[fmt][1],
+            use_container_width=True,
+        )
 
     with col_btn:
-        html_data = styles.get_verdict_download_html(verdict)
+        # 导出内容只生成一次，点击下载引起的 rerun 直接复用
+        export_key = f"export_{data['id']}"
+        if export_key not in st.session_state:
+            st.session_state[export_key] = styles.get_verdict_download_html(data["verdict"], verdict_html)
         st.download_button(
             label="📥 导出判决书 (HTML)",
-            data=html_data,
+            data=st.session_state[export_key],
             file_name="AI_Court_Verdict.html",
             mime="text/html",
             use_container_width=True,
             type="primary"
-        )
\ No newline at end of file
+        )
+
+
+ROLE_NAMES = {"plaintiff": "🦁 原告", "defendant": "🦈 被告", "jury": "👥 陪审", "poll": "🗳️ 民调",
+              "clerk": "🧾 书记", "judge": "👨‍⚖️ 法官"}
+
+
+def render_metrics(data):
+    """本场庭审的调用瀑布图与汇总"""
+    calls = data.get("calls") or []
+    if not calls:
+        return
+    import altair as alt
+    import pandas as pd
+
+    summary = metrics.summarize(calls)
+    with st.expander(f"📊 调用明细：{summary['calls']} 次调用 · 估算费用 ¥{summary['cost']:.4f}", expanded=False):
+        cols = st.columns(4)
+        cols[0].metric("总耗时", f"{data['timings'].get('total', 0):.1f}s")
+        cols[1].metric("输入 / 输出 token", f"{summary['prompt_tokens']} / {summary['completion_tokens']}")
+        cols[2].metric("前缀缓存命中 token", summary['cached_tokens'],
+                       f"命中率 {summary['prefix_hit_rate']:.0%} · 节省 ¥{summary['prefix_savings']:.4f}",
+                       delta_color="off")
+        if summary["slowest"]:
+            cols[3].metric("最慢调用", f"{summary['slowest']['latency']:.1f}s", summary["slowest"]["model"],
+                           delta_color="off")
+
+        rows = []
+        for i, call in enumerate(calls):
+            label = ROLE_NAMES.get(call["role"], call["role"]) + (f" · {call['persona']}" if call["persona"] else "")
+            rows.append({
+                "调用": f"{i + 1:02d} {label}",
+                "模型": call["model"],
+                "开始": call["start"],
+                "结束": call["start"] + call["latency"],
+                "排队(s)": round(call["queue_wait"], 2),
+                "首字(s)": None if call["ttft"] is None else round(call["ttft"], 2),
+                "耗时(s)": round(call["latency"], 2),
+                "输入": call["prompt_tokens"],
+                "输出": call["completion_tokens"],
+                "缓存命中": call["cached_tokens"],
+                "费用(¥)": round(call["cost"], 5),
+                "状态": "❌" if call["error"] else ("♻️" if call["cache_hit"] else "✅"),
+            })
+        df = pd.DataFrame(rows)
+        chart = alt.Chart(df).mark_bar().encode(
+            x=alt.X("开始:Q", title="秒"),
+            x2="结束:Q",
+            y=alt.Y("调用:N", sort=None, title=None),
+            color="模型:N",
+            tooltip=["调用", "模型", "排队(s)", "首字(s)", "耗时(s)", "输入", "输出", "费用(¥)"],
+        )
+        st.altair_chart(chart, use_container_width=True)
+        st.dataframe(df.drop(columns=["开始", "结束"]), hide_index=True, use_container_width=True)
+
+
+def render_trial(data):
+    """根据庭审快照重绘整个页面；rerun 时不会发起任何模型调用"""
+    if data["status"] == "error":
+        st.error(f"庭审中断：{data['error']}")
+    elif data["status"] == "cancelled":
+        st.warning(f"⏹ {data['error']}")
+    for note in data.get("notes") or []:
+        st.info(f"⏱️ {note}")
+    if data.get("routing"):
+        st.caption(f"🤖 自动路由：{describe(data['routing'])}")
+    if data.get("fork"):
+        st.caption(f"🌿 分支庭审（父庭审 {data['fork']['parent']}）：{describe_fork(data['fork'])}，"
+                   f"沿用了 {data['fork']['reused_calls']} 次调用的结果")
+    render_debate(data)
+    if reached(data, "jury"):
+        if data.get("poll_size"):
+            render_poll(data)
+        else:
+            render_jury(data)
+    if reached(data, "judge"):
+        render_judge(data)
+    render_metrics(data)
+
+
+# ==========================================
+# 庭审状态：保存在 session_state 中，rerun 时直接重绘
+# ==========================================
+def session_alive():
+    """返回检查当前浏览器会话是否仍在的函数，供 asyncio 引擎回收无人观看的庭审"""
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None or not Runtime.exists():
+        return None
+    session_id = ctx.session_id
+    return lambda: Runtime.instance().is_active_session(session_id)
+
+
+trial_store = get_store()
+trial_archive = get_archive()
+job_queue = get_queue()
+if "trial" not in st.session_state and st.query_params.get("trial"):
+    # 页面刷新或重连后，根据 URL 中的庭审编号找回：仍在队列中（或刚结束）的直接接着轮询，否则从磁盘或档案库恢复
+    trial_id = st.query_params["trial"]
+    restored = job_queue.get(trial_id)
+    if isinstance(restored, AsyncTrial):
+        restored.alive = session_alive()  # 原来的会话已经不在了，改由当前会话决定是否回收
+    if restored is None and trial_store is not None:
+        try:
+            restored = trial_store.load(trial_id)
+        except ValueError:
+            pass
+    if restored is None and trial_archive is not None:
+        restored = trial_archive.load(trial_id)
+    if restored is not None:
+        st.session_state["trial"] = restored
+
+
+def trial_snapshot():
+    trial = st.session_state.get("trial")
+    return trial.to_dict() if isinstance(trial, Trial) else trial
+
+
+def save_finished(trial):
+    data = trial.to_dict()
+    if trial_store is not None:
+        trial_store.save(data)
+    if trial_archive is not None:
+        trial_archive.save(data)  # 后台线程写入
+
+
+def open_archived(trial_id):
+    """从档案库打开一场庭审（按钮回调，在 rerun 之前执行）"""
+    st.session_state["trial"] = trial_archive.load(trial_id)
+    st.query_params["trial"] = trial_id
+
+
+def is_running():
+    """排队中或进行中"""
+    trial = st.session_state.get("trial")
+    return isinstance(trial, Trial) and trial.status in ACTIVE_STATUSES
+
+
+# ==========================================
+# 侧边栏：历史庭审
+# ==========================================
+with st.sidebar:
+    if trial_archive is not None:
+        with st.expander("📚 历史庭审", expanded=False):
+            history_query = st.text_input("🔍 搜索话题或关键词", key="history_query")
+            history_total = trial_archive.count(history_query)
+            history_pages = max(1, -(-history_total // ARCHIVE_PAGE_SIZE))
+            history_page = 1
+            if history_pages > 1:
+                history_page = st.number_input(f"页码 (共 {history_pages} 页)", 1, history_pages, 1,
+                                               key=f"history_page_{history_query}_{history_pages}")
+            st.caption(f"共 {history_total} 场庭审")
+            for item in trial_archive.search(history_query, ARCHIVE_PAGE_SIZE, (history_page - 1) * ARCHIVE_PAGE_SIZE):
+                st.button(
+                    f"{'✅' if item['status'] == 'done' else '❌'} {item['topic']}",
+                    key=f"history_{item['id']}",
+                    help=f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(item['created']))} · 法官 {item['judge_model']}",
+                    on_click=open_archived, args=(item["id"],),
+                    disabled=is_running(),
+                    use_container_width=True,
+                )
+
+    # 本次脚本执行耗时，页面末尾填入
+    run_time_slot = st.empty()
+
+# ==========================================
+# 输入区域
+# ==========================================
+topic = st.text_input("📝 输入案件争议焦点：", value="AI生成的画作版权应该归属于提示词作者吗？")
+
+# 相同话题已经审过时，直接查看档案比重新开庭（10 余次模型调用）便宜得多
+if trial_archive is not None and topic and not is_running():
+    previous = trial_archive.find_topic(topic)
+    shown = trial_snapshot()
+    if previous is not None and (shown is None or shown["id"] != previous["id"]):
+        col_info, col_reuse = st.columns([4, 1])
+        col_info.info(f"📚 档案库中已有相同话题的庭审（{time.strftime('%Y-%m-%d %H:%M', time.localtime(previous['created']))}，"
+                      f"法官 {previous['models']['judge']}），可直接查看而无需重新开庭。")
+        col_reuse.button("♻️ 查看上次庭审", on_click=open_archived, args=(previous["id"],), use_container_width=True)
+
+start_btn = st.button("🔥 开庭审理", type="primary", use_container_width=True, disabled=is_running())
+
+if start_btn and topic:
+    # 庭审在后台线程中运行，点击侧边栏或下载按钮引起的 rerun 不会打断它
+    personas, configs = JURY_PERSONAS, CONFIGS
+    if poll_mode:
+        # 每场庭审重新抽样陪审员
+        personas = sample_jurors(poll_size)
+        configs = {**POLL_CONFIGS, "jury": {persona['id']: POLL_CONFIGS["jury"]["poll"] for persona in personas}}
+    routing = None
+    if needs_routing(configs):
+        # 自动路由每场开庭时重新分配，参考的是截至此刻的滚动统计
+        try:
+            configs, routing = route(configs, rounds, poll=poll_mode, jury_pipeline=pipelined_jury)
+        except ValueError as e:
+            st.error(str(e))
+            st.stop()
+    trial = (AsyncTrial if async_engine else Trial)(topic, configs, rounds, cache_bypass=cache_bypass,
+                                                    personas=personas)
+    trial.poll = poll_mode
+    trial.routing = routing
+    if async_engine:
+        trial.alive = session_alive()
+    trial.stream = stream_output
+    trial.jury_pipeline = pipelined_jury
+    trial.prefix_layout = prefix_layout
+    trial.map_reduce = map_reduce
+    try:
+        job_queue.submit(trial, concurrent_jury=concurrent_jury, on_finish=save_finished)
+    except QueueFull as e:
+        st.error(f"🚦 {e}")
+    else:
+        st.session_state["trial"] = trial
+        st.query_params["trial"] = trial.id  # 重连后按编号找回
+
+queue_state = job_queue.snapshot()
+st.caption(f"🚦 服务器负载：进行中 {queue_state['running']}/{queue_state['workers']} 场，排队 {queue_state['queued']} 场")
+
+polling = is_running()
+if polling:
+    current = st.session_state["trial"]
+    # 排队中的庭审随时可以撤回；进行中的庭审只有 asyncio 引擎能中断
+    if current.status == "queued" or isinstance(current, AsyncTrial):
+        st.button("⏹ 停止庭审", on_click=job_queue.cancel, args=(current.id,), use_container_width=True)
+
+
+@st.fragment(run_every=TRIAL_POLL_INTERVAL if polling else None)
+def trial_view():
+    data = trial_snapshot()
+    if data is None:
+        return
+    if data["status"] == "queued":
+        position, eta = job_queue.position(data["id"]), job_queue.eta(data["id"])
+        if position is not None:
+            st.info(f"⏳ 排队中：前面还有 {position} 场庭审，预计约 {eta:.0f}s 后开庭（任务编号 {data['id']}，"
+                    f"关闭页面后可通过当前链接找回）")
+    render_trial(data)
+    if polling and data["status"] not in ACTIVE_STATUSES:
+        # 庭审结束后整页重绘一次，停止轮询并恢复开庭按钮
+        st.rerun()
+
+
+trial_view()
+
+
+# ==========================================
+# 分支：从某一轮或某个阶段分叉重跑，比较各分支的判决
+# ==========================================
+KEEP_MODEL = "（沿用）"
+
+
+def render_branching(data):
+    st.markdown("---")
+    with st.expander("🌿 从这里分叉：换模型或回合数，只重跑分叉点之后的部分", expanded=False):
+        with st.form(f"fork_{data['id']}"):
+            points = dict(fork_points(data))
+            point = st.selectbox("分叉点", list(points), format_func=points.get)
+            # 与新开庭审同一上限；命令行批处理的庭审可能超过上限，此时只能沿用或减少回合数
+            fork_rounds = st.number_input("辩论回合数", 1, max(MAX_ROUNDS, data["rounds"]), data["rounds"])
+            choices = [KEEP_MODEL] + list(AVAILABLE_MODELS)
+            col_p, col_d, col_j, col_jury = st.columns(4)
+            fork_plaintiff = col_p.selectbox("原告", choices)
+            fork_defendant = col_d.selectbox("被告", choices)
+            fork_judge = col_j.selectbox("法官", choices)
+            fork_jury = col_jury.selectbox("陪审团（全体）", choices)
+            submitted = st.form_submit_button("🌿 分叉重审", type="primary", use_container_width=True)
+        if submitted:
+            picked = [None if name == KEEP_MODEL else name
+                      for name in (fork_plaintiff, fork_defendant, fork_judge, fork_jury)]
+            try:
+                branch = fork(data, point, rounds=fork_rounds, plaintiff=picked[0], defendant=picked[1],
+                              judge=picked[2], jury=picked[3], engine=AsyncTrial if async_engine else Trial)
+            except ValueError as e:
+                st.error(str(e))
+                return
+            if async_engine:
+                branch.alive = session_alive()
+            branch.stream = stream_output
+            try:
+                job_queue.submit(branch, concurrent_jury=concurrent_jury, on_finish=save_finished)
+            except QueueFull as e:
+                st.error(f"🚦 {e}")
+                return
+            st.session_state["trial"] = branch
+            st.query_params["trial"] = branch.id
+            st.rerun()
+
+    if trial_archive is None:
+        return
+    family = trial_archive.family(data["id"])
+    if len(family) < 2:
+        return
+    with st.expander(f"🌳 分支树（共 {len(family)} 场）", expanded=True):
+        for depth, row, label in tree_lines(family, data["id"]):
+            col_label, col_open = st.columns([6, 1])
+            col_label.markdown("&emsp;" * depth + label, unsafe_allow_html=True)
+            col_open.button("打开", key=f"branch_{row['id']}", on_click=open_archived, args=(row["id"],),
+                            disabled=row["id"] == data["id"], use_container_width=True)
+        finished = {row["id"]: label for _, row, label in tree_lines(family) if row["status"] == "done"}
+        compare = st.multiselect("并排比较判决", list(finished), default=list(finished)[:2],
+                                 format_func=finished.get, max_selections=3, key=f"compare_{data['id']}")
+        if compare:
+            for col, row_id in zip(st.columns(len(compare)), compare):
+                row = next(row for row in family if row["id"] == row_id)
+                col.caption(finished[row_id])
+                col.markdown(styles.render_verdict(row["verdict"]), unsafe_allow_html=True)
+
+
+shown_trial = trial_snapshot()
+if not polling and shown_trial is not None and shown_trial["status"] == "done":
+    render_branching(shown_trial)
+
+# 记录本次脚本执行耗时（不含轮询片段），可在 /metrics 中查看分位数
+_run_time = time.perf_counter() - _run_started
+metrics.metrics.record_rerun(_run_time)
+run_time_slot.caption(f"⏱️ 本次页面执行 {_run_time * 1000:.0f} ms")
\ No newline at end of file
@@ -0,0 +1,225 @@
+# metrics.py
+# 模型调用埋点：每次调用的角色、模型、排队时间、首字延迟、总耗时、token 用量与估算费用
+# 汇总结果可通过 Prometheus 文本格式端点 (CYBERGAVEL_METRICS_PORT) 或 JSONL 文件 (CYBERGAVEL_METRICS_JSONL) 导出
+import json
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import MODEL_PRICES, METRICS_JSONL, METRICS_PORT
+
+# 计算延迟分位数时保留的最近样本数
+_WINDOW = 500
+# 自动路由参考的滚动窗口：每个 (模型, 角色) 保留的最近调用数
+_ROUTE_WINDOW = 100
+
+
+def estimate_cost(model_name, prompt_tokens, completion_tokens, cached_tokens=0):
+    """按价目表估算费用（元）；未配置价格的模型返回 0"""
+    price = MODEL_PRICES.get(model_name)
+    if not price:
+        return 0.0
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * price["input"]
+            + cached_tokens * price.get("cached_input", price["input"])
+            + completion_tokens * price["output"]) / 1_000_000
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)  # (model, role, status) -> 次数
+        self.latency_sum = defaultdict(float)  # model -> 总耗时
+        self.queue_wait_sum = defaultdict(float)
+        self.tokens = defaultdict(int)  # (model, 类型) -> token 数
+        self.cost = defaultdict(float)  # model -> 元
+        self.recent = defaultdict(lambda: deque(maxlen=_WINDOW))  # model -> 最近的耗时
+        # (model, role) -> 最近的 (是否出错, 耗时, 首字延迟, 输出 token 数, 费用)，不含缓存命中
+        self.window = defaultdict(lambda: deque(maxlen=_ROUTE_WINDOW))
+        self.reruns = deque(maxlen=_WINDOW)  # 最近的页面脚本执行耗时
+        self.rerun_sum = 0.0
+        self.rerun_count = 0
+        self.gauges = {}  # 指标名 -> (说明, 返回当前值的函数)，由其他模块注册
+        self._sink = open(METRICS_JSONL, "a", encoding="utf-8") if METRICS_JSONL else None
+
+    def record(self, call):
+        """call: 一次调用的记录（字段见 Trial._record_call）"""
+        model = call["model"]
+        status = "error" if call["error"] else ("cache" if call["cache_hit"] else "ok")
+        with self._lock:
+            self.calls[(model, call["role"], status)] += 1
+            self.latency_sum[model] += call["latency"]
+            self.queue_wait_sum[model] += call["queue_wait"]
+            if not call["error"] and not call["cache_hit"]:
+                self.recent[model].append(call["latency"])
+            if not call["cache_hit"]:
+                self.window[(model, call["role"])].append(
+                    (call["error"], call["latency"], call["ttft"], call["completion_tokens"], call["cost"]))
+            for kind in ("prompt", "completion", "cached"):
+                self.tokens[(model, kind)] += call[f"{kind}_tokens"]
+            self.cost[model] += call["cost"]
+            if self._sink is not None:
+                self._sink.write(json.dumps(call, ensure_ascii=False) + "\n")
+                self._sink.flush()
+
+    def record_rerun(self, seconds):
+        """一次 Streamlit 脚本执行（冷启动或 rerun）的耗时"""
+        with self._lock:
+            self.reruns.append(seconds)
+            self.rerun_sum += seconds
+            self.rerun_count += 1
+
+    def add_gauge(self, name, help_text, read):
+        """注册一个在抓取时才读取的瞬时值（如任务队列长度）"""
+        with self._lock:
+            self.gauges[name] = (help_text, read)
+
+    def rerun_quantile(self, q):
+        with self._lock:
+            samples = sorted(self.reruns)
+        if not samples:
+            return None
+        return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+    def model_stats(self, model, role=None):
+        """
+        某模型近期调用的滚动统计，供 router 自动选择模型；role 为 None 时合并所有角色
+        返回 samples / error_rate / p95 / ttft_p95 / tokens_per_sec / cost (成功调用的平均费用)，没有样本时返回 None
+        """
+        with self._lock:
+            samples = [s for (m, r), window in self.window.items() if m == model and role in (None, r) for s in window]
+        if not samples:
+            return None
+        ok = [s for s in samples if not s[0]]
+        latencies = sorted(s[1] for s in ok)
+        ttfts = sorted(s[2] for s in ok if s[2] is not None)
+        generating = sum(s[1] - (s[2] or 0.0) for s in ok)  # 扣除首字延迟后的生成时间
+        return {
+            "samples": len(samples),
+            "error_rate": 1 - len(ok) / len(samples),
+            "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None,
+            "ttft_p95": ttfts[min(int(len(ttfts) * 0.95), len(ttfts) - 1)] if ttfts else None,
+            "tokens_per_sec": sum(s[3] for s in ok) / generating if generating > 0 else None,
+            "cost": sum(s[4] for s in ok) / len(ok) if ok else None,
+        }
+
+    def quantile(self, model, q):
+        with self._lock:
+            samples = sorted(self.recent[model])
+        if not samples:
+            return None
+        return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+    def prometheus_text(self):
+        """Prometheus 文本格式"""
+        lines = [
+            "# HELP cybergavel_llm_calls_total LLM calls by model, role and status.",
+            "# TYPE cybergavel_llm_calls_total counter",
+        ]
+        with self._lock:
+            calls = dict(self.calls)
+            latency_sum = dict(self.latency_sum)
+            queue_wait_sum = dict(self.queue_wait_sum)
+            tokens = dict(self.tokens)
+            cost = dict(self.cost)
+        for (model, role, status), n in sorted(calls.items()):
+            lines.append(f'cybergavel_llm_calls_total{{model="{model}",role="{role}",status="{status}"}} {n}')
+
+        counts = defaultdict(int)
+        for (model, _, _), n in calls.items():
+            counts[model] += n
+        lines += ["# HELP cybergavel_llm_latency_seconds LLM call latency.",
+                  "# TYPE cybergavel_llm_latency_seconds summary"]
+        for model in sorted(latency_sum):
+            for q in (0.5, 0.95, 0.99):
+                value = self.quantile(model, q)
+                if value is not None:
+                    lines.append(f'cybergavel_llm_latency_seconds{{model="{model}",quantile="{q}"}} {value:.4f}')
+            lines.append(f'cybergavel_llm_latency_seconds_sum{{model="{model}"}} {latency_sum[model]:.4f}')
+            lines.append(f'cybergavel_llm_latency_seconds_count{{model="{model}"}} {counts[model]}')
+
+        lines += ["# HELP cybergavel_llm_queue_wait_seconds_total Time spent waiting for provider quota.",
+                  "# TYPE cybergavel_llm_queue_wait_seconds_total counter"]
+        for model, value in sorted(queue_wait_sum.items()):
+            lines.append(f'cybergavel_llm_queue_wait_seconds_total{{model="{model}"}} {value:.4f}')
+
+        lines += ["# HELP cybergavel_llm_tokens_total Tokens by model and type.",
+                  "# TYPE cybergavel_llm_tokens_total counter"]
+        for (model, kind), n in sorted(tokens.items()):
+            lines.append(f'cybergavel_llm_tokens_total{{model="{model}",type="{kind}"}} {n}')
+
+        lines += ["# HELP cybergavel_llm_cost_yuan_total Estimated cost in CNY.",
+                  "# TYPE cybergavel_llm_cost_yuan_total counter"]
+        for model, value in sorted(cost.items()):
+            lines.append(f'cybergavel_llm_cost_yuan_total{{model="{model}"}} {value:.6f}')
+
+        lines += ["# HELP cybergavel_rerun_seconds Streamlit script run time.",
+                  "# TYPE cybergavel_rerun_seconds summary"]
+        for q in (0.5, 0.95, 0.99):
+            value = self.rerun_quantile(q)
+            if value is not None:
+                lines.append(f'cybergavel_rerun_seconds{{quantile="{q}"}} {value:.4f}')
+        lines.append(f"cybergavel_rerun_seconds_sum {self.rerun_sum:.4f}")
+        lines.append(f"cybergavel_rerun_seconds_count {self.rerun_count}")
+
+        with self._lock:
+            gauges = dict(self.gauges)
+        for name, (help_text, read) in sorted(gauges.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不把每次抓取都打到控制台
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port=METRICS_PORT):
+    """在后台线程启动 /metrics 端点；重复调用只启动一次，port 为 0 时不启动"""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
+
+
+def summarize(calls):
+    """单场庭审的调用汇总；prefix_hit_rate 为输入 token 中命中服务端前缀缓存的比例"""
+    ok = [c for c in calls if not c["error"]]
+    prompt_tokens = sum(c["prompt_tokens"] for c in calls)
+    cached_tokens = sum(c["cached_tokens"] for c in calls)
+    cost = sum(c["cost"] for c in calls)
+    # 假如没有前缀缓存需要支付的费用
+    uncached_cost = sum(estimate_cost(c["model"], c["prompt_tokens"], c["completion_tokens"])
+                        for c in calls if not c["cache_hit"])
+    return {
+        "calls": len(calls),
+        "errors": len(calls) - len(ok),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": sum(c["completion_tokens"] for c in calls),
+        "cached_tokens": cached_tokens,
+        "prefix_hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "prefix_savings": uncached_cost - cost,
+        "cost": cost,
+        "slowest": max(ok, key=lambda c: c["latency"], default=None),
+    }
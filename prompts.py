@@ -99,6 +99,28 @@ JURY_PERSONAS = [
     }
 ]
 
+# 大规模民调陪审团：以上面的人设为模板，按以下维度随机组合出不同的陪审员
+POLL_TRAITS = {
+    "年龄": ["18-24 岁", "25-34 岁", "35-49 岁", "50-64 岁", "65 岁以上"],
+    "职业": ["学生", "程序员", "个体户", "中学教师", "公务员", "外卖骑手", "医生", "自由职业者", "退休工人", "销售"],
+    "居住地": ["一线城市", "省会城市", "县城", "农村"],
+    "立场": ["立场摇摆，容易被说服", "有自己的倾向，但愿意听取证据", "立场坚定，很难改变看法"],
+}
+
+POLL_VOTE_PROMPT = """
+请以你的身份对本案投票。只输出一个 JSON 对象，不要输出任何其他内容，格式如下：
+{"side": "plaintiff 或 defendant 或 abstain", "confidence": 0 到 1 之间的小数, "reason": "不超过 30 字的一句话理由"}
+其中 plaintiff 表示支持原告，defendant 表示支持被告，abstain 表示弃权。
+"""
+
+# 前缀缓存布局 (CYBERGAVEL_PREFIX_LAYOUT) 下所有角色共用的系统提示词
+# 必须保持稳定：任何改动都会让服务端已缓存的前缀全部失效
+COURT_SYSTEM_PROMPT = """
+这是一场模拟法庭辩论。
+接下来的消息依次是：案件话题、按发言顺序排列的庭审记录；最后一条消息是你在本场庭审中的角色设定与本次任务。
+请完全以最后一条消息指定的角色身份、按其要求发言，不要复述庭审记录。
+"""
+
 JUDGE_PROMPT = """
 你是一名公正、威严的法官。
 任务：
@@ -110,4 +132,24 @@ JUDGE_PROMPT = """
 - 【法庭陈述】：概括核心争议点。
 - 【精彩交锋】：指出辩论中最有力的一句反驳。
 - 【最终裁定】：给出极具哲理或深度的最终理由。
+"""
+
+# 分段归纳判决 (map-reduce)：书记员把每轮辩论、陪审团意见整理成固定格式的要点，法官只读这些要点
+CLERK_PROMPT = """
+你是法庭书记员，只做客观、简洁的整理，不评判输赢，不添加记录中没有的内容。
+严格按要求的格式输出，每一项不超过 60 字。
+"""
+
+CLERK_ROUND_FORMAT = """
+- 【原告主张】：本轮原告的核心主张
+- 【被告主张】：本轮被告的核心主张
+- 【反驳要点】：双方针对对方的主要反驳
+- 【最有力的一句】：原文摘录本轮最有力的一句话，并注明出自原告还是被告
+"""
+
+CLERK_JURY_FORMAT = """
+- 【票数】：支持原告 X 票，支持被告 Y 票，未表态 Z 票（按每位陪审员的表态统计）
+- 【支持原告的理由】：归纳支持原告的陪审员的主要理由
+- 【支持被告的理由】：归纳支持被告的陪审员的主要理由
+- 【代表性发言】：原文摘录一句，并注明出自哪位陪审员
 """
\ No newline at end of file
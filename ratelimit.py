@@ -0,0 +1,236 @@
+# ratelimit.py
+# 按服务商（API Key + base_url）限流：最大并发数、每分钟请求数 (RPM)、每分钟 token 数 (TPM)
+# 多个 UI 模型可能共用同一个账号（如 Qwen-Plus 与 Qwen-Turbo），因此按账号而不是按模型排队
+# 排队在不同调用方（庭审）之间轮转，避免一场批量任务占满队列；遇到 429 时按 Retry-After 暂停并收缩并发
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from resilience import retry_after
+from config import PROVIDER_MAX_INFLIGHT, PROVIDER_RPM, PROVIDER_TPM, PROVIDER_LIMITS
+
+
+class QueueTimeout(TimeoutError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n, now):
+        """还需要等待多少秒才有 n 个令牌"""
+        self._refill(now)
+        n = min(n, self.capacity)
+        return 0.0 if self.level >= n else (n - self.level) / self.rate
+
+    def take(self, n):
+        self.level -= min(n, self.capacity)
+
+
+class Slot:
+    """一次已获准的请求；调用结束后必须 release"""
+
+    def __init__(self, limiter, waited):
+        self.limiter = limiter
+        self.waited = waited  # 排队等待的秒数
+        self._released = False
+
+    def release(self, error=None):
+        if not self._released:
+            self._released = True
+            self.limiter.release(error)
+
+
+class ProviderLimiter:
+    def __init__(self, max_inflight=PROVIDER_MAX_INFLIGHT, rpm=PROVIDER_RPM, tpm=PROVIDER_TPM):
+        self.max_inflight = max_inflight
+        self.limit = max_inflight  # 当前允许的并发数，遇到 429 时减半，之后逐步恢复
+        self.inflight = 0
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # 调用方 -> 等待中的票据队列，按调用方轮转
+        self._successes = 0
+
+    def _is_head(self, ticket):
+        for queue in self._queues.values():
+            return queue[0] is ticket
+        return False
+
+    def _wait_time(self, ticket, tokens, now):
+        """0 表示可以立即放行；None 表示需要等待其他请求结束；正数表示需要等待的秒数"""
+        if not self._is_head(ticket):
+            return None
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.inflight >= self.limit:
+            return None
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def _dequeue(self, owner, ticket, granted):
+        queue = self._queues[owner]
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[owner]
+        elif granted:
+            # 本调用方刚获准一个请求，排到队尾，让其他调用方先走
+            self._queues.move_to_end(owner)
+        self._cond.notify_all()
+
+    def acquire(self, tokens=0, owner=None, timeout=None):
+        ticket = object()
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        with self._cond:
+            self._queues.setdefault(owner, deque()).append(ticket)
+            granted = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(ticket, tokens, now)
+                    if wait == 0:
+                        break
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise QueueTimeout("等待服务商配额超时")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+
+                self._grant(tokens)
+                granted = True
+            finally:
+                self._dequeue(owner, ticket, granted)
+        return Slot(self, time.monotonic() - start)
+
+    def _grant(self, tokens):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        self.inflight += 1
+
+    def _has_capacity(self, tokens, now):
+        if self._queues or now < self.paused_until or self.inflight >= self.limit:
+            return False
+        if self.requests and self.requests.wait_time(1, now) > 0:
+            return False
+        return not (self.tokens and self.tokens.wait_time(tokens, now) > 0)
+
+    def has_capacity(self, tokens=0):
+        """没有人排队且配额充足，新请求可以立即放行"""
+        with self._cond:
+            return self._has_capacity(tokens, time.monotonic())
+
+    def try_acquire(self, tokens=0):
+        """没有人排队且配额充足时立即放行，否则返回 None（不进入队列）"""
+        with self._cond:
+            if not self._has_capacity(tokens, time.monotonic()):
+                return None
+            self._grant(tokens)
+        return Slot(self, 0.0)
+
+    def release(self, error=None):
+        with self._cond:
+            self.inflight -= 1
+            if getattr(error, "status_code", None) == 429:
+                # 加性增、乘性减：收缩并发，并按 Retry-After 暂停
+                self.paused_until = max(self.paused_until, time.monotonic() + (retry_after(error) or 1.0))
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            elif error is None:
+                self._successes += 1
+                if self.limit < self.max_inflight and self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "inflight": self.inflight,
+                "limit": self.limit,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "paused": max(self.paused_until - time.monotonic(), 0.0),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model_conf):
+    """同一账号 (env_key, base_url) 共用一个限流器"""
+    key = (model_conf.get("env_key_name"), model_conf["base_url"])
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                overrides = PROVIDER_LIMITS.get(model_conf.get("env_key_name"), {})
+                limiter = ProviderLimiter(
+                    max_inflight=overrides.get("max_inflight", PROVIDER_MAX_INFLIGHT),
+                    rpm=overrides.get("rpm", PROVIDER_RPM),
+                    tpm=overrides.get("tpm", PROVIDER_TPM),
+                )
+                _limiters[key] = limiter
+    return limiter
+
+
+def acquire(model_conf, tokens=0, owner=None, timeout=None):
+    return get_limiter(model_conf).acquire(tokens, owner, timeout)
+
+
+# asyncio 引擎中同时排队等待配额的请求数上限（每个占用一个线程），更多的请求在线程池中等候
+_ASYNC_WAITERS = 64
+_waiters = None
+_waiters_lock = threading.Lock()
+
+
+def _waiter_pool():
+    # 不能用事件循环的默认线程池：httpx 在其中解析域名，排队的请求占满它之后，
+    # 已拿到名额的请求连不上服务端、名额无法归还，整个服务商的队列就会卡死
+    global _waiters
+    if _waiters is None:
+        with _waiters_lock:
+            if _waiters is None:
+                _waiters = ThreadPoolExecutor(max_workers=_ASYNC_WAITERS, thread_name_prefix="ratelimit-wait")
+    return _waiters
+
+
+async def aacquire(model_conf, tokens=0, owner=None, timeout=None):
+    """
+    acquire 的 asyncio 版本，与同步调用共用同一个限流器
+    配额充足时直接放行；需要排队时在专用线程池中等待（只有排队中的请求占用线程），保持轮转的公平性
+    等待期间被取消时，稍后拿到的名额会立即归还
+    """
+    limiter = get_limiter(model_conf)
+    slot = limiter.try_acquire(tokens)
+    if slot is not None:
+        return slot
+    future = asyncio.get_running_loop().run_in_executor(_waiter_pool(), limiter.acquire, tokens, owner, timeout)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(lambda f: f.cancelled() or f.exception() or f.result().release())
+        raise
+
+
+def snapshot():
+    """各账号当前的并发、排队情况"""
+    return {f"{env_key} @ {url}": limiter.snapshot() for (env_key, url), limiter in list(_limiters.items())}
\ No newline at end of file
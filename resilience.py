@@ -0,0 +1,274 @@
+# resilience.py
+# 调用容错策略：按角色的总时限、429/5xx 抖动指数退避重试、基于 p95 的对冲请求、服务商故障时切换到备用模型
+import asyncio
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
+from config import (AVAILABLE_MODELS, get_model_config, ROLE_DEADLINES, HTTP_READ_TIMEOUT,
+                    RETRY_MAX, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+                    HEDGE_ENABLED, HEDGE_MIN_SAMPLES, FAILOVER_ENABLED,
+                    CIRCUIT_FAILURES, CIRCUIT_COOLDOWN)
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_retryable(e):
+    """429、5xx、超时与连接错误可以重试；鉴权、参数错误等重试也没有意义"""
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # 延迟导入：能走到这里说明已经发起过调用，两个模块早已加载
+    import httpx
+    import openai
+    return isinstance(e, (openai.APIConnectionError, httpx.TransportError, TimeoutError))
+
+
+def retry_after(e):
+    """读取服务端的 Retry-After 头（秒）"""
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, e=None):
+    """带完全抖动的指数退避；服务端给了 Retry-After 时以它为准"""
+    hint = retry_after(e) if e is not None else None
+    if hint is not None:
+        return min(hint, RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_BASE_DELAY * (2 ** attempt), RETRY_MAX_DELAY))
+
+
+class ProviderHealth:
+    """
+    记录每个模型的近期延迟（用于计算对冲阈值）与每个服务商的连续失败次数（熔断）
+    """
+
+    def __init__(self, window=100):
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: deque(maxlen=window))  # 模型名称 -> 最近的耗时
+        self._failures = defaultdict(int)  # base_url -> 连续失败次数
+        self._open_until = {}  # base_url -> 熔断结束时间
+
+    def record_success(self, model_conf, elapsed):
+        with self._lock:
+            self._latency[model_conf["name"]].append(elapsed)
+            self._failures[model_conf["base_url"]] = 0
+            self._open_until.pop(model_conf["base_url"], None)
+
+    def record_failure(self, model_conf):
+        with self._lock:
+            url = model_conf["base_url"]
+            self._failures[url] += 1
+            if self._failures[url] >= CIRCUIT_FAILURES:
+                self._open_until[url] = time.monotonic() + CIRCUIT_COOLDOWN
+
+    def is_down(self, model_conf):
+        with self._lock:
+            return self._open_until.get(model_conf["base_url"], 0) > time.monotonic()
+
+    def p95(self, model_name):
+        with self._lock:
+            samples = sorted(self._latency[model_name])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+
+health = ProviderHealth()
+
+
+def candidates(model_conf):
+    """
+    本次调用依次尝试的模型配置：首选模型，然后是备用模型
+    备用模型优先取模型池中配置的 "fallback" 列表，否则取其他服务商中已配置 Key 的模型
+    已熔断的服务商排到最后
+    """
+    result = [model_conf]
+    if FAILOVER_ENABLED:
+        template = AVAILABLE_MODELS.get(model_conf["name"], {})
+        names = template.get("fallback") or [name for name, conf in AVAILABLE_MODELS.items()
+                                             if conf["base_url"] != model_conf["base_url"]]
+        for name in names:
+            conf = get_model_config(name)
+            if conf["api_key"] and conf["name"] != model_conf["name"]:
+                result.append(conf)
+    return sorted(result, key=health.is_down)
+
+
+class _Sent:
+    """
+    传给 call 的回调：拿到限流名额、请求即将发出时调用，记下发出的时刻
+    对冲的计时与 p95 的延迟样本都从这一刻算起，排队等名额的时间不计入
+    """
+
+    def __init__(self, event):
+        self.event = event  # threading.Event 或 asyncio.Event
+        self.at = None
+
+    def __call__(self):
+        self.at = time.monotonic()
+        self.event.set()
+
+
+def _has_capacity(model_conf):
+    """服务商没有排队、还有空闲名额时才对冲：名额紧张时重复请求只会挤占其他调用"""
+    # 延迟导入：ratelimit 依赖本模块
+    from ratelimit import get_limiter
+    return get_limiter(model_conf).has_capacity()
+
+
+def _start(call, *args):
+    """在独立线程中执行 call，返回 Future；每个请求一个线程，不会在共享线程池中排队"""
+    future = Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(call(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="hedge", daemon=True).start()
+    return future
+
+
+def _hedged(call, model_conf, timeout, sent):
+    """
+    对冲请求：首个请求发出后超过该模型的 p95 延迟仍未返回，且服务商还有空闲名额时，再发一个相同的请求，取先成功的那个
+    同步 SDK 的请求无法中途中断，落后的那个会在后台自然结束（asyncio 引擎会真正取消）
+    """
+    delay = health.p95(model_conf["name"])
+    if delay is None or delay >= timeout:
+        return call(model_conf, timeout, sent)
+
+    started = time.monotonic()
+
+    def remaining():
+        return max(timeout - (time.monotonic() - started), 0)
+
+    first = _start(call, model_conf, timeout, sent)
+    first.add_done_callback(lambda _: sent.event.set())  # 排队超时等未发出就结束的情况
+    sent.event.wait(timeout)
+    if first.done() or sent.at is None:
+        return first.result(timeout=remaining())
+    try:
+        return first.result(timeout=min(max(sent.at + delay - time.monotonic(), 0), remaining()))
+    except FutureTimeout:
+        pass
+    if not _has_capacity(model_conf):
+        return first.result(timeout=remaining())
+
+    second = _start(call, model_conf, max(remaining(), 0.1), None)
+    done, _ = wait([first, second], timeout=remaining(), return_when=FIRST_COMPLETED)
+    for future in done:
+        if future.exception() is None:
+            return future.result()
+    # 先结束的那个失败了，等另一个
+    pending = [f for f in (first, second) if f not in done]
+    if not pending:
+        return first.result()
+    return pending[0].result(timeout=remaining())
+
+
+def call_with_policy(call, model_conf, role=None, hedge=False):
+    """
+    按容错策略执行 call(model_conf, timeout)，返回 (结果, 实际应答的模型配置)
+    对冲时 call 还会收到第三个参数 sent：可能为 None，否则在请求发出前调用 sent()
+    - 整个过程（含重试与切换）不超过该角色的总时限
+    - 可重试的错误按抖动指数退避重试并计入熔断，不可重试的错误直接切换到下一个候选模型、不计入熔断
+    - 所有候选都失败时抛出最后一个异常
+    """
+    deadline = time.monotonic() + ROLE_DEADLINES.get(role, HTTP_READ_TIMEOUT)
+    last_error = None
+
+    for conf in candidates(model_conf):
+        for attempt in range(RETRY_MAX + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{role or '调用'} 超过时限") from last_error
+            start = time.monotonic()
+            sent = _Sent(threading.Event()) if hedge and HEDGE_ENABLED else None
+            try:
+                if sent is not None:
+                    result = _hedged(call, conf, remaining, sent)
+                else:
+                    result = call(conf, remaining)
+                health.record_success(conf, time.monotonic() - (sent and sent.at or start))
+                return result, conf
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e):
+                    break  # 鉴权、参数等客户端错误不说明服务商故障：换下一个候选模型，但不计入熔断
+                health.record_failure(conf)
+                if attempt == RETRY_MAX:
+                    break
+                time.sleep(min(backoff_delay(attempt, e), max(deadline - time.monotonic(), 0)))
+
+    raise last_error
+
+
+async def _ahedged(call, model_conf, timeout, sent):
+    """_hedged 的 asyncio 版本：落后的那个请求会被真正取消"""
+    delay = health.p95(model_conf["name"])
+    if delay is None or delay >= timeout:
+        return await call(model_conf, timeout, sent)
+
+    started = time.monotonic()
+    tasks = [asyncio.ensure_future(call(model_conf, timeout, sent))]
+    waiter = asyncio.ensure_future(sent.event.wait())
+    try:
+        await asyncio.wait([tasks[0], waiter], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not tasks[0].done() and sent.at is not None:
+            done, _ = await asyncio.wait(tasks, timeout=max(sent.at + delay - time.monotonic(), 0))
+            if not done and _has_capacity(model_conf):
+                tasks.append(asyncio.ensure_future(call(model_conf, max(timeout - (time.monotonic() - started), 0.1), None)))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+        return tasks[0].result()  # 都失败了，抛出首个请求的异常
+    finally:
+        waiter.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+async def acall_with_policy(call, model_conf, role=None, hedge=False):
+    """
+    call_with_policy 的 asyncio 版本，call 为 async (conf, timeout)
+    超时或被取消时，进行中的请求会被中断而不是在后台继续计费
+    """
+    deadline = time.monotonic() + ROLE_DEADLINES.get(role, HTTP_READ_TIMEOUT)
+    last_error = None
+
+    for conf in candidates(model_conf):
+        for attempt in range(RETRY_MAX + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{role or '调用'} 超过时限") from last_error
+            start = time.monotonic()
+            sent = _Sent(asyncio.Event()) if hedge and HEDGE_ENABLED else None
+            try:
+                attempt_call = _ahedged(call, conf, remaining, sent) if sent is not None else call(conf, remaining)
+                result = await asyncio.wait_for(attempt_call, remaining)
+                health.record_success(conf, time.monotonic() - (sent and sent.at or start))
+                return result, conf
+            except Exception as e:  # 取消 (CancelledError) 不是 Exception，会直接向上传递
+                last_error = e
+                if not is_retryable(e):
+                    break  # 鉴权、参数等客户端错误不说明服务商故障：换下一个候选模型，但不计入熔断
+                health.record_failure(conf)
+                if attempt == RETRY_MAX:
+                    break
+                await asyncio.sleep(min(backoff_delay(attempt, e), max(deadline - time.monotonic(), 0)))
+
+    raise last_error
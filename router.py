@@ -0,0 +1,177 @@
+# router.py
+# 自动路由：角色选择「🤖 自动路由」时，开庭前按各模型近期的 p95 延迟、错误率、输出速度与费用分配模型
+# - 每个角色有延迟 SLA (config.ROLE_SLAS)，优先在满足 SLA 的模型中按延迟与费用综合打分
+# - 每场庭审可设费用上限 (config.TRIAL_BUDGET)，预计超支时依次把省钱最多的角色换成更便宜的候选
+# - 缺少 API Key、已熔断或近期错误率过高的模型不参与分配
+# 某个服务商变慢后它的 p95 超出陪审团的 SLA，陪审团这类扇出角色自然转到更快的模型上
+from config import (AVAILABLE_MODELS, ROLE_SLAS, TRIAL_BUDGET, ROUTER_MAX_ERROR_RATE, ROUTER_MIN_SAMPLES,
+                    get_model_config)
+from metrics import metrics, estimate_cost
+from resilience import health
+
+ROLE_LABELS = {"judge": "法官", "plaintiff": "原告律师", "defendant": "被告律师", "jury": "陪审团", "poll": "民调陪审员"}
+# 没有该角色的调用记录时，估算耗时与费用用的典型 token 数 (输入, 输出)
+TYPICAL_TOKENS = {
+    "plaintiff": (1500, 600),
+    "defendant": (1500, 600),
+    "jury": (1500, 250),
+    "poll": (1500, 60),
+    "judge": (3000, 900),
+}
+# 打分时延迟所占的权重，其余为费用；陪审团这类扇出角色更看重延迟
+LATENCY_WEIGHT = {"jury": 0.7, "poll": 0.7}
+DEFAULT_LATENCY_WEIGHT = 0.5
+
+
+def needs_routing(configs):
+    """build_configs 的结果中是否有选了自动路由（值为 None）的角色"""
+    return None in (configs["judge"], configs["plaintiff"], configs["defendant"]) or None in configs["jury"].values()
+
+
+def available_models():
+    """有 API Key 且没有熔断的模型: {名称: 配置}"""
+    pool = {}
+    for name in AVAILABLE_MODELS:
+        conf = get_model_config(name)
+        if conf["api_key"] and not health.is_down(conf):
+            pool[name] = conf
+    return pool
+
+
+def estimate(name, role):
+    """
+    某模型担任某角色的近期表现估计
+    该角色样本充足时直接用其 p95；否则用该模型全部调用的首字延迟与输出速度推算；完全没有记录时 p95 为 None
+    """
+    prompt_tokens, output_tokens = TYPICAL_TOKENS.get(role, TYPICAL_TOKENS["jury"])
+    stats = metrics.model_stats(name, role)
+    overall = metrics.model_stats(name)
+    result = {
+        "name": name,
+        "samples": stats["samples"] if stats else 0,
+        "error_rate": (overall or {}).get("error_rate", 0.0),
+        "tokens_per_sec": (overall or {}).get("tokens_per_sec"),
+        "p95": None,
+        "cost": estimate_cost(name, prompt_tokens, output_tokens),
+    }
+    if stats and stats["samples"] >= ROUTER_MIN_SAMPLES:
+        result["error_rate"] = stats["error_rate"]
+        result["p95"] = stats["p95"]
+        if stats["cost"] is not None:
+            result["cost"] = stats["cost"]
+    elif overall and overall["tokens_per_sec"]:
+        result["p95"] = (overall["ttft_p95"] or 0.0) + output_tokens / overall["tokens_per_sec"]
+    return result
+
+
+def rank(role, pool):
+    """候选模型按优先顺序排列：满足 SLA 的在前，其余按 p95 从低到高；错误率过高的模型剔除（除非全部都过高）"""
+    sla = ROLE_SLAS.get(role, ROLE_SLAS["jury"])
+    candidates = [estimate(name, role) for name in pool]
+    healthy = [c for c in candidates if c["error_rate"] <= ROUTER_MAX_ERROR_RATE]
+    candidates = healthy or candidates
+    # 没有记录的模型按 SLA 的一半估计，让它有机会被试用并积累数据
+    for c in candidates:
+        c["expected"] = c["p95"] if c["p95"] is not None else sla / 2
+        c["sla_ok"] = c["expected"] <= sla
+    max_cost = max((c["cost"] for c in candidates), default=0.0) or 1.0
+    weight = LATENCY_WEIGHT.get(role, DEFAULT_LATENCY_WEIGHT)
+    for c in candidates:
+        c["score"] = weight * c["expected"] / sla + (1 - weight) * c["cost"] / max_cost
+    ok = sorted((c for c in candidates if c["sla_ok"]), key=lambda c: c["score"])
+    slow = sorted((c for c in candidates if not c["sla_ok"]), key=lambda c: c["expected"])
+    return ok + slow
+
+
+def _reason(role, choice, downgraded):
+    sla = ROLE_SLAS.get(role, ROLE_SLAS["jury"])
+    if choice["p95"] is None:
+        text = "暂无调用记录，试用"
+    elif choice["sla_ok"]:
+        text = f"p95 {choice['p95']:.1f}s ≤ SLA {sla:g}s"
+    else:
+        text = f"所有模型都超出 SLA {sla:g}s，选延迟最低的（p95 {choice['p95']:.1f}s）"
+    if downgraded:
+        text += "；为控制预算改用较便宜的模型"
+    return text
+
+
+def route(configs, rounds=2, poll=False, jury_pipeline=False, budget=TRIAL_BUDGET):
+    """
+    为 configs 中选了自动路由的角色分配模型（陪审员按角色整体分配）
+    返回 (新的 configs, 路由记录)；没有任何可用模型时抛出 ValueError
+    """
+    jury_role = "poll" if poll else "jury"
+    auto_jurors = [pid for pid, conf in configs["jury"].items() if conf is None]
+    per_juror = rounds if jury_pipeline and not poll else 1  # 逐轮旁听时除最后一轮外每轮还有一次即时反应
+    counts = {"judge": 1, "plaintiff": rounds, "defendant": rounds, jury_role: len(auto_jurors) * per_juror}
+    roles = [r for r in ("judge", "plaintiff", "defendant") if configs[r] is None] + ([jury_role] if auto_jurors else [])
+
+    pool = available_models()
+    if roles and not pool:
+        raise ValueError("自动路由没有可用的模型：请检查 .env 中的 API Key，或稍后再试（服务商可能已熔断）")
+    ranked = {role: rank(role, pool) for role in roles}
+    choice = {role: 0 for role in roles}
+
+    # 手动指定的角色费用固定，只计入总额
+    fixed = sum(estimate_cost(configs[r]["name"], *TYPICAL_TOKENS[r]) * counts[r]
+                for r in ("judge", "plaintiff", "defendant") if configs[r] is not None)
+    fixed += sum(estimate_cost(conf["name"], *TYPICAL_TOKENS[jury_role]) * per_juror
+                 for conf in configs["jury"].values() if conf is not None)
+
+    def total():
+        return fixed + sum(ranked[r][choice[r]]["cost"] * counts[r] for r in roles)
+
+    downgraded = set()
+    if budget:
+        # 预计超支时，每次把省钱最多的角色换成排序中下一个更便宜的候选，直到不超支或无可再换
+        while total() > budget:
+            best = None
+            for r in roles:
+                current = ranked[r][choice[r]]["cost"]
+                for j in range(choice[r] + 1, len(ranked[r])):
+                    if ranked[r][j]["cost"] < current:
+                        saving = (current - ranked[r][j]["cost"]) * counts[r]
+                        if best is None or saving > best[0]:
+                            best = (saving, r, j)
+                        break
+            if best is None:
+                break
+            choice[best[1]] = best[2]
+            downgraded.add(best[1])
+
+    configs = {**configs, "jury": dict(configs["jury"])}
+    decisions = []
+    for role in roles:
+        picked = ranked[role][choice[role]]
+        if role == jury_role:
+            for pid in auto_jurors:
+                configs["jury"][pid] = pool[picked["name"]]
+        else:
+            configs[role] = pool[picked["name"]]
+        decisions.append({
+            "role": role,
+            "label": ROLE_LABELS[role],
+            "model": picked["name"],
+            "calls": counts[role],
+            "p95": picked["p95"],
+            "sla": ROLE_SLAS.get(role, ROLE_SLAS["jury"]),
+            "cost": picked["cost"],
+            "reason": _reason(role, picked, role in downgraded),
+        })
+    estimated = total()
+    return configs, {
+        "decisions": decisions,
+        "estimated_cost": estimated,
+        "budget": budget,
+        "over_budget": bool(budget) and estimated > budget,
+    }
+
+
+def describe(routing):
+    """路由记录的一行摘要，用于界面与批处理日志"""
+    parts = [f"{d['label']} → {d['model']}（{d['reason']}）" for d in routing["decisions"]]
+    text = "；".join(parts) + f"。预计费用 ¥{routing['estimated_cost']:.4f}"
+    if routing["budget"]:
+        text += f" / 上限 ¥{routing['budget']:g}" + ("，仍会超支" if routing["over_budget"] else "")
+    return text
@@ -0,0 +1,40 @@
+# store.py
+# 庭审结果的磁盘存储：每场庭审一个 JSON 文件，按庭审 id 读取
+# 页面刷新或重连后可以直接从这里重绘，无需再次调用模型
+import json
+import os
+import re
+from config import TRIAL_STORE_DIR
+
+_ID_RE = re.compile(r"^[0-9a-f]{1,32}$")
+
+
+class TrialStore:
+    def __init__(self, root=TRIAL_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, trial_id):
+        # id 来自 URL 参数，只接受十六进制，防止路径穿越
+        if not _ID_RE.match(trial_id or ""):
+            raise ValueError(f"非法的庭审编号: {trial_id}")
+        return os.path.join(self.root, f"{trial_id}.json")
+
+    def save(self, data):
+        path = self._path(data["id"])
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)  # 原子替换，读取方不会看到写了一半的文件
+
+    def load(self, trial_id):
+        try:
+            with open(self._path(trial_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+def get_store():
+    """未配置 CYBERGAVEL_TRIAL_STORE 时返回 None（只保存在会话内）"""
+    return TrialStore() if TRIAL_STORE_DIR else None
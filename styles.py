@@ -1,11 +1,20 @@
 # styles.py
+import hashlib
+import threading
+from collections import OrderedDict
 import streamlit as st
-import markdown  # 【必须确保安装：pip install markdown】
 from datetime import datetime  # 引入时间模块
 
+# Markdown 实例创建时要加载扩展，开销不小；每个线程复用一个实例，转换前 reset()
+_md_local = threading.local()
+# 已渲染内容的缓存：{内容哈希: HTML}，同一段文本在重绘、导出时不再重复转换
+_HTML_MEMO = OrderedDict()
+_HTML_MEMO_SIZE = 512
+_memo_lock = threading.Lock()
 
-def apply_custom_css():
-    st.markdown("""
+
+# 页面样式；导出的整场庭审 HTML (export.py) 也内嵌这份样式，卡片与页面上一致
+APP_CSS = """
     <style>
     /* 全局重置 */
     .stApp { background-color: #1a1a2e; color: #e0e0e0; }
@@ -138,12 +147,38 @@ def apply_custom_css():
     .verdict-content strong { color: #d35400; font-weight: bold; }
     .verdict-content p { margin-bottom: 1em; line-height: 1.8; font-size: 1.05rem; }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+
+def apply_custom_css():
+    st.markdown(APP_CSS, unsafe_allow_html=True)
+
+
+def _get_converter():
+    converter = getattr(_md_local, "converter", None)
+    if converter is None:
+        import markdown  # 【必须确保安装：pip install markdown】首次渲染时才导入
+        converter = markdown.Markdown(extensions=['nl2br', 'sane_lists'])
+        _md_local.converter = converter
+    return converter
 
 
 def md_to_html(text):
     if not text: return ""
-    return markdown.markdown(text, extensions=['nl2br', 'sane_lists'])
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    with _memo_lock:
+        html = _HTML_MEMO.get(key)
+        if html is not None:
+            _HTML_MEMO.move_to_end(key)
+            return html
+
+    html = _get_converter().reset().convert(text)
+
+    with _memo_lock:
+        _HTML_MEMO[key] = html
+        while len(_HTML_MEMO) > _HTML_MEMO_SIZE:
+            _HTML_MEMO.popitem(last=False)
+    return html
 
 
 # 【修改点 1】增加了 model_name 参数，并显示在右上角
@@ -202,8 +237,10 @@ def render_jury_card(name, avatar, content, model_name="AI"):
     """
 
 
-def render_verdict(content):
-    content_html = md_to_html(content)
+# content_html: 可传入已转换好的 HTML，页面与导出共用同一次渲染
+def render_verdict(content, content_html=None):
+    if content_html is None:
+        content_html = md_to_html(content)
     return f"""
     <div class="verdict-container">
         <div class="verdict-paper">
@@ -224,8 +261,9 @@ def render_verdict(content):
     """
 
 
-def get_verdict_download_html(content):
-    content_html = md_to_html(content)
+def get_verdict_download_html(content, content_html=None):
+    if content_html is None:
+        content_html = md_to_html(content)
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     return f"""
@@ -0,0 +1,28 @@
+# tests/test_cache.py
+# 缓存 key 包含按角色附加的请求参数：调整回复长度或 JSON 模式后不再返回旧的回复
+import utils
+from cache import make_key
+from config import get_model_config
+
+
+def test_options_change_key():
+    conf = get_model_config("DeepSeek-Chat")
+    plain = make_key(conf, "sys", "user", 0.7)
+    assert make_key(conf, "sys", "user", 0.7, {}) == plain
+    assert make_key(conf, "sys", "user", 0.7, {"max_tokens": 120}) != plain
+    assert make_key(conf, "sys", "user", 0.7, {"max_tokens": 120}) != make_key(conf, "sys", "user", 0.7, {"max_tokens": 200})
+
+
+def test_role_settings_change_key(monkeypatch):
+    monkeypatch.setattr(utils, "get_cache", lambda: object())
+    conf = get_model_config("DeepSeek-Chat")
+    _, poll = utils._cache_for(conf, "sys", "user", True, role="poll")
+    _, jury = utils._cache_for(conf, "sys", "user", True, role="jury")
+    assert poll != jury
+    monkeypatch.setattr(utils, "POLL_JSON_MODE", not utils.POLL_JSON_MODE)
+    assert utils._cache_for(conf, "sys", "user", True, role="poll")[1] != poll
+    monkeypatch.setattr(utils, "POLL_MAX_TOKENS", utils.POLL_MAX_TOKENS + 1)
+    assert utils._cache_for(conf, "sys", "user", True, role="poll")[1] != poll
+    _, clerk = utils._cache_for(conf, "sys", "user", True, role="clerk")
+    monkeypatch.setattr(utils, "CLERK_MAX_TOKENS", utils.CLERK_MAX_TOKENS + 1)
+    assert utils._cache_for(conf, "sys", "user", True, role="clerk")[1] != clerk
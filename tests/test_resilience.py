@@ -0,0 +1,53 @@
+# tests/test_resilience.py
+# 熔断只统计说明服务商故障的错误 (429/5xx/超时/连接错误)，客户端错误只切换候选模型
+import asyncio
+
+import pytest
+
+import resilience
+from config import CIRCUIT_FAILURES, get_model_config
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture
+def conf(monkeypatch):
+    monkeypatch.setattr(resilience, "health", resilience.ProviderHealth())
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt, e=None: 0)
+    return get_model_config("DeepSeek-Chat")
+
+
+def failing(status_code):
+    def call(conf, timeout):
+        raise StatusError(status_code)
+    return call
+
+
+def test_client_error_does_not_trip_breaker(conf):
+    for _ in range(CIRCUIT_FAILURES + 1):
+        with pytest.raises(StatusError):
+            resilience.call_with_policy(failing(400), conf)
+    assert not resilience.health.is_down(conf)
+
+
+def test_client_error_does_not_trip_breaker_async(conf):
+    def acall(status_code):
+        async def call(conf, timeout):
+            raise StatusError(status_code)
+        return call
+
+    for _ in range(CIRCUIT_FAILURES + 1):
+        with pytest.raises(StatusError):
+            asyncio.run(resilience.acall_with_policy(acall(401), conf))
+    assert not resilience.health.is_down(conf)
+
+
+def test_server_error_trips_breaker(conf):
+    for _ in range(CIRCUIT_FAILURES):
+        with pytest.raises(StatusError):
+            resilience.call_with_policy(failing(503), conf)
+    assert resilience.health.is_down(conf)
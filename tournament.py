@@ -0,0 +1,319 @@
+# tournament.py
+# 模型锦标赛：AVAILABLE_MODELS 中的模型两两对阵（原告、被告各打一次），在一组话题上循环赛
+# 法官与陪审团固定，由判决书的【判决结果】决定胜负；比赛并发进行，服务商配额由 ratelimit 统一控制
+# 每场结束立即追加写入结果 JSONL，并按完成顺序增量更新 Elo；中断后用同一个结果文件重跑，已完成的比赛不会重复
+#
+# 用法示例:
+#   python tournament.py topics.txt -o tournament.jsonl --judge DeepSeek-Chat --jury "Qwen-Turbo " --workers 4
+#   python tournament.py --report tournament.jsonl   # 只根据已有结果打印排行榜
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import permutations
+from court import build_configs, verdict_winner
+from archive import get_archive
+from batch import load_topics, check_keys, run_one
+from config import AVAILABLE_MODELS, get_model_config
+
+model_names = list(AVAILABLE_MODELS.keys())
+
+ELO_BASE = 1500.0
+ELO_K = 32.0
+# Bradley-Terry 拟合时每对模型之间各加的虚拟平局数，避免全胜/全负的模型得分发散
+BT_PRIOR = 0.5
+BT_ITERATIONS = 200
+
+
+def match_key(plaintiff, defendant, topic):
+    return f"{plaintiff.strip()} | {defendant.strip()} | {topic}"
+
+
+def schedule(models, topics):
+    """每个话题上所有有序对阵 (原告模型, 被告模型)；按话题依次排列，中断时前面的话题结果完整"""
+    return [(plaintiff, defendant, topic) for topic in topics for plaintiff, defendant in permutations(models, 2)]
+
+
+def load_results(path):
+    """读取已有结果；出错的比赛不算完成，重跑时会再次进行"""
+    results = []
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    results.append(json.loads(line))
+    return results
+
+
+def completed_keys(results):
+    return {r["match"] for r in results if r["status"] == "done"}
+
+
+def latest_results(results):
+    """每场比赛只保留最后一行（出错后重跑的比赛以重跑结果为准），按这些行在文件中的顺序排列"""
+    latest = {}
+    for r in results:
+        latest.pop(r["match"], None)
+        latest[r["match"]] = r
+    return list(latest.values())
+
+
+# ==========================================
+# 评分
+# ==========================================
+def score_of(result):
+    """原告模型的得分：胜 1、负 0；判决书没有写明胜负时返回 None（不计入评分）"""
+    if result.get("status") != "done" or result.get("winner") is None:
+        return None
+    return 1.0 if result["winner"] == "plaintiff" else 0.0
+
+
+class Elo:
+    """按比赛完成顺序增量更新的 Elo 评分"""
+
+    def __init__(self, k=ELO_K, base=ELO_BASE):
+        self.k = k
+        self.base = base
+        self.ratings = {}
+
+    def expected(self, a, b):
+        return 1 / (1 + 10 ** ((self.rating(b) - self.rating(a)) / 400))
+
+    def rating(self, model):
+        return self.ratings.get(model, self.base)
+
+    def update(self, a, b, score_a):
+        expected_a = self.expected(a, b)
+        self.ratings[a] = self.rating(a) + self.k * (score_a - expected_a)
+        self.ratings[b] = self.rating(b) - self.k * (score_a - expected_a)
+
+
+def bradley_terry(results, models):
+    """
+    Bradley-Terry 强度（MM 迭代），换算成与 Elo 同一刻度的分数：平均水平为 1500，相差 400 分约为 10:1 的胜率比
+    与 Elo 不同，结果与比赛完成的顺序无关
+    """
+    if not models:
+        return {}
+    wins = {a: {b: BT_PRIOR for b in models if b != a} for a in models}
+    for r in results:
+        score = score_of(r)
+        if score is None or r["plaintiff_model"] not in wins or r["defendant_model"] not in wins:
+            continue
+        a, b = r["plaintiff_model"], r["defendant_model"]
+        wins[a][b] += score
+        wins[b][a] += 1 - score
+    strength = {m: 1.0 for m in models}
+    for _ in range(BT_ITERATIONS):
+        updated = {}
+        for a in models:
+            total_wins = sum(wins[a].values())
+            denominator = sum((wins[a][b] + wins[b][a]) / (strength[a] + strength[b]) for b in wins[a])
+            updated[a] = total_wins / denominator if denominator else strength[a]
+        # 归一化到几何平均为 1
+        mean_log = sum(math.log(s) for s in updated.values()) / len(updated)
+        strength = {m: s / math.exp(mean_log) for m, s in updated.items()}
+    return {m: ELO_BASE + 400 * math.log10(s) for m, s in strength.items()}
+
+
+def standings(results, models=None):
+    """
+    排行榜：按 Bradley-Terry 分数排序，含 Elo（按结果文件顺序重放）、胜负场数与分执原告/被告时的胜率
+    同一场比赛有多行时只计最后一行
+    """
+    results = latest_results(results)
+    if models is None:
+        models = sorted({r["plaintiff_model"] for r in results} | {r["defendant_model"] for r in results})
+    table = {m: {"model": m, "played": 0, "wins": 0, "losses": 0, "undecided": 0, "errors": 0,
+                 "plaintiff_wins": 0, "plaintiff_played": 0, "defendant_wins": 0, "defendant_played": 0,
+                 "cost": 0.0} for m in models}
+    elo = Elo()
+    for r in results:
+        a, b = r["plaintiff_model"], r["defendant_model"]
+        if a not in table or b not in table:
+            continue
+        for m in (a, b):
+            table[m]["cost"] += r.get("cost", 0.0) / 2
+        if r["status"] != "done":
+            table[a]["errors"] += 1
+            table[b]["errors"] += 1
+            continue
+        score = score_of(r)
+        if score is None:
+            table[a]["undecided"] += 1
+            table[b]["undecided"] += 1
+            continue
+        elo.update(a, b, score)
+        winner, loser = (a, b) if score else (b, a)
+        table[winner]["wins"] += 1
+        table[loser]["losses"] += 1
+        table[a]["plaintiff_played"] += 1
+        table[a]["plaintiff_wins"] += int(score)
+        table[b]["defendant_played"] += 1
+        table[b]["defendant_wins"] += int(not score)
+        for m in (a, b):
+            table[m]["played"] += 1
+    bt = bradley_terry(results, models)
+    rows = []
+    for m in models:
+        row = table[m]
+        row["elo"] = elo.rating(m)
+        row["bt"] = bt[m]
+        row["win_rate"] = row["wins"] / row["played"] if row["played"] else 0.0
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["bt"], reverse=True)
+
+
+def format_standings(rows):
+    lines = [f"{'#':<3}{'模型':<24}{'BT':>7}{'Elo':>7}{'胜':>5}{'负':>5}{'未判':>5}{'出错':>5}{'胜率':>7}"
+             f"{'执原告胜率':>11}{'执被告胜率':>11}{'费用¥':>9}"]
+    for i, row in enumerate(rows, start=1):
+        p_rate = row["plaintiff_wins"] / row["plaintiff_played"] if row["plaintiff_played"] else 0.0
+        d_rate = row["defendant_wins"] / row["defendant_played"] if row["defendant_played"] else 0.0
+        lines.append(f"{i:<3}{row['model'].strip():<24}{row['bt']:>7.0f}{row['elo']:>7.0f}{row['wins']:>5}"
+                     f"{row['losses']:>5}{row['undecided']:>5}{row['errors']:>5}{row['win_rate']:>7.0%}"
+                     f"{p_rate:>11.0%}{d_rate:>11.0%}{row['cost']:>9.4f}")
+    return "\n".join(lines)
+
+
+# ==========================================
+# 比赛
+# ==========================================
+def play(plaintiff, defendant, topic, judge, jury, rounds, concurrent_jury=True, archive=None):
+    """进行一场比赛，返回写入结果文件的一行（完整庭审另存到档案库）"""
+    configs = build_configs(judge, plaintiff, defendant, jury)
+    trial = run_one(topic, configs, rounds, concurrent_jury, archive=archive)
+    return {
+        "match": match_key(plaintiff, defendant, topic),
+        "plaintiff_model": plaintiff,
+        "defendant_model": defendant,
+        "topic": topic,
+        "judge_model": judge,
+        "jury_model": jury,
+        "rounds": rounds,
+        "trial": trial["id"],
+        "status": trial["status"],
+        "error": trial["error"],
+        "winner": verdict_winner(trial["verdict"]),
+        "cost": sum(call["cost"] for call in trial["calls"]),
+        "duration": trial["timings"].get("total", 0.0),
+        "finished": time.time(),
+    }
+
+
+def run_tournament(matches, judge, jury, rounds=1, workers=4, concurrent_jury=True, out=None, on_done=None,
+                   archive=None):
+    """
+    并发进行 matches 中的比赛，每场结束立即写入 out 一行 JSON 并回调 on_done(done, total, result)
+    中断 (Ctrl+C) 时不再开始新的比赛，等进行中的几场结束并照常写入（它们已产生费用），下次运行会跳过已写入的比赛
+    """
+    lock = threading.Lock()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    futures = [pool.submit(play, p, d, t, judge, jury, rounds, concurrent_jury, archive) for p, d, t in matches]
+    reported = set()
+    wait = True
+
+    def report(future):
+        reported.add(future)
+        result = future.result()
+        with lock:
+            if out is not None:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+        if on_done:
+            on_done(len(reported), len(matches), result)
+
+    try:
+        for future in as_completed(futures):
+            report(future)
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        running = [future for future in futures if future not in reported and not future.cancelled()]
+        if running:
+            print(f"已中断：等待进行中的 {len(running)} 场比赛结束并写入结果（再次 Ctrl+C 放弃）", file=sys.stderr)
+            try:
+                for future in as_completed(running):
+                    report(future)
+            except KeyboardInterrupt:
+                wait = False
+        raise
+    finally:
+        pool.shutdown(wait=wait, cancel_futures=True)
+        if archive is not None:
+            archive.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CyberGavel 模型锦标赛：两两对阵的循环赛，Elo / Bradley-Terry 排名")
+    parser.add_argument("topics", nargs="?", help="话题文件 (每行一个话题，或含 topic 字段的 .jsonl)")
+    parser.add_argument("-o", "--output", default="tournament.jsonl", help="结果 JSONL；已有的结果会被跳过（断点续跑）")
+    parser.add_argument("--models", nargs="+", choices=model_names, help="参赛模型，默认为所有配置了 API Key 的模型")
+    parser.add_argument("--judge", default=model_names[0], choices=model_names, help="固定的法官模型")
+    parser.add_argument("--jury", default=model_names[2], choices=model_names, help="固定的陪审团模型 (所有陪审员共用)")
+    parser.add_argument("--rounds", type=int, default=1, help="每场比赛的辩论回合数")
+    parser.add_argument("--workers", type=int, default=4, help="同时进行的比赛数")
+    parser.add_argument("--sequential-jury", action="store_true", help="陪审团逐个发言而不是并发合议")
+    parser.add_argument("--report", metavar="RESULTS", help="不比赛，只根据已有结果文件打印排行榜")
+    args = parser.parse_args(argv)
+
+    if args.report:
+        print(format_standings(standings(load_results(args.report))))
+        return
+    if not args.topics:
+        parser.error("需要话题文件（或使用 --report 查看已有结果）")
+
+    models = args.models or [name for name in model_names if get_model_config(name)["api_key"]]
+    if len(models) < 2:
+        parser.error("至少需要两个配置了 API Key 的参赛模型")
+    try:
+        for name in models:
+            check_keys(build_configs(args.judge, name, name, args.jury))
+    except ValueError as e:
+        parser.error(str(e))
+
+    previous = load_results(args.output)
+    finished = completed_keys(previous)
+    all_matches = schedule(models, load_topics(args.topics))
+    matches = [m for m in all_matches if match_key(*m) not in finished]
+    print(f"共 {len(all_matches)} 场比赛，已完成 {len(all_matches) - len(matches)} 场，本次进行 {len(matches)} 场",
+          file=sys.stderr)
+
+    # Elo 从已有结果开始，随每场比赛增量更新
+    elo = Elo()
+    for r in previous:
+        if score_of(r) is not None:
+            elo.update(r["plaintiff_model"], r["defendant_model"], score_of(r))
+    results = list(previous)
+    start = time.perf_counter()
+
+    def on_done(done, total, result):
+        results.append(result)
+        score = score_of(result)
+        if score is not None:
+            elo.update(result["plaintiff_model"], result["defendant_model"], score)
+        flag = "❌" if result["status"] != "done" else {"plaintiff": "🦁", "defendant": "🦈"}.get(result["winner"], "❔")
+        leader = max(models, key=elo.rating)
+        print(f"[{done}/{total}] {flag} {result['plaintiff_model'].strip()} vs {result['defendant_model'].strip()}"
+              f" · {result['topic']} ({result['duration']:.1f}s) 领先: {leader.strip()} {elo.rating(leader):.0f}",
+              file=sys.stderr)
+
+    out = open(args.output, "a", encoding="utf-8")
+    try:
+        run_tournament(matches, args.judge, args.jury, args.rounds, args.workers, not args.sequential_jury, out,
+                       on_done, archive=get_archive())
+    except KeyboardInterrupt:
+        print("已中断：已完成的比赛已写入结果文件，重新运行同一命令即可继续", file=sys.stderr)
+    finally:
+        out.close()
+
+    print(f"用时 {time.perf_counter() - start:.1f}s\n", file=sys.stderr)
+    print(format_standings(standings(results, models)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# transcript.py
+# 结构化庭审记录：按发言保存，按模型家族估算 token，
+# 为陪审团、法官等角色生成不超过 token 预算的记录视图（只保留完整发言，优先保留最近的）
+import re
+
+ROLE_LABELS = {"plaintiff": "原告", "defendant": "被告"}
+
+# 各模型家族的 token 估算系数：(每个中日韩字符的 token 数, 每个其他字符的 token 数)
+# 这些服务商没有可离线使用的公开分词器，这里取经验近似值，只用于控制提示词规模
+TOKEN_RATIOS = {
+    "deepseek": (0.6, 0.3),
+    "qwen": (0.7, 0.3),
+    "kimi": (0.7, 0.3),
+    "moonshot": (0.7, 0.3),
+    "glm": (0.7, 0.3),
+}
+DEFAULT_RATIO = (1.0, 0.3)  # 未知模型按偏保守的系数估算
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_SENTENCE_END_RE = re.compile(r"[。！？!?\n]")
+
+# 摘要中每段早期发言保留的字数
+SUMMARY_CHARS = 40
+
+
+def model_family(model):
+    model = (model or "").lower()
+    for family in TOKEN_RATIOS:
+        if model.startswith(family):
+            return family
+    return "default"
+
+
+def count_tokens(text, model=None):
+    """按模型家族估算 token 数"""
+    cjk_ratio, other_ratio = TOKEN_RATIOS.get(model_family(model), DEFAULT_RATIO)
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * cjk_ratio + (len(text) - cjk) * other_ratio) + 1
+
+
+def _brief(content):
+    """取第一句话作为摘要"""
+    match = _SENTENCE_END_RE.search(content)
+    first = content[:match.start()] if match else content
+    first = first.strip().lstrip("#*- ").strip()
+    return first[:SUMMARY_CHARS] + ("…" if len(first) > SUMMARY_CHARS else "")
+
+
+class Transcript:
+    def __init__(self, topic):
+        self.topic = topic
+        self.turns = []  # {"role", "round", "content", "text", "tokens": {家族: token 数}}
+
+    def add(self, role, round_idx, content):
+        self.turns.append({
+            "role": role,
+            "round": round_idx,
+            "content": content,
+            "text": f"[{ROLE_LABELS[role]}]: {content}",
+            "tokens": {},
+        })
+
+    @property
+    def header(self):
+        return f"案件：{self.topic}"
+
+    def text(self):
+        """完整记录，与原来的字符串拼接格式一致"""
+        return "\n".join([self.header] + [turn["text"] for turn in self.turns])
+
+    def _turn_tokens(self, turn, model):
+        family = model_family(model)
+        if family not in turn["tokens"]:
+            turn["tokens"][family] = count_tokens(turn["text"], model)
+        return turn["tokens"][family]
+
+    def _upto(self, upto_round):
+        # 另一个线程可能正在追加下一轮的发言，按轮次截断保证视图稳定
+        return self.turns if upto_round is None else [turn for turn in self.turns if turn["round"] <= upto_round]
+
+    def view(self, budget, model=None, summary=True, round_idx=None, upto_round=None):
+        """
+        生成不超过 budget 个 token 的记录视图
+        从最近的发言往前取完整发言；放不下的早期发言可选地压缩成一行摘要
+        round_idx: 只看某一轮的发言
+        upto_round: 只看截至某一轮（含）的发言
+        """
+        turns = self._upto(upto_round)
+        if round_idx is not None:
+            turns = [turn for turn in turns if turn["round"] == round_idx]
+        remaining = budget - count_tokens(self.header, model)
+        kept = []
+        for turn in reversed(turns):
+            cost = self._turn_tokens(turn, model) + 1
+            if cost > remaining:
+                break
+            kept.append(turn["text"])
+            remaining -= cost
+
+        if not kept and turns:
+            # 连最近一段都放不下时，截取它的结尾，保证视图不为空且不超预算
+            last = turns[-1]["text"]
+            chars = max(int(len(last) * remaining / self._turn_tokens(turns[-1], model)), 0)
+            kept.append("…" + last[len(last) - chars:])
+            remaining = 0
+
+        dropped = turns[:len(turns) - len(kept)]
+        lines = []
+        if dropped and summary:
+            # 摘要同样受预算约束，优先保留离现在较近的发言
+            items = []
+            remaining -= count_tokens("（此前 00 段发言摘要：）", model)
+            for turn in reversed(dropped):
+                item = f"[{ROLE_LABELS[turn['role']]}·第{turn['round'] + 1}轮] {_brief(turn['content'])}"
+                cost = count_tokens(item, model) + 1
+                if cost > remaining:
+                    break
+                items.append(item)
+                remaining -= cost
+            if items:
+                lines.append(f"（此前 {len(dropped)} 段发言摘要：{'；'.join(reversed(items))}）")
+
+        return "\n".join([self.header] + lines + list(reversed(kept)))
+
+    def history(self, budget, model=None, upto_round=None):
+        """
+        前缀缓存布局使用的多条消息：案件一条、每段发言各一条，按发言顺序只增不改
+        同一场庭审中各角色、各轮次拿到的历史消息逐字节相同，服务端可以复用已缓存的前缀
+        超出预算时退回 view() 生成的单条消息（不再能复用前缀，但保证不超预算）
+        """
+        turns = self._upto(upto_round)
+        total = count_tokens(self.header, model) + sum(self._turn_tokens(turn, model) + 1 for turn in turns)
+        if total > budget:
+            return [{"role": "user", "content": self.view(budget, model, upto_round=upto_round)}]
+        return [{"role": "user", "content": self.header}] + [
+            {"role": "user", "content": f"【{ROLE_LABELS[turn['role']]}·第{turn['round'] + 1}轮】\n{turn['content']}"}
+            for turn in turns
+        ]
+
+    def tokens(self, model=None):
+        return count_tokens(self.header, model) + sum(self._turn_tokens(turn, model) + 1 for turn in self.turns)
\ No newline at end of file
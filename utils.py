@@ -1,33 +1,417 @@
 # utils.py
-from openai import OpenAI
+import sys
+import threading
+import time
+from cache import get_cache, make_key
+from resilience import call_with_policy, acall_with_policy
+from transcript import count_tokens
+import ratelimit
+from config import (HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY,
+                    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, EST_COMPLETION_TOKENS, STREAM_USAGE,
+                    POLL_JSON_MODE, POLL_MAX_TOKENS, CLERK_MAX_TOKENS)
+
+# openai (约 0.6s) 与 httpx 在首次调用模型时才导入，页面冷启动与只改侧边栏的 rerun 不必为它们买单
+# 进程级客户端注册表：{(base_url, api_key, http2): OpenAI}
+# Streamlit 的各个会话和每次 rerun 都运行在同一进程中，因此可以共享连接池
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+# asyncio 引擎使用的 AsyncOpenAI 客户端；它们绑定在 async_court 的事件循环上，只能在该循环中使用
+_ACLIENTS = {}
+
+TEMPERATURE = 0.7
+# 错误信息前缀：以此开头的回复不会被缓存
+ERROR_PREFIX = "🚨 **Error"
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_http_client(http2=False, is_async=False):
+    """创建带连接池与超时设置的 httpx 客户端"""
+    import httpx
+    return (httpx.AsyncClient if is_async else httpx.Client)(
+        http2=http2 and _http2_available(),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
 
 def get_client(model_conf):
-    """创建 OpenAI Client"""
+    """获取（或创建）与该服务商共享的 OpenAI Client"""
     if not model_conf or not model_conf.get("api_key"):
         raise ValueError(f"⚠️ 模型 '{model_conf.get('name')}' 未配置 API Key。\n请在 .env 文件中检查 {model_conf.get('env_key_name')}")
 
-    return OpenAI(
-        api_key=model_conf["api_key"],
-        base_url=model_conf["base_url"]
+    key = (model_conf["base_url"], model_conf["api_key"], bool(model_conf.get("http2")))
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(
+                    api_key=model_conf["api_key"],
+                    base_url=model_conf["base_url"],
+                    http_client=_build_http_client(key[2]),
+                    max_retries=0,  # 重试由 resilience.call_with_policy 统一处理
+                )
+                _CLIENTS[key] = client
+    return client
+
+
+def get_async_client(model_conf):
+    """get_client 的 AsyncOpenAI 版本（只在事件循环线程中调用，无需加锁）"""
+    if not model_conf or not model_conf.get("api_key"):
+        raise ValueError(f"⚠️ 模型 '{model_conf.get('name')}' 未配置 API Key。\n请在 .env 文件中检查 {model_conf.get('env_key_name')}")
+
+    key = (model_conf["base_url"], model_conf["api_key"], bool(model_conf.get("http2")))
+    client = _ACLIENTS.get(key)
+    if client is None:
+        from openai import AsyncOpenAI
+        client = _ACLIENTS[key] = AsyncOpenAI(
+            api_key=model_conf["api_key"],
+            base_url=model_conf["base_url"],
+            http_client=_build_http_client(key[2], is_async=True),
+            max_retries=0,
+        )
+    return client
+
+
+def close_clients():
+    """关闭所有共享客户端（进程退出或测试时使用）"""
+    with _CLIENTS_LOCK:
+        for client in _CLIENTS.values():
+            client.close()
+        _CLIENTS.clear()
+
+
+def build_messages(system_prompt, user_content):
+    """user_content 为字符串时是一条用户消息；为消息列表时（前缀缓存布局）原样接在系统提示词之后"""
+    if isinstance(user_content, list):
+        return [{"role": "system", "content": system_prompt}, *user_content]
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content}
+    ]
+
+
+def format_error(model_conf, e):
+    return f"{ERROR_PREFIX} ({model_conf.get('name')}):** {str(e)}"
+
+
+def is_error(content):
+    return content.startswith(ERROR_PREFIX)
+
+
+def _cache_for(model_conf, system_prompt, user_content, use_cache, role=None):
+    """返回 (cache, key)；未开启缓存或调用方要求绕过时返回 (None, None)"""
+    cache = get_cache() if use_cache else None
+    if cache is None:
+        return None, None
+    return cache, make_key(model_conf, system_prompt, user_content, TEMPERATURE, _request_options(role))
+
+
+def _request_options(role):
+    """按角色附加的请求参数：民调陪审员 (role="poll") 要求 JSON 输出并限制回复长度，书记员 (role="clerk") 限制要点长度"""
+    if role == "clerk":
+        return {"max_tokens": CLERK_MAX_TOKENS}
+    if role != "poll":
+        return {}
+    options = {"max_tokens": POLL_MAX_TOKENS}
+    if POLL_JSON_MODE:
+        options["response_format"] = {"type": "json_object"}
+    return options
+
+
+def _create(model_conf, messages, timeout, stream=False, options=None):
+    """单次请求，不做任何容错处理"""
+    client = get_client(model_conf).with_options(timeout=timeout)
+    extra = {"stream_options": {"include_usage": True}} if stream and STREAM_USAGE else {}
+    return client.chat.completions.create(
+        model=model_conf["model"],
+        messages=messages,
+        temperature=TEMPERATURE,
+        stream=stream,
+        **extra,
+        **(options or {})
     )
 
-def get_ai_response(system_prompt, user_content, model_conf):
+
+def _record_usage(stats, usage):
+    """记录 token 用量；cached_tokens 为命中服务端前缀缓存的输入 token"""
+    if stats is None or usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)  # DeepSeek 的字段名
+    stats["prompt_tokens"] = usage.prompt_tokens or 0
+    stats["completion_tokens"] = usage.completion_tokens or 0
+    stats["cached_tokens"] = cached or 0
+
+
+def _acquire(model_conf, messages, owner, timeout, stats):
+    """在该账号的限流器上排队，排队时间计入本次调用的时限"""
+    tokens = sum(count_tokens(m["content"], model_conf["model"]) for m in messages) + EST_COMPLETION_TOKENS
+    slot = ratelimit.acquire(model_conf, tokens, owner, timeout)
+    if stats is not None:
+        stats["queue_wait"] = stats.get("queue_wait", 0.0) + slot.waited
+    return slot
+
+
+def _record_answer(stats, model_conf, answered):
+    """记录实际应答的模型（切换到备用模型时与请求的模型不同）"""
+    if stats is not None:
+        stats["model"] = answered["name"]
+        if answered["name"] != model_conf["name"]:
+            stats["failover_from"] = model_conf["name"]
+
+
+def get_ai_response(system_prompt, user_content, model_conf, use_cache=True, stats=None, role=None, owner=None):
     """
     通用调用函数
     model_conf: 包含 api_key, base_url, model, name
+    use_cache: 开启缓存时是否允许读写缓存，False 表示强制重新采样
+    stats: 可选字典，写入实际应答的模型名称 model (以及切换前的 failover_from)、token 用量与排队时间
+    role: 调用方角色，决定总时限
+    owner: 调用方标识（如庭审编号），限流排队时在不同调用方之间轮转
     """
+    cache, key = _cache_for(model_conf, system_prompt, user_content, use_cache, role)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            _record_answer(stats, model_conf, model_conf)
+            if stats is not None:
+                stats["cache_hit"] = True
+            return cached
+
+    messages = build_messages(system_prompt, user_content)
+
+    def call(conf, timeout, sent=None):
+        slot = _acquire(conf, messages, owner, timeout, stats)
+        if sent is not None:
+            sent()
+        try:
+            response = _create(conf, messages, max(timeout - slot.waited, 0.1), options=_request_options(role))
+        except Exception as e:
+            slot.release(e)
+            raise
+        slot.release()
+        return response
+
     try:
-        client = get_client(model_conf)
-
-        response = client.chat.completions.create(
-            model=model_conf["model"],
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
-            temperature=0.7
-        )
-        return response.choices[0].message.content
+        response, answered = call_with_policy(call, model_conf, role, hedge=True)
     except Exception as e:
         # 返回错误信息而不是崩溃，方便前端展示
-        return f"🚨 **Error ({model_conf.get('name')}):** {str(e)}"
\ No newline at end of file
+        return format_error(model_conf, e)
+
+    content = response.choices[0].message.content
+    _record_answer(stats, model_conf, answered)
+    _record_usage(stats, getattr(response, "usage", None))
+    # 备用模型的回复不写入首选模型的缓存
+    if cache is not None and content and answered is model_conf:
+        cache.put(key, content)
+    return content
+
+
+def stream_ai_response(system_prompt, user_content, model_conf, stats=None, use_cache=True, role=None, owner=None):
+    """
+    流式调用函数，逐段 yield 模型输出的增量文本
+    stats: 可选字典，结束后写入 ttft (首字延迟) 与 total (总耗时)，单位秒，以及实际应答的模型与 token 用量
+    use_cache: 同 get_ai_response；命中缓存时一次性输出完整内容
+    重试与切换备用模型只发生在建立连接阶段，开始输出后中断则以错误文本结尾
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    cache, key = _cache_for(model_conf, system_prompt, user_content, use_cache, role)
+    try:
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                first_token_at = time.perf_counter()
+                _record_answer(stats, model_conf, model_conf)
+                if stats is not None:
+                    stats["cache_hit"] = True
+                yield cached
+                return
+
+        messages = build_messages(system_prompt, user_content)
+
+        def open_stream(conf, timeout):
+            slot = _acquire(conf, messages, owner, timeout, stats)
+            try:
+                return _create(conf, messages, max(timeout - slot.waited, 0.1), stream=True), slot
+            except Exception as e:
+                slot.release(e)
+                raise
+
+        (stream, slot), answered = call_with_policy(open_stream, model_conf, role)
+        _record_answer(stats, model_conf, answered)
+
+        parts = []
+        try:
+            for chunk in stream:
+                # include_usage 时，最后一个分片没有 choices，只带 usage
+                _record_usage(stats, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(delta)
+                yield delta
+        finally:
+            # 整个流读完（或中断）才归还并发名额
+            slot.release(sys.exc_info()[1])
+        # 只缓存首选模型完整结束的回复；中途出错会进入 except，不会写入缓存
+        if cache is not None and parts and answered is model_conf:
+            cache.put(key, "".join(parts))
+    except Exception as e:
+        # 与 get_ai_response 保持一致：错误以文本形式输出
+        yield format_error(model_conf, e)
+    finally:
+        if stats is not None:
+            end = time.perf_counter()
+            stats["ttft"] = (first_token_at or end) - start
+            stats["total"] = end - start
+
+
+# ==========================================
+# asyncio 版本（供 async_court.AsyncTrial 使用）
+# 行为与同步版本一致；区别在于任务被取消时，进行中的 HTTP 请求会随之中断
+# ==========================================
+async def _acreate(model_conf, messages, timeout, stream=False, options=None):
+    client = get_async_client(model_conf).with_options(timeout=timeout)
+    extra = {"stream_options": {"include_usage": True}} if stream and STREAM_USAGE else {}
+    return await client.chat.completions.create(
+        model=model_conf["model"],
+        messages=messages,
+        temperature=TEMPERATURE,
+        stream=stream,
+        **extra,
+        **(options or {})
+    )
+
+
+async def _aacquire(model_conf, messages, owner, timeout, stats):
+    tokens = sum(count_tokens(m["content"], model_conf["model"]) for m in messages) + EST_COMPLETION_TOKENS
+    slot = await ratelimit.aacquire(model_conf, tokens, owner, timeout)
+    if stats is not None:
+        stats["queue_wait"] = stats.get("queue_wait", 0.0) + slot.waited
+    return slot
+
+
+async def aget_ai_response(system_prompt, user_content, model_conf, use_cache=True, stats=None, role=None, owner=None):
+    """get_ai_response 的 asyncio 版本"""
+    cache, key = _cache_for(model_conf, system_prompt, user_content, use_cache, role)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            _record_answer(stats, model_conf, model_conf)
+            if stats is not None:
+                stats["cache_hit"] = True
+            return cached
+
+    messages = build_messages(system_prompt, user_content)
+
+    async def call(conf, timeout, sent=None):
+        slot = await _aacquire(conf, messages, owner, timeout, stats)
+        if sent is not None:
+            sent()
+        try:
+            response = await _acreate(conf, messages, max(timeout - slot.waited, 0.1),
+                                      options=_request_options(role))
+        except BaseException as e:  # 包括取消
+            slot.release(e)
+            raise
+        slot.release()
+        return response
+
+    try:
+        response, answered = await acall_with_policy(call, model_conf, role, hedge=True)
+    except Exception as e:
+        return format_error(model_conf, e)
+
+    content = response.choices[0].message.content
+    _record_answer(stats, model_conf, answered)
+    _record_usage(stats, getattr(response, "usage", None))
+    if cache is not None and content and answered is model_conf:
+        cache.put(key, content)
+    return content
+
+
+async def astream_ai_response(system_prompt, user_content, model_conf, on_delta, stats=None, use_cache=True,
+                              role=None, owner=None):
+    """
+    stream_ai_response 的 asyncio 版本：每收到一段增量文本调用 on_delta(delta)，返回完整文本
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    parts = []
+    cache, key = _cache_for(model_conf, system_prompt, user_content, use_cache, role)
+    try:
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                first_token_at = time.perf_counter()
+                _record_answer(stats, model_conf, model_conf)
+                if stats is not None:
+                    stats["cache_hit"] = True
+                on_delta(cached)
+                return cached
+
+        messages = build_messages(system_prompt, user_content)
+
+        async def open_stream(conf, timeout):
+            slot = await _aacquire(conf, messages, owner, timeout, stats)
+            try:
+                return await _acreate(conf, messages, max(timeout - slot.waited, 0.1), stream=True), slot
+            except BaseException as e:
+                slot.release(e)
+                raise
+
+        (stream, slot), answered = await acall_with_policy(open_stream, model_conf, role)
+        _record_answer(stats, model_conf, answered)
+
+        error = None
+        try:
+            async for chunk in stream:
+                _record_usage(stats, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(delta)
+                on_delta(delta)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            slot.release(error)
+            await stream.close()  # 被取消时关闭连接，服务端随即停止生成
+        if cache is not None and parts and answered is model_conf:
+            cache.put(key, "".join(parts))
+        return "".join(parts)
+    except Exception as e:
+        # 与同步版本一致：错误文本接在已输出的内容之后
+        text = format_error(model_conf, e)
+        on_delta(text)
+        return "".join(parts) + text
+    finally:
+        if stats is not None:
+            end = time.perf_counter()
+            stats["ttft"] = (first_token_at or end) - start
+            stats["total"] = end - start
\ No newline at end of file